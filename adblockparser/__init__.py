@@ -1,3 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
-from .parser import AdblockRules, AdblockRule, AdblockParsingError
+from .parser import (
+    AdblockRules, AdblockRule, AdblockParsingError, RequestOptions, Request,
+    MatchResult
+)
+from .serialization import AdblockCacheError
+from .filterlist import FilterList, AdblockChecksumError
+from .parallel import ParallelAdblockRules
+from .mapped import MappedAdblockRules
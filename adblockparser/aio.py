@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio support (Python 3.5+).
+
+Matching runs in an executor, so a slow regex or a cold rule never
+blocks the event loop. Concurrent ``should_block`` calls are collected
+into batches which are checked using ``AdblockRules.should_block_many``.
+"""
+from __future__ import absolute_import
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from adblockparser.parser import AdblockRules
+from adblockparser import parallel
+
+
+class AsyncMatcher(object):
+    """
+    Checks URLs against ``rules`` (an AdblockRules instance) without
+    blocking the event loop.
+
+    ``should_block`` calls made during an iteration of the event loop
+    are sent to the executor as a single batch; a batch is also sent as soon
+    as it has ``max_batch_size`` URLs.
+
+    ``executor`` is a ``concurrent.futures`` executor which runs
+    matching; by default the event loop's default executor (a thread pool)
+    is used. Create rules with ``thread_safe=True`` when they are checked
+    from several threads. Pass ``processes`` to use a pool of worker
+    processes instead (Python 3.7+); the pool is started on first use,
+    and workers get a copy of the rules the same way
+    :class:`adblockparser.ParallelAdblockRules` workers do.
+
+    An AsyncMatcher must only be used from a single event loop.
+
+    >>> async def check(matcher):
+    ...     return await asyncio.gather(
+    ...         matcher.should_block("http://ads.example.com/banner.gif"),
+    ...         matcher.should_block("http://example.com/"),
+    ...     )
+    >>> matcher = AsyncMatcher(AdblockRules(["||ads.example.com^"]))
+    >>> loop = asyncio.new_event_loop()
+    >>> loop.run_until_complete(check(matcher))
+    [True, False]
+    >>> matcher.batches
+    1
+    >>> loop.close()
+    """
+
+    def __init__(self, rules, executor=None, processes=None, max_batch_size=1000):
+        if executor is not None and processes is not None:
+            raise ValueError("executor and processes can't be used together")
+        self.rules = rules
+        self.executor = executor
+        self.processes = processes
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self._pending = []
+        self._flush_handle = None
+
+    async def should_block(self, url, options=None):
+        """ Return ``rules.should_block(url, options)``, computed in the executor. """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((url, options or {}, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_soon(self._flush)
+        return await future
+
+    async def should_block_many(self, urls, options=None):
+        """
+        Return ``rules.should_block_many(urls, options)``,
+        computed in the executor.
+        """
+        if not (options is None or isinstance(options, dict)):
+            options = list(options)
+        return await self._run(list(urls), options)
+
+    async def reload(self, *args, factory=AdblockRules, **kwargs):
+        """
+        Create new rules in the executor (see :func:`create_rules`)
+        and replace ``rules`` with them. Batches which were already sent
+        are checked against the old rules. Return the new rules.
+        """
+        rules = await create_rules(*args, factory=factory,
+                                   executor=self._thread_executor(), **kwargs)
+        self.rules = rules
+        if self.processes is not None and self.executor is not None:
+            # workers have a copy of the old rules
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        return rules
+
+    def close(self):
+        """ Stop worker processes started by this matcher. """
+        if self.processes is not None and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        parallel._SHARED_RULES.pop(id(self), None)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        asyncio.ensure_future(self._check_batch(batch))
+
+    async def _check_batch(self, batch):
+        self.batches += 1
+        try:
+            results = await self._run(
+                [url for url, options, result in batch],
+                [options for url, options, result in batch],
+            )
+        except asyncio.CancelledError:
+            for url, options, result in batch:
+                result.cancel()
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                _set_result(batch[0][2], error=e)
+                return
+            # only fail calls with invalid options
+            for item in batch:
+                await self._check_batch([item])
+            return
+        for (url, options, result), value in zip(batch, results):
+            _set_result(result, value)
+
+    def _run(self, urls, options):
+        loop = asyncio.get_event_loop()
+        if self.processes is None:
+            return loop.run_in_executor(self.executor, self.rules.should_block_many,
+                                        urls, options)
+        return loop.run_in_executor(self._process_executor(), parallel._should_block_chunk,
+                                    (urls, options))
+
+    def _thread_executor(self):
+        return None if self.processes is not None else self.executor
+
+    def _process_executor(self):
+        if self.executor is None:
+            context = multiprocessing.get_context()
+            if context.get_start_method() == 'fork':
+                parallel._SHARED_RULES[id(self)] = self.rules
+                initargs = (id(self), None)
+            else:
+                initargs = (None, parallel._rules_state(self.rules))
+            self.executor = ProcessPoolExecutor(
+                self.processes, mp_context=context,
+                initializer=parallel._init_worker, initargs=initargs,
+            )
+        return self.executor
+
+
+def _set_result(future, value=None, error=None):
+    if future.done():  # the caller was cancelled
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+
+
+async def create_rules(*args, factory=AdblockRules, executor=None, **kwargs):
+    """
+    Call ``factory(*args, **kwargs)`` in ``executor`` (the default
+    executor of the event loop if it is None), so that parsing
+    and indexing rules doesn't block the event loop. ``factory``
+    is AdblockRules by default; ``AdblockRules.from_files`` or
+    ``AdblockRules.load`` can be used as well.
+
+    >>> loop = asyncio.new_event_loop()
+    >>> rules = loop.run_until_complete(create_rules(["||ads.example.com^"], lazy=True))
+    >>> rules.should_block("http://ads.example.com/")
+    True
+    >>> loop.close()
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(factory, *args, **kwargs))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Aho-Corasick automaton for finding all occurrences of many literal
+strings in a single pass over the text.
+
+If pyahocorasick library (https://github.com/WojciechMula/pyahocorasick)
+is installed it is used; otherwise a pure-Python implementation
+with the same interface is used.
+"""
+from __future__ import absolute_import
+from collections import deque
+
+
+class Automaton(object):
+    """
+    Pure-Python Aho-Corasick automaton. It mimics the part of
+    ``ahocorasick.Automaton`` interface used by adblockparser.
+
+    >>> automaton = Automaton()
+    >>> automaton.add_word("he", "he")
+    True
+    >>> automaton.add_word("she", "she")
+    True
+    >>> automaton.add_word("hers", "hers")
+    True
+    >>> automaton.make_automaton()
+    >>> list(automaton.iter("ushers"))
+    [(3, 'she'), (3, 'he'), (5, 'hers')]
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+    def add_word(self, word, value):
+        """
+        Add ``word`` to the automaton; ``value`` is reported when
+        the word is found. Return False if the word was already added
+        (its value is replaced in this case).
+        """
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        is_new = not self._output[state]
+        self._output[state] = [value]
+        return is_new
+
+    def make_automaton(self):
+        """ Compute failure links; call it after all words are added. """
+        goto, fail, output = self._goto, self._fail, self._output
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail_state = goto[fallback].get(char, 0)
+                if fail_state == next_state:
+                    fail_state = 0
+                fail[next_state] = fail_state
+                output[next_state] = output[next_state] + output[fail_state]
+
+    def iter(self, text):
+        """
+        Yield ``(end_index, value)`` tuples for all occurrences of the words
+        in ``text``; ``end_index`` is the index of the last character of
+        the occurrence.
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            if output[state]:
+                for value in output[state]:
+                    yield index, value
+
+
+def make_automaton(words, use_pyahocorasick='auto'):
+    """
+    Return an Aho-Corasick automaton built from ``words``, an iterable
+    of ``(word, value)`` tuples.
+
+    >>> automaton = make_automaton([("ad", 1), ("banner", 2)], use_pyahocorasick=False)
+    >>> list(automaton.iter("/ad/banner"))
+    [(2, 1), (9, 2)]
+    """
+    if use_pyahocorasick == 'auto':
+        use_pyahocorasick = _is_pyahocorasick_supported()
+
+    if use_pyahocorasick:
+        import ahocorasick
+        automaton = ahocorasick.Automaton()
+    else:
+        automaton = Automaton()
+
+    for word, value in words:
+        automaton.add_word(word, value)
+    automaton.make_automaton()
+    return automaton
+
+
+def _is_pyahocorasick_supported():
+    try:
+        import ahocorasick
+    except ImportError:
+        return False
+    return hasattr(ahocorasick, 'Automaton')
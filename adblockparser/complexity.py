@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Finding rules whose regexes can be slow to match.
+
+stdlib re is a backtracking engine: a regex with several unbounded
+wildcards (``/banner/*/ad*/img*.gif`` becomes ``/banner/.*/ad.*/img.*\\.gif``)
+or with nested quantifiers (``/(\\w+)+\\.js/``) can take time polynomial or
+exponential in the URL length when an URL almost matches.
+
+Such rules can be matched by a safe engine instead: re2 (if it is used),
+or, for wildcard rules, :class:`WildcardRegex`, which takes linear time.
+"""
+from __future__ import absolute_import
+import re
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+from adblockparser.index import (
+    ANCHOR_START, ANCHOR_DOMAIN, ANCHOR_END, _DOMAIN_PREFIX_RE,
+    _strip_anchors, _is_regex_rule
+)
+from adblockparser.utils import _compile
+
+# Rules with more unbounded wildcards than this are expensive.
+MAX_WILDCARDS = 2
+
+_REPEAT_OPS = frozenset(['MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'])
+
+
+def rule_issues(rule, max_wildcards=MAX_WILDCARDS):
+    """
+    Return a list of reasons why matching ``rule`` (an AdblockRule)
+    can be slow; the list is empty if the rule is fine.
+
+    >>> from adblockparser import AdblockRule
+    >>> rule_issues(AdblockRule("/banner/*/img^"))
+    []
+    >>> rule_issues(AdblockRule("/banner/*/ad*/img*.gif"))
+    ['3 unbounded wildcards']
+    >>> rule_issues(AdblockRule(r"/(\\w+)+\\.js/"))
+    ['nested quantifiers']
+    """
+    text = rule.rule_text
+    if _is_regex_rule(text):
+        return regex_issues(text[1:-1], max_wildcards)
+    wildcards = text.count('*')
+    if wildcards > max_wildcards:
+        return ['%d unbounded wildcards' % wildcards]
+    return []
+
+
+def regex_issues(regex, max_wildcards=MAX_WILDCARDS):
+    """
+    Return a list of reasons why matching ``regex`` can be slow.
+
+    >>> regex_issues(r"^https?://[^/]+/ad")
+    []
+    >>> regex_issues(r"(?:a|b.*)*c.*d")
+    ['nested quantifiers', '3 unbounded quantifiers']
+    """
+    try:
+        parsed = sre_parse.parse(regex)
+    except Exception:  # invalid regexes are reported when they are compiled
+        return []
+    counts = {'unbounded': 0, 'nested': False}
+    _count_repeats(parsed, counts, in_repeat=False)
+    issues = []
+    if counts['nested']:
+        issues.append('nested quantifiers')
+    if counts['unbounded'] > max_wildcards:
+        issues.append('%d unbounded quantifiers' % counts['unbounded'])
+    return issues
+
+
+def _count_repeats(items, counts, in_repeat):
+    for op, av in items:
+        name = str(op).upper()
+        if name in _REPEAT_OPS:
+            low, high, subpattern = av
+            if high == sre_parse.MAXREPEAT:
+                counts['unbounded'] += 1
+            if in_repeat and high > 1:
+                counts['nested'] = True
+            _count_repeats(subpattern, counts,
+                           in_repeat or high == sre_parse.MAXREPEAT)
+        elif name == 'SUBPATTERN':
+            _count_repeats(av[-1], counts, in_repeat)
+        elif name == 'BRANCH':
+            for subpattern in av[1]:
+                _count_repeats(subpattern, counts, in_repeat)
+        elif name in ('ASSERT', 'ASSERT_NOT'):
+            _count_repeats(av[1], counts, in_repeat)
+        elif name == 'ATOMIC_GROUP':
+            _count_repeats(av, counts, in_repeat)
+
+
+class RegexGuard(object):
+    """
+    Decides which rules are expensive (see :func:`rule_issues`)
+    and compiles their regexes with a safe engine (see :func:`safe_regex`).
+    """
+
+    def __init__(self, max_wildcards=MAX_WILDCARDS):
+        self.max_wildcards = max_wildcards
+
+    def issues(self, rule):
+        return rule_issues(rule, self.max_wildcards)
+
+    def is_expensive(self, rule):
+        return bool(rule.rule_text) and bool(self.issues(rule))
+
+    def compile(self, rule, flags=0, use_re2=False, max_mem=None):
+        return safe_regex(rule, flags, use_re2, max_mem)
+
+
+def safe_regex(rule, flags=0, use_re2=False, max_mem=None):
+    """
+    Return an object with ``search(url)`` method which matches URLs like
+    ``rule.regex`` does, but without catastrophic backtracking if possible:
+    a re2 regex, a :class:`WildcardRegex`, or a stdlib re regex
+    for ``/regex/`` rules if re2 is not used.
+    """
+    if use_re2:
+        try:
+            return _compile(rule.regex, flags, use_re2, max_mem)
+        except Exception:  # re2 can't compile some regexes
+            pass
+    if WildcardRegex.supports(rule.rule_text):
+        return WildcardRegex(rule.rule_text, flags)
+    return re.compile(rule.regex, flags)
+
+
+class WildcardRegex(object):
+    """
+    A matcher for rules with ``*`` wildcards which works in linear time.
+    The rule is split into parts at wildcards; each part is found after
+    the end of the previous one. The first occurrence ends first, so if
+    it doesn't lead to a match, no other occurrence does.
+
+    ``search`` returns True if ``url`` matches and None otherwise.
+
+    >>> regex = WildcardRegex("||example.com^*/ads/*banner*.gif|")
+    >>> regex.search("http://www.example.com/x/ads/top_banner/1.gif")
+    True
+    >>> print(regex.search("http://www.example.com/x/ads/top_banner/1.gif?x"))
+    None
+    >>> print(regex.search("http://notexample.com/x/ads/top_banner/1.gif"))
+    None
+    """
+
+    def __init__(self, rule_text, flags=0):
+        text, anchors = _strip_anchors(rule_text)
+        parts = text.split('*')
+        if not parts[0]:
+            anchors &= ~(ANCHOR_START | ANCHOR_DOMAIN)
+        if not parts[-1]:
+            anchors &= ~ANCHOR_END
+        parts = [_part_regex(part) for part in parts if part]
+        if parts and anchors & ANCHOR_END:
+            parts[-1] += '$'
+        self.rule_text = rule_text
+        self.anchors = anchors
+        self.parts = [re.compile(part, flags) for part in parts]
+        self.flags = flags
+        self._regex = None
+
+    @classmethod
+    def supports(cls, rule_text):
+        """ Return True if WildcardRegex can match ``rule_text`` """
+        if _is_regex_rule(rule_text):
+            return False
+        return '|' not in _strip_anchors(rule_text)[0]
+
+    def search(self, url):
+        if '\n' in url:
+            # wildcards don't match newlines; don't bother
+            if self._regex is None:
+                from adblockparser.parser import AdblockRule
+                self._regex = re.compile(AdblockRule.rule_to_regex(self.rule_text),
+                                         self.flags)
+            return True if self._regex.search(url) else None
+
+        pos = 0
+        for number, part in enumerate(self.parts):
+            if number == 0 and self.anchors & ANCHOR_START:
+                match = part.match(url)
+            elif number == 0 and self.anchors & ANCHOR_DOMAIN:
+                match = part.search(url)
+                while match is not None and \
+                        not _DOMAIN_PREFIX_RE.match(url, 0, match.start()):
+                    if match.start() >= len(url):
+                        match = None
+                        break
+                    match = part.search(url, match.start() + 1)
+            else:
+                match = part.search(url, pos)
+            if match is None:
+                return None
+            pos = match.end()
+        return True
+
+
+def _part_regex(part):
+    # the same conversion as in AdblockRule.rule_to_regex
+    part = re.sub(r"([.$+?{}()\[\]\\])", r"\\\1", part)
+    return part.replace("^", r"(?:[^\w\-.%]|$)")
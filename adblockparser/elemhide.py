@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Index for element hiding rules (``##`` and ``#@#``).
+
+Rules which are restricted to domains are stored in {domain: [rules]}
+dicts, so selectors for a page are collected using a dict lookup for each
+variant of the page domain; rules without domains form a generic
+selector list which is built once. Results are cached per domain.
+"""
+from __future__ import absolute_import
+import re
+
+from adblockparser.utils import LRUCache, _domain_variants
+
+_HTML_RULE_RE = re.compile(r'^([^/*|@"!]*?)#(@)?#(.+)$')
+
+# Selectors per CSS rule in a stylesheet: an invalid selector
+# makes the whole CSS rule invalid.
+SELECTORS_PER_CSS_RULE = 1000
+
+
+def parse_html_rule(rule_text):
+    """
+    Parse an element hiding rule. Return ``(domains, selector, is_exception)``
+    tuple, where ``domains`` is a {domain: required} dict, or None if
+    ``rule_text`` is not an element hiding rule.
+
+    >>> domains, selector, is_exception = parse_html_rule("Example.com,~foo.example.com##.ad")
+    >>> sorted(domains.items())
+    [('example.com', True), ('foo.example.com', False)]
+    >>> selector, is_exception
+    ('.ad', False)
+    >>> parse_html_rule("#@#div[id^='ad-']")
+    ({}, "div[id^='ad-']", True)
+    >>> parse_html_rule("||example.com/##ads") is None
+    True
+    """
+    match = _HTML_RULE_RE.match(rule_text.strip())
+    if match is None:
+        return None
+    domains_text, exception, selector = match.groups()
+    domains = {}
+    for domain in domains_text.lower().split(','):
+        domain = domain.strip()
+        if domain.lstrip('~'):
+            domains[domain.lstrip('~')] = not domain.startswith('~')
+    return domains, selector.strip(), bool(exception)
+
+
+class _HtmlRule(object):
+    __slots__ = ['rule', 'domains', 'selector', 'is_exception', 'is_generic']
+
+    def __init__(self, rule, domains, selector, is_exception):
+        self.rule = rule
+        self.domains = domains
+        self.selector = selector
+        self.is_exception = is_exception
+        # generic rules apply to all domains which are not excluded
+        self.is_generic = not any(domains.values())
+
+    def applies(self, variants):
+        for domain in variants:
+            if domain in self.domains:
+                return self.domains[domain]
+        return self.is_generic
+
+
+class ElementHidingIndex(object):
+    """
+    Element hiding rules indexed by domain.
+
+    >>> from adblockparser import AdblockRule
+    >>> index = ElementHidingIndex([AdblockRule(text) for text in [
+    ...     "##.ad",
+    ...     "##.banner",
+    ...     "example.com##.sponsored",
+    ...     "~example.org##.promo",
+    ...     "foo.example.com#@#.ad",
+    ... ]])
+    >>> index.selectors("www.example.com")
+    ('.sponsored', '.ad', '.banner', '.promo')
+    >>> index.selectors("foo.example.com")
+    ('.sponsored', '.banner', '.promo')
+    >>> index.selectors("example.org")
+    ('.ad', '.banner')
+    >>> index.generic_selectors()
+    ('.ad', '.banner')
+    """
+
+    def __init__(self, rules=(), cache_size=1000):
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self._rules = {}  # id(rule) -> _HtmlRule
+        # generic rules and exceptions, in order
+        self.generic = []
+        self.generic_exceptions = []
+        # {domain: [_HtmlRule]} for rules and exceptions with required domains
+        self.by_domain = {}
+        self.exceptions_by_domain = {}
+        # {domain: [_HtmlRule]} for generic rules which exclude domains
+        self.excluded_by_domain = {}
+        self._generic_selectors = None
+        self._generic_stylesheet = None
+        self._generic_data_cache = None
+        for rule in rules:
+            self._add(rule)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def add(self, rule):
+        """
+        Add an element hiding rule (an AdblockRule instance). Return False
+        if the rule can't be parsed, and True otherwise.
+        """
+        added = self._add(rule)
+        if added:
+            self._invalidate()
+        return added
+
+    def remove(self, rule):
+        """ Remove a rule added before. """
+        html_rule = self._rules.pop(id(rule), None)
+        if html_rule is None:
+            return
+        if html_rule.is_generic:
+            lst = self.generic_exceptions if html_rule.is_exception else self.generic
+            _remove_html_rule(lst, html_rule)
+            if not html_rule.is_exception:
+                self._remove_from_index(self.excluded_by_domain, html_rule, False)
+        elif html_rule.is_exception:
+            self._remove_from_index(self.exceptions_by_domain, html_rule, True)
+        else:
+            self._remove_from_index(self.by_domain, html_rule, True)
+        self._invalidate()
+
+    def selectors(self, domain):
+        """
+        Return a tuple of unique CSS selectors of elements to hide
+        on pages from ``domain``: selectors of rules for the domain
+        (and its parent domains) go first, then generic selectors.
+        """
+        domain = domain.lower()
+        if self.cache is None:
+            return self._selectors(domain)
+        selectors = self.cache.get(domain)
+        if selectors is None:
+            selectors = self._selectors(domain)
+            self.cache[domain] = selectors
+        return selectors
+
+    def generic_selectors(self):
+        """
+        Return a tuple of unique CSS selectors of generic rules (rules
+        without domains), minus selectors disabled by generic exceptions.
+        """
+        if self._generic_selectors is None:
+            disabled = set(
+                html_rule.selector for html_rule in self.generic_exceptions
+                if not html_rule.domains
+            )
+            self._generic_selectors = _unique(
+                html_rule.selector for html_rule in self.generic
+                if not html_rule.domains and html_rule.selector not in disabled
+            )
+        return self._generic_selectors
+
+    def stylesheet(self, domain=None):
+        """
+        Return CSS which hides elements on pages from ``domain``,
+        or generic CSS if ``domain`` is None.
+        """
+        if domain is not None:
+            return to_stylesheet(self.selectors(domain))
+        if self._generic_stylesheet is None:
+            self._generic_stylesheet = to_stylesheet(self.generic_selectors())
+        return self._generic_stylesheet
+
+    def _add(self, rule):
+        parsed = parse_html_rule(rule.rule_text)
+        if parsed is None:
+            return False
+        html_rule = _HtmlRule(rule, *parsed)
+        self._rules[id(rule)] = html_rule
+        if html_rule.is_generic:
+            if html_rule.is_exception:
+                self.generic_exceptions.append(html_rule)
+            else:
+                self.generic.append(html_rule)
+                self._add_to_index(self.excluded_by_domain, html_rule, False)
+        elif html_rule.is_exception:
+            self._add_to_index(self.exceptions_by_domain, html_rule, True)
+        else:
+            self._add_to_index(self.by_domain, html_rule, True)
+        return True
+
+    @classmethod
+    def _add_to_index(cls, index, html_rule, required):
+        for domain, value in html_rule.domains.items():
+            if value == required:
+                index.setdefault(domain, []).append(html_rule)
+
+    @classmethod
+    def _remove_from_index(cls, index, html_rule, required):
+        for domain, value in html_rule.domains.items():
+            if value == required:
+                _remove_html_rule(index[domain], html_rule)
+                if not index[domain]:
+                    del index[domain]
+
+    def _invalidate(self):
+        self._generic_data_cache = None
+        self._generic_selectors = None
+        self._generic_stylesheet = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _selectors(self, domain):
+        variants = tuple(_domain_variants(domain))
+
+        disabled = set(
+            html_rule.selector for html_rule in self.generic_exceptions
+            if html_rule.applies(variants)
+        )
+        for variant in variants:
+            for html_rule in self.exceptions_by_domain.get(variant, ()):
+                if html_rule.applies(variants):
+                    disabled.add(html_rule.selector)
+
+        specific = [
+            html_rule.selector
+            for variant in variants
+            for html_rule in self.by_domain.get(variant, ())
+            if html_rule.selector not in disabled and html_rule.applies(variants)
+        ]
+
+        # Generic selectors are computed once; only generic rules which
+        # exclude one of the domain variants need to be checked here.
+        generic, plain, with_exclusions = self._generic_data()
+        excluded = set()
+        for variant in variants:
+            for html_rule in self.excluded_by_domain.get(variant, ()):
+                selector = html_rule.selector
+                if html_rule.applies(variants) or selector in plain:
+                    continue
+                # a selector can still be added by another generic rule
+                if not any(other.applies(variants)
+                           for other in with_exclusions[selector]):
+                    excluded.add(selector)
+
+        if not specific and not disabled and not excluded:
+            return generic
+        disabled.update(excluded)
+        return _unique(specific + [
+            selector for selector in generic if selector not in disabled
+        ])
+
+    def _generic_data(self):
+        """
+        Return ``(selectors, plain_selectors, with_exclusions)``:
+        a tuple of selectors of all generic rules (minus selectors
+        disabled everywhere), a set of selectors of rules without
+        domains and a {selector: [rules]} dict for rules which
+        exclude domains.
+        """
+        if self._generic_data_cache is None:
+            disabled = set(
+                html_rule.selector for html_rule in self.generic_exceptions
+                if not html_rule.domains
+            )
+            plain = set()
+            with_exclusions = {}
+            for html_rule in self.generic:
+                if html_rule.domains:
+                    with_exclusions.setdefault(html_rule.selector, []).append(html_rule)
+                else:
+                    plain.add(html_rule.selector)
+            selectors = _unique(
+                html_rule.selector for html_rule in self.generic
+                if html_rule.selector not in disabled
+            )
+            self._generic_data_cache = selectors, plain, with_exclusions
+        return self._generic_data_cache
+
+
+def to_stylesheet(selectors):
+    """
+    Return CSS which hides elements matched by ``selectors``.
+
+    >>> print(to_stylesheet([".ad", "#banner"]))
+    .ad, #banner {display: none !important;}
+    <BLANKLINE>
+    >>> to_stylesheet([])
+    ''
+    """
+    selectors = list(selectors)
+    return "".join(
+        "%s {display: none !important;}\n" %
+        ", ".join(selectors[i:i + SELECTORS_PER_CSS_RULE])
+        for i in range(0, len(selectors), SELECTORS_PER_CSS_RULE)
+    )
+
+
+def _unique(selectors):
+    seen = set()
+    result = []
+    for selector in selectors:
+        if selector not in seen:
+            seen.add(selector)
+            result.append(selector)
+    return tuple(result)
+
+
+def _remove_html_rule(html_rules, html_rule):
+    for i, item in enumerate(html_rules):
+        if item is html_rule:
+            del html_rules[i]
+            return
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Reading filter lists from files.
+
+Lines are read one-by-one, so a list is never loaded into memory
+as a whole; comments and empty lines are skipped before AdblockRule
+instances are created.
+"""
+from __future__ import absolute_import
+import base64
+import hashlib
+import io
+import re
+
+_CHECKSUM_RE = re.compile(r'^\s*!\s*checksum[\s\-:]+([\w\+\/=]+)', re.IGNORECASE)
+_METADATA_RE = re.compile(r'^!\s*([\w\- ]+?)\s*:\s*(.*?)\s*$')
+
+
+class AdblockChecksumError(ValueError):
+    """ Checksum of a filter list doesn't match its contents. """
+    pass
+
+
+class FilterList(object):
+    """
+    Filter list stored in a file: an iterable of rule strings.
+
+    ``source`` is a file name or a file object opened in binary or text
+    mode; lines are decoded using ``encoding``. List header is parsed
+    while reading: ``header`` is the ``[Adblock Plus 2.0]`` line
+    without brackets (or None), ``metadata`` is a dict with
+    ``! Key: value`` comments from the beginning of the list.
+
+    If the list has a ``! Checksum:`` comment and ``verify_checksum``
+    is True, AdblockChecksumError is raised after the last line is read
+    if the checksum doesn't match.
+
+    >>> data = b'''[Adblock Plus 2.0]
+    ... ! Title: Example list
+    ... ! Expires: 4 days
+    ...
+    ... ||ads.example.com^
+    ... ! comment
+    ... @@||ads.example.com/notbanner^$~script
+    ... '''
+    >>> filter_list = FilterList(io.BytesIO(data))
+    >>> list(filter_list)
+    ['||ads.example.com^', '@@||ads.example.com/notbanner^$~script']
+    >>> filter_list.header
+    'Adblock Plus 2.0'
+    >>> sorted(filter_list.metadata.items())
+    [('Expires', '4 days'), ('Title', 'Example list')]
+    """
+
+    def __init__(self, source, encoding='utf-8', verify_checksum=True):
+        self.source = source
+        self.encoding = encoding
+        self.verify_checksum = verify_checksum
+        self.header = None
+        self.metadata = {}
+        self.checksum = None
+
+    def __iter__(self):
+        if hasattr(self.source, 'read'):
+            for rule in self._read(self.source):
+                yield rule
+        else:
+            with io.open(self.source, 'rb') as f:
+                for rule in self._read(f):
+                    yield rule
+
+    def _read(self, fileobj):
+        self.header = None
+        self.metadata = {}
+        self.checksum = None
+        digest = _ChecksumDigest() if self.verify_checksum else None
+        in_header = True
+        for lineno, line in enumerate(fileobj):
+            if isinstance(line, bytes):
+                line = line.decode(self.encoding)
+            if lineno == 0:
+                line = line.lstrip(u'\ufeff')
+            text = line.strip()
+
+            match = _CHECKSUM_RE.match(text)
+            if match:
+                self.checksum = match.group(1)
+            elif digest is not None:
+                digest.update(line)
+
+            if not text:
+                continue
+            if text.startswith('!'):
+                if in_header:
+                    match = _METADATA_RE.match(text)
+                    if match and match.group(1).lower() != 'checksum':
+                        self.metadata[match.group(1)] = match.group(2)
+                continue
+            if text.startswith('[Adblock'):
+                self.header = text.strip('[]')
+                continue
+            in_header = False
+            yield text
+
+        if digest is not None and self.checksum is not None:
+            if digest.checksum() != self.checksum.rstrip('='):
+                raise AdblockChecksumError(
+                    "Filter list checksum doesn't match: %s" % self.checksum
+                )
+
+    def __repr__(self):
+        return "FilterList(%r)" % (self.source,)
+
+
+class _ChecksumDigest(object):
+    """
+    MD5 of a filter list, computed the same way as Adblock Plus does:
+    '\\r' characters are removed, consecutive line breaks are collapsed
+    and the checksum line is excluded.
+    """
+
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.newline = False
+
+    def update(self, line):
+        line = line.replace(u'\r', u'')
+        if not line.strip(u'\n'):
+            if line and not self.newline:
+                self.md5.update(b'\n')
+                self.newline = True
+            return
+        self.md5.update(line.encode('utf8'))
+        self.newline = line.endswith(u'\n')
+
+    def checksum(self):
+        return base64.b64encode(self.md5.digest()).decode('ascii').rstrip('=')
@@ -0,0 +1,855 @@
+# -*- coding: utf-8 -*-
+"""
+Index for matching URLs against many option-less rules.
+
+Instead of joining all rules into a single huge regex, rules are split
+into four groups:
+
+* ``||host^`` rules are put into a hash table keyed by host name;
+  for an URL, the host names it may match are looked up;
+* literal rules (no wildcards or separators, only anchors) are found
+  using an Aho-Corasick automaton in a single pass over the URL;
+* other rules are assigned a "keyword": a run of letters and digits from
+  the rule text which must be present in any URL the rule matches,
+  as a complete token. An URL is split into tokens once, and only rules
+  whose keyword is among these tokens are checked;
+* the remaining rules are combined into a single regex (or several
+  regexes, if there are too many of them).
+"""
+from __future__ import absolute_import
+import re
+import time
+
+from adblockparser.utils import _combined_regex, LRUCache
+from adblockparser.automaton import make_automaton
+
+# URLs are tokenized after lowercasing, rule keywords are lowercased too
+_URL_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_RULE_TOKEN_RE = re.compile(r'[a-zA-Z0-9]+')
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+# Tokens which are present in almost every URL; a rule is keyed
+# by one of them only if it has no better candidates.
+_COMMON_TOKENS = frozenset(['http', 'https', 'www', 'com', 'net', 'org', 'js'])
+
+_NOT_COMPILED = object()
+
+# Anchors of literal rules
+ANCHOR_START = 1   # |literal
+ANCHOR_DOMAIN = 2  # ||literal
+ANCHOR_END = 4     # literal|
+
+# What ``||`` is converted to by AdblockRule.rule_to_regex,
+# up to the start of the literal.
+_DOMAIN_PREFIX_RE = re.compile(r"(?:[^:/?#]+:)?(?://(?:[^/?#]*\.)?)?\Z")
+_LITERAL_SPECIAL_CHARS = frozenset('*^|')
+
+# ``||host^`` rules; host can only have characters which
+# are not separators
+_HOST_RULE_RE = re.compile(r'\|\|([A-Za-z0-9_\-.%]+)\^\Z')
+_HOST_CHARS_RE = re.compile(r'[A-Za-z0-9_\-.%]*')
+_SCHEME_RE = re.compile(r'[^:/?#]+:')
+_AUTHORITY_END_RE = re.compile(r'[/?#]')
+
+
+def _regex_count(regex):
+    if regex is None or regex is _NOT_COMPILED:
+        return 0
+    return len(getattr(regex, 'shards', [regex]))
+
+
+def _strip_anchors(rule_text):
+    anchors = 0
+    if rule_text.startswith('||'):
+        rule_text, anchors = rule_text[2:], ANCHOR_DOMAIN
+    elif rule_text.startswith('|'):
+        rule_text, anchors = rule_text[1:], ANCHOR_START
+    if rule_text.endswith('|'):
+        rule_text, anchors = rule_text[:-1], anchors | ANCHOR_END
+    return rule_text, anchors
+
+
+def _is_regex_rule(rule_text):
+    return rule_text.startswith('/') and rule_text.endswith('/')
+
+
+def _matches_all_urls(rule):
+    """
+    Return True if ``rule`` has an empty pattern (e.g. ``$script``)
+    or an empty regex (``//$script``), so it matches all URLs.
+    """
+    if not rule.rule_text:
+        return True
+    # only /regex/ rules can be converted to an empty regex
+    return _is_regex_rule(rule.rule_text) and not rule.regex
+
+
+def rule_literal(rule_text):
+    """
+    Return a ``(literal, anchors)`` tuple if ``rule_text`` (without options)
+    is a plain substring, possibly anchored; return None otherwise.
+    ``anchors`` is a combination of ``ANCHOR_START``, ``ANCHOR_DOMAIN``
+    and ``ANCHOR_END`` flags.
+
+    >>> rule_literal("-ad-banner.")
+    ('-ad-banner.', 0)
+    >>> rule_literal("||example.com/banner.gif") == ('example.com/banner.gif', ANCHOR_DOMAIN)
+    True
+    >>> rule_literal("|http://example.com/|") == ('http://example.com/', ANCHOR_START | ANCHOR_END)
+    True
+    >>> print(rule_literal("||ads.example.com^"))
+    None
+    >>> print(rule_literal("/banner/*/img"))
+    None
+    """
+    if not rule_text or _NON_ASCII_RE.search(rule_text) or _is_regex_rule(rule_text):
+        return None
+    literal, anchors = _strip_anchors(rule_text)
+    if not literal or _LITERAL_SPECIAL_CHARS.intersection(literal):
+        return None
+    return literal, anchors
+
+
+def _anchors_match(url, start, end, anchors):
+    if anchors & ANCHOR_START and start != 0:
+        return False
+    if anchors & ANCHOR_END and not (
+        end == len(url) or (end == len(url) - 1 and url[-1] == '\n')
+    ):
+        return False
+    if anchors & ANCHOR_DOMAIN and not _DOMAIN_PREFIX_RE.match(url[:start]):
+        return False
+    return True
+
+
+def rule_host(rule_text):
+    """
+    Return a host name if ``rule_text`` (without options) is a pure
+    host name rule like ``||ads.example.com^``; return None otherwise.
+
+    >>> rule_host("||ads.example.com^")
+    'ads.example.com'
+    >>> print(rule_host("||ads.example.com/banner^"))
+    None
+    >>> print(rule_host("||ads.example.com"))
+    None
+    """
+    match = _HOST_RULE_RE.match(rule_text)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def url_hosts(url):
+    """
+    Return a set of strings from ``url`` which a host of a ``||host^`` rule
+    must be equal to for the rule to match: runs of non-separator characters
+    starting at the beginning of the URL, after the scheme, after ``//``
+    and after each dot in the authority. None is returned for
+    non-ASCII URLs.
+
+    >>> sorted(url_hosts("http://ads.example.com:8080/banner.gif"))
+    ['ads.example.com', 'com', 'example.com', 'http']
+    >>> sorted(url_hosts("//cdn.example.net/x?a.b"))
+    ['cdn.example.net', 'example.net', 'net']
+    """
+    if _NON_ASCII_RE.search(url):
+        return None
+    starts = [0]
+    match = _SCHEME_RE.match(url)
+    if match:
+        starts.append(match.end())
+
+    positions = set()
+    for start in starts:
+        positions.add(start)
+        if url.startswith('//', start):
+            # (?://(?:[^/?#]*\.)?)? part of the regex
+            pos = start + 2
+            positions.add(pos)
+            end = _AUTHORITY_END_RE.search(url, pos)
+            end = end.start() if end else len(url)
+            dot = url.find('.', pos, end)
+            while dot != -1:
+                positions.add(dot + 1)
+                dot = url.find('.', dot + 1, end)
+    hosts = set(_HOST_CHARS_RE.match(url, pos).group() for pos in positions)
+    hosts.discard('')
+    return hosts
+
+
+def rule_keywords(rule_text):
+    r"""
+    Return a list of keyword candidates for ``rule_text`` (without options):
+    lowercased tokens which are guaranteed to be complete tokens of every
+    URL the rule matches. Very common tokens are only returned if there
+    are no other candidates.
+
+    >>> rule_keywords("||ads.example.com^")
+    ['ads', 'example']
+    >>> rule_keywords("|http://example.com/|")
+    ['example']
+    >>> rule_keywords("*/ad*")
+    []
+    >>> rule_keywords(r"/banner\d+/")
+    []
+    """
+    if not rule_text or _NON_ASCII_RE.search(rule_text):
+        # non-ASCII characters may match ASCII letters
+        # when the regex is case-insensitive
+        return []
+
+    if _is_regex_rule(rule_text):
+        return []
+
+    text, anchors = _strip_anchors(rule_text)
+    start_anchored = bool(anchors & (ANCHOR_START | ANCHOR_DOMAIN))
+    end_anchored = bool(anchors & ANCHOR_END)
+
+    if '|' in text:
+        # AdblockRule.rule_to_regex mangles such rules; don't try
+        # to guess what they match.
+        return []
+
+    keywords = []
+    for match in _RULE_TOKEN_RE.finditer(text):
+        start, end = match.span()
+        if start == 0 and not start_anchored:
+            continue
+        if end == len(text) and not end_anchored:
+            continue
+        if text[start-1:start] == '*' or text[end:end+1] == '*':
+            continue
+        token = match.group().lower()
+        if token not in keywords:
+            keywords.append(token)
+
+    uncommon = [token for token in keywords if token not in _COMMON_TOKENS]
+    return uncommon or keywords
+
+
+def rule_keyword(rule_text):
+    r"""
+    Return the longest keyword candidate for ``rule_text``
+    (see :func:`rule_keywords`), or None if there are no candidates.
+
+    >>> rule_keyword("||ads.example.com^")
+    'example'
+    >>> rule_keyword("/banner/*/img^")
+    'banner'
+    >>> rule_keyword("/ad.swf|")
+    'swf'
+    >>> print(rule_keyword("adv"))
+    None
+    >>> print(rule_keyword(r"/banner\d+/"))
+    None
+    """
+    keywords = rule_keywords(rule_text)
+    if not keywords:
+        return None
+    return max(keywords, key=len)
+
+
+def pick_keyword(keywords, buckets):
+    """
+    Return a keyword from ``keywords`` candidates with the smallest bucket
+    in ``buckets`` (a ``{keyword: rules}`` dict); longer keywords win ties.
+
+    >>> pick_keyword(['ads', 'example'], {'example': [1, 2]})
+    'ads'
+    >>> pick_keyword(['ads', 'example'], {})
+    'example'
+    """
+    return min(keywords, key=lambda keyword: (
+        len(buckets.get(keyword, ())), -len(keyword)
+    ))
+
+
+def url_tokens(url):
+    """
+    Return a set of lowercased tokens of ``url``, or None if the URL
+    can't be tokenized reliably (it has non-ASCII characters).
+
+    >>> sorted(url_tokens("http://Example.com/banner.gif"))
+    ['banner', 'com', 'example', 'gif', 'http']
+    """
+    if _NON_ASCII_RE.search(url):
+        return None
+    return set(_URL_TOKEN_RE.findall(url.lower()))
+
+
+# compiled regexes of individual rules, used to find which rule matched
+_RULE_RE_CACHE = LRUCache(10000)
+
+
+def _rule_re(regex, flags):
+    key = regex, flags
+    compiled = _RULE_RE_CACHE.get(key)
+    if compiled is None:
+        compiled = _RULE_RE_CACHE[key] = re.compile(regex, flags)
+    return compiled
+
+
+def find_rule(rules, url, flags, combined=None):
+    """
+    Return the first rule from ``rules`` which matches ``url``, or None.
+    ``combined`` is a regex combined from regexes of ``rules``;
+    if it is sharded, only rules of the matching shard are checked.
+
+    >>> from adblockparser import AdblockRule
+    >>> rules = [AdblockRule(text) for text in ["/ad/", "/banner/", "/img/"]]
+    >>> combined = _combined_regex([r.regex for r in rules], shard_size=2)
+    >>> find_rule(rules, "http://example.com/img/1.gif", re.IGNORECASE, combined)
+    AdblockRule('/img/')
+    """
+    rules = [rule for rule in rules if rule.regex]
+    shards = getattr(combined, 'shards', None)
+    if shards is not None and combined.shard_size:
+        size = combined.shard_size
+        for number, shard in enumerate(shards):
+            if shard.search(url):
+                rules = rules[number * size:(number + 1) * size]
+                break
+        else:
+            return None
+    for rule in rules:
+        if _rule_re(rule.regex, flags).search(url):
+            return rule
+    return None
+
+
+class HostTable(object):
+    """
+    A hash table for ``||host^`` rules (see :func:`rule_host`).
+    An URL is checked by looking up strings returned by :func:`url_hosts`,
+    instead of searching for each host name.
+
+    ``combine`` is a function which returns a combined regex for a list
+    of regexes; it is used for non-ASCII URLs.
+
+    >>> from adblockparser import AdblockRule
+    >>> from adblockparser.utils import _combined_regex
+    >>> hosts = HostTable(_combined_regex)
+    >>> hosts.add(AdblockRule("||ads.example.com^"))
+    >>> hosts.search("https://ADS.example.com/banner.gif")
+    True
+    >>> hosts.search("https://ads.example.com.evil.org/")
+    False
+    """
+
+    def __init__(self, combine, ignore_case=True):
+        self.combine = combine
+        self.ignore_case = ignore_case
+        self.hosts = {}
+        self._size = 0
+        self._regex = _NOT_COMPILED
+
+    def _key(self, rule):
+        host = rule_host(rule.rule_text)
+        return host.lower() if self.ignore_case else host
+
+    def add(self, rule):
+        self.hosts.setdefault(self._key(rule), []).append(rule)
+        self._size += 1
+        self._regex = _NOT_COMPILED
+
+    def remove(self, rule):
+        key = self._key(rule)
+        rules = self.hosts.get(key, [])
+        for i, other in enumerate(rules):
+            if other is rule:
+                del rules[i]
+                if not rules:
+                    del self.hosts[key]
+                self._size -= 1
+                self._regex = _NOT_COMPILED
+                return
+        raise ValueError("%r is not in the index" % rule)
+
+    def __len__(self):
+        return self._size
+
+    def rules(self):
+        return [rule for rules in self.hosts.values() for rule in rules]
+
+    def search(self, url, request=None):
+        """
+        Return True if any of the rules matches ``url``. ``request`` is
+        an optional object with precomputed ``hosts`` attribute
+        (e.g. :class:`adblockparser.Request`).
+        """
+        if not self.hosts:
+            return False
+        hosts = url_hosts(url) if request is None else request.hosts
+        if hosts is None:
+            # case-insensitive matching of non-ASCII characters
+            # is tricky; use regexes
+            if self._regex is _NOT_COMPILED:
+                self._regex = self.combine([rule.regex for rule in self.rules()])
+            return bool(self._regex.search(url))
+        for host in hosts:
+            if self.ignore_case:
+                host = host.lower()
+            if host in self.hosts:
+                return True
+        return False
+
+    def find(self, url, request=None):
+        """
+        Return a rule which matches ``url``, or None. See :meth:`search`.
+        """
+        if not self.hosts:
+            return None
+        hosts = url_hosts(url) if request is None else request.hosts
+        if hosts is None:
+            if not self.search(url, request):
+                return None
+            flags = re.IGNORECASE if self.ignore_case else 0
+            return find_rule(self.rules(), url, flags, self._regex)
+        for host in hosts:
+            if self.ignore_case:
+                host = host.lower()
+            if host in self.hosts:
+                return self.hosts[host][0]
+        return None
+
+    def precompile(self):
+        """ Compile the regex used for non-ASCII URLs. """
+        if self.hosts and self._regex is _NOT_COMPILED:
+            self._regex = self.combine([rule.regex for rule in self.rules()])
+
+    def compiled_regexes(self):
+        return _regex_count(self._regex)
+
+
+class RuleIndex(object):
+    """
+    An index of rules which allows to check if any of the rules
+    matches an URL. Rule options are not taken into account.
+
+    ``||host^`` rules are put into a HostTable. Literal rules
+    (see :func:`rule_literal`) are matched using an Aho-Corasick automaton.
+    Other rules are grouped by keywords (see :func:`rule_keywords`);
+    each rule is put into the smallest of its keyword buckets. Regexes
+    are combined per keyword and compiled on first use; the automaton
+    is also built on first use. Rules without a keyword are combined
+    into ``fallback_re`` regex. Rules with an empty pattern match all URLs.
+
+    Matching is case-insensitive by default; pass ``flags=0``
+    to make it case-sensitive.
+
+    If ``shard_size`` is set, combined regexes of more than ``shard_size``
+    rules are split into several regexes (see ``utils.ShardedRegex``).
+
+    ``guard`` is an optional :class:`adblockparser.complexity.RegexGuard`;
+    rules it considers expensive are not combined with other rules,
+    and are matched one-by-one using regexes it compiles.
+    Use :meth:`stats` to check how large the index is and how much time
+    was spent compiling regexes.
+
+    >>> from adblockparser import AdblockRule
+    >>> index = RuleIndex([AdblockRule("||ads.example.com^"), AdblockRule("adv")])
+    >>> index.search("http://ads.example.com/foo.gif")
+    True
+    >>> index.search("http://example.com/advert.html")
+    True
+    >>> index.search("http://example.com/")
+    False
+    """
+
+    def __init__(self, rules=(), use_re2=False, max_mem=None,
+                 use_pyahocorasick='auto', flags=re.IGNORECASE, shard_size=None,
+                 guard=None):
+        self.use_re2 = use_re2
+        self.flags = flags
+        self.max_mem = max_mem
+        self.shard_size = shard_size
+        self.compile_time = 0.0
+        self.use_pyahocorasick = use_pyahocorasick
+        self.hosts = HostTable(self._combined, bool(flags & re.IGNORECASE))
+        self.literals = {}
+        self.buckets = {}
+        self.fallback = []
+        self.match_all = []
+        self.guard = guard
+        self.isolated = []
+        self._isolated_re = {}
+        self._bucket_re = {}
+        self._literal_re = None
+        self._automaton = None
+        self._size = 0
+
+        for rule in rules:
+            self._add(rule)
+
+        # compile it now to raise errors for invalid regex rules early
+        self._fallback_re = self._combined([r.regex for r in self.fallback])
+
+    def _add(self, rule):
+        self._size += 1
+        if _matches_all_urls(rule):
+            # e.g. "$websocket,domain=example.com" or "//$script"
+            self.match_all.append(rule)
+            return
+
+        if rule_host(rule.rule_text) is not None:
+            self.hosts.add(rule)
+            return
+
+        literal = rule_literal(rule.rule_text)
+        if literal is not None:
+            text, anchors = literal
+            self.literals.setdefault(text.lower(), []).append((rule, anchors, text))
+            return
+
+        if self.guard is not None and self.guard.is_expensive(rule):
+            self.isolated.append(rule)
+            return
+
+        keywords = rule_keywords(rule.rule_text)
+        if not keywords:
+            self.fallback.append(rule)
+        else:
+            keyword = pick_keyword(keywords, self.buckets)
+            self.buckets.setdefault(keyword, []).append(rule)
+
+    def add(self, rule):
+        """
+        Add a rule to the index. Only the part of the index the rule
+        is put into (a keyword bucket regex, the literal automaton or
+        the fallback regex) is compiled again.
+
+        >>> from adblockparser import AdblockRule
+        >>> index = RuleIndex([AdblockRule("adv")])
+        >>> index.search("http://example.com/banner.gif")
+        False
+        >>> rule = AdblockRule("/banner.gif")
+        >>> index.add(rule)
+        >>> index.search("http://example.com/banner.gif")
+        True
+        >>> index.remove(rule)
+        >>> index.search("http://example.com/banner.gif")
+        False
+        """
+        self._add(rule)
+        self._invalidate(rule)
+        if self.fallback and self.fallback[-1] is rule:
+            # compile it now to raise errors for invalid regex rules early
+            try:
+                self._fallback_re = self._combined([r.regex for r in self.fallback])
+            except Exception:
+                self.remove(rule)
+                raise
+
+    def remove(self, rule):
+        """
+        Remove a rule from the index. ValueError is raised
+        if the rule is not in the index.
+        """
+        if _matches_all_urls(rule):
+            self.match_all.remove(rule)
+        elif rule_host(rule.rule_text) is not None:
+            self.hosts.remove(rule)
+        elif any(r is rule for r in self.isolated):
+            self.isolated = [r for r in self.isolated if r is not rule]
+            self._isolated_re.pop(id(rule), None)
+        elif not self._remove_literal(rule):
+            for keyword in rule_keywords(rule.rule_text):
+                bucket = self.buckets.get(keyword, ())
+                if any(r is rule for r in bucket):
+                    bucket.remove(rule)
+                    if not bucket:
+                        del self.buckets[keyword]
+                    break
+            else:
+                self.fallback.remove(rule)
+        self._size -= 1
+        self._invalidate(rule)
+
+    def _remove_literal(self, rule):
+        literal = rule_literal(rule.rule_text)
+        if literal is None:
+            return False
+        key = literal[0].lower()
+        entries = self.literals.get(key, [])
+        for i, entry in enumerate(entries):
+            if entry[0] is rule:
+                del entries[i]
+                if not entries:
+                    del self.literals[key]
+                return True
+        raise ValueError("%r is not in the index" % rule)
+
+    def _invalidate(self, rule):
+        """ Drop compiled data which depends on ``rule``. """
+        if not rule.rule_text or rule_host(rule.rule_text) is not None:
+            # HostTable takes care of its own data
+            return
+        if self.guard is not None and self.guard.is_expensive(rule):
+            return
+        if rule_literal(rule.rule_text) is not None:
+            self._automaton = self._literal_re = None
+            return
+        keywords = rule_keywords(rule.rule_text)
+        for keyword in keywords:
+            self._bucket_re.pop(keyword, None)
+        if not keywords:
+            self._fallback_re = _NOT_COMPILED
+
+    def dump(self, rule_ids):
+        """
+        Return index data as a dict of builtin types; rules are
+        replaced with their ids from ``rule_ids`` mapping
+        (``{id(rule): rule_id}``).
+        """
+        def _ids(rules):
+            return [rule_ids[id(rule)] for rule in rules]
+
+        return {
+            'flags': self.flags,
+            'hosts': dict(
+                (host, _ids(rules)) for host, rules in self.hosts.hosts.items()
+            ),
+            'literals': dict(
+                (key, [(rule_ids[id(rule)], anchors, text)
+                       for rule, anchors, text in entries])
+                for key, entries in self.literals.items()
+            ),
+            'buckets': dict(
+                (keyword, _ids(rules)) for keyword, rules in self.buckets.items()
+            ),
+            'fallback': _ids(self.fallback),
+            'match_all': _ids(self.match_all),
+            'isolated': _ids(self.isolated),
+        }
+
+    @classmethod
+    def restore(cls, data, rules, **kwargs):
+        """
+        Create RuleIndex from ``data`` returned by :meth:`dump`;
+        ``rules`` is a list of rules indexed by rule ids.
+        Extra keyword arguments are passed to RuleIndex constructor.
+        """
+        index = cls(flags=data['flags'], **kwargs)
+        for host, rule_ids in data['hosts'].items():
+            index.hosts.hosts[host] = [rules[rule_id] for rule_id in rule_ids]
+            index.hosts._size += len(rule_ids)
+        index.literals = dict(
+            (key, [(rules[rule_id], anchors, text)
+                   for rule_id, anchors, text in entries])
+            for key, entries in data['literals'].items()
+        )
+        index.buckets = dict(
+            (keyword, [rules[rule_id] for rule_id in rule_ids])
+            for keyword, rule_ids in data['buckets'].items()
+        )
+        index.fallback = [rules[rule_id] for rule_id in data['fallback']]
+        index.match_all = [rules[rule_id] for rule_id in data['match_all']]
+        index.isolated = [rules[rule_id] for rule_id in data['isolated']]
+        index._size = (
+            len(index.hosts) + len(index.fallback) + len(index.match_all) +
+            len(index.isolated) +
+            sum(len(entries) for entries in index.literals.values()) +
+            sum(len(bucket) for bucket in index.buckets.values())
+        )
+        # rules were validated before saving; compile regex on first use
+        index._fallback_re = _NOT_COMPILED
+        return index
+
+    def precompile(self):
+        """
+        Compile all regexes and build the automaton now instead of
+        on first use, so that :meth:`search` doesn't modify the index.
+
+        >>> from adblockparser import AdblockRule
+        >>> index = RuleIndex([AdblockRule("adv"), AdblockRule("/banner/*/img")])
+        >>> index.stats()['compiled_regexes']
+        0
+        >>> index.precompile()
+        >>> index.stats()['compiled_regexes']
+        2
+        """
+        self.hosts.precompile()
+        for keyword in self.buckets:
+            self._get_bucket_re(keyword)
+        if self.literals:
+            if self._automaton is None:
+                self._automaton = self._build_automaton()
+            if self._literal_re is None:
+                self._literal_re = self._combined(
+                    rule.regex for rule in self._literal_rules()
+                )
+        self.fallback_re
+        for rule in self.isolated:
+            self._get_isolated_re(rule)
+
+    @property
+    def fallback_re(self):
+        if self._fallback_re is _NOT_COMPILED:
+            self._fallback_re = self._combined([r.regex for r in self.fallback])
+        return self._fallback_re
+
+    def __len__(self):
+        return self._size
+
+    def search(self, url, request=None):
+        """
+        Return True if any of the rules matches ``url``. ``request`` is
+        an optional object with precomputed ``tokens`` and ``hosts``
+        attributes (e.g. :class:`adblockparser.Request`).
+        """
+        if self.match_all:
+            return True
+        if self.hosts and self.hosts.search(url, request):
+            return True
+        tokens = url_tokens(url) if request is None else request.tokens
+        for keyword in self._keywords(tokens):
+            if self._get_bucket_re(keyword).search(url):
+                return True
+        if self.literals and self._find_literal(url, tokens) is not None:
+            return True
+        if self.fallback_re is not None and self.fallback_re.search(url):
+            return True
+        if self.isolated and self._find_isolated(url) is not None:
+            return True
+        return False
+
+    def find(self, url, request=None):
+        """
+        Return a rule which matches ``url``, or None. Only the part of
+        the index which matched (a host, a keyword bucket, a literal,
+        a shard of the fallback regex) is checked rule-by-rule,
+        so this is almost as fast as :meth:`search`.
+
+        >>> from adblockparser import AdblockRule
+        >>> index = RuleIndex([AdblockRule("||ads.example.com^"), AdblockRule("adv"),
+        ...                    AdblockRule("/banner/*/img^")])
+        >>> index.find("http://example.com/advert.html")
+        AdblockRule('adv')
+        >>> index.find("http://example.com/banner/x/img/1.gif")
+        AdblockRule('/banner/*/img^')
+        >>> print(index.find("http://example.com/"))
+        None
+        """
+        if self.match_all:
+            return self.match_all[0]
+        if self.hosts:
+            rule = self.hosts.find(url, request)
+            if rule is not None:
+                return rule
+        tokens = url_tokens(url) if request is None else request.tokens
+        for keyword in self._keywords(tokens):
+            regex = self._get_bucket_re(keyword)
+            if regex.search(url):
+                return find_rule(self.buckets[keyword], url, self.flags, regex)
+        if self.literals:
+            rule = self._find_literal(url, tokens)
+            if rule is not None:
+                return rule
+        if self.fallback_re is not None and self.fallback_re.search(url):
+            return find_rule(self.fallback, url, self.flags, self.fallback_re)
+        if self.isolated:
+            return self._find_isolated(url)
+        return None
+
+    def _find_isolated(self, url):
+        for rule in self.isolated:
+            if self._get_isolated_re(rule).search(url):
+                return rule
+        return None
+
+    def _get_isolated_re(self, rule):
+        regex = self._isolated_re.get(id(rule))
+        if regex is None:
+            start_time = time.time()
+            regex = self.guard.compile(rule, self.flags, self.use_re2, self.max_mem)
+            self.compile_time += time.time() - start_time
+            self._isolated_re[id(rule)] = regex
+        return regex
+
+    def _keywords(self, tokens):
+        if tokens is None:
+            return list(self.buckets)
+        return [token for token in tokens if token in self.buckets]
+
+    def _find_literal(self, url, tokens):
+        if tokens is None:
+            # Lowercasing may change the length of a non-ASCII string,
+            # and some non-ASCII characters are equal to ASCII letters
+            # when compared case-insensitively; use regexes instead.
+            if self._literal_re is None:
+                self._literal_re = self._combined(
+                    rule.regex for rule in self._literal_rules()
+                )
+            if not self._literal_re.search(url):
+                return None
+            return find_rule(self._literal_rules(), url, self.flags, self._literal_re)
+
+        ignore_case = self.flags & re.IGNORECASE
+        if self._automaton is None:
+            self._automaton = self._build_automaton()
+        for end, (length, entries) in self._automaton.iter(url.lower()):
+            start, end = end - length + 1, end + 1
+            for rule, anchors, text in entries:
+                if not ignore_case and url[start:end] != text:
+                    continue
+                if _anchors_match(url, start, end, anchors):
+                    return rule
+        return None
+
+    def _literal_rules(self):
+        return [rule for entries in self.literals.values() for rule, anchors, text in entries]
+
+    def _build_automaton(self):
+        return make_automaton(
+            ((text, (len(text), entries)) for text, entries in self.literals.items()),
+            use_pyahocorasick=self.use_pyahocorasick
+        )
+
+    def _get_bucket_re(self, keyword):
+        regex = self._bucket_re.get(keyword)
+        if regex is None:
+            regex = self._combined([r.regex for r in self.buckets[keyword]])
+            self._bucket_re[keyword] = regex
+        return regex
+
+    def _combined(self, regexes):
+        start_time = time.time()
+        try:
+            return _combined_regex(regexes, flags=self.flags, use_re2=self.use_re2,
+                                   max_mem=self.max_mem, shard_size=self.shard_size)
+        finally:
+            self.compile_time += time.time() - start_time
+
+    def stats(self):
+        """
+        Return a dict with index statistics: number of rules of each
+        kind, the number of currently compiled regexes (shards)
+        and total time spent compiling them, in seconds.
+
+        >>> from adblockparser import AdblockRule
+        >>> index = RuleIndex([AdblockRule("adv"), AdblockRule("/banner/*/img"),
+        ...                    AdblockRule("/ad*/")])
+        >>> stats = index.stats()
+        >>> stats['literal_rules'], stats['bucket_rules'], stats['fallback_rules']
+        (1, 1, 1)
+        >>> stats['compiled_regexes']
+        1
+        """
+        compiled = list(self._bucket_re.values())
+        compiled.extend([self._literal_re, self._fallback_re])
+        return {
+            'rules': len(self),
+            'host_rules': len(self.hosts),
+            'literal_rules': sum(len(entries) for entries in self.literals.values()),
+            'buckets': len(self.buckets),
+            'bucket_rules': sum(len(rules) for rules in self.buckets.values()),
+            'largest_bucket': max([len(rules) for rules in self.buckets.values()] or [0]),
+            'fallback_rules': len(self.fallback),
+            'match_all_rules': len(self.match_all),
+            'isolated_rules': len(self.isolated),
+            'compiled_regexes': (sum(_regex_count(regex) for regex in compiled) +
+                                 self.hosts.compiled_regexes() +
+                                 len(self._isolated_re)),
+            'compile_time': self.compile_time,
+        }
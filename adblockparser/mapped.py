@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only rule index stored in a flat binary file and accessed via mmap.
+
+``AdblockRules`` keeps an ``AdblockRule`` instance (with option and domain
+dicts) for every rule; with many worker processes on a host it adds up.
+``MappedAdblockRules`` queries a file written by
+``MappedAdblockRules.build`` without creating per-rule Python objects,
+so the OS page cache keeps a single copy of the data shared by
+all processes which open the file.
+
+File layout: magic bytes, format version, length of JSON metadata and
+the metadata itself, followed by binary sections (little-endian)
+whose offsets are listed in the metadata:
+
+* ``rules`` - fixed-size rule records (flags, option bitmasks,
+  regex location, domain entries location);
+* ``domain_entries`` - ``(string offset, string length, required)``
+  records for ``domain`` options of rules;
+* ``strings`` - UTF-8 encoded regexes, keywords and domains;
+* ``ids`` - arrays of rule ids;
+* hash tables (open addressing, CRC32 of UTF-8 key) mapping keywords
+  of option-less rules and required domains of rules with options
+  to arrays of rule ids.
+"""
+from __future__ import absolute_import
+import json
+import mmap
+import re
+import struct
+import zlib
+
+from adblockparser.index import rule_keywords, url_tokens, pick_keyword
+from adblockparser.parser import _domain_variants
+from adblockparser.utils import _combined_regex
+
+MAGIC = b'ABPMMAP\x00'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+# flags, true mask, false mask, required mask, regex offset, regex length,
+# first domain entry, domain entries count
+_RULE = struct.Struct('<BxxxQQQIIII')
+_DOMAIN_ENTRY = struct.Struct('<IIB3x')
+# key offset, key length, ids offset, ids count (0 for empty slots)
+_SLOT = struct.Struct('<IIII')
+_ID = struct.Struct('<I')
+
+_HAS_DOMAIN_OPTION = 1
+
+
+class MappedAdblockRules(object):
+    """
+    Read-only AdblockRules counterpart which uses a memory-mapped file
+    written by :meth:`build`.
+
+    >>> import os, tempfile
+    >>> from adblockparser import AdblockRules
+    >>> path = os.path.join(tempfile.mkdtemp(), 'rules.mmap')
+    >>> MappedAdblockRules.build(AdblockRules(["||ads.example.com^", "@@advice.$~script"]), path)
+    >>> rules = MappedAdblockRules(path)
+    >>> rules.should_block("http://ads.example.com/banner.gif")
+    True
+    >>> rules.should_block("http://example.com/advice.html", {'script': False})
+    False
+    >>> rules.close()
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.meta = self._read_meta(path)
+        except Exception:
+            self._mm.close()
+            raise
+
+        self.skip_unsupported_rules = self.meta['skip_unsupported_rules']
+        self.option_bits = dict(
+            (name, 1 << bit) for bit, name in enumerate(self.meta['options'])
+        )
+        self._sections = self.meta['sections']
+
+        # Compiled regexes are cached per process; only rules which
+        # were candidates for some URL are compiled.
+        self._regexes = {}
+        self._fallback_re = {}
+
+    def _read_meta(self, path):
+        if len(self._mm) < _HEADER.size:
+            raise ValueError("Not a MappedAdblockRules file: %s" % path)
+        magic, version, meta_length = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a MappedAdblockRules file: %s" % path)
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported format version: %s" % version)
+        meta = self._mm[_HEADER.size:_HEADER.size + meta_length]
+        return json.loads(meta.decode('utf8'))
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def should_block(self, url, options=None):
+        options = options or {}
+        if self._matches(url, options, 'whitelist'):
+            return False
+        if self._matches(url, options, 'blacklist'):
+            return True
+        return False
+
+    def should_block_many(self, urls, options=None):
+        """
+        Return a list of ``should_block`` results for ``urls``.
+        ``options`` is either a dict shared by all URLs, or an iterable
+        of dicts with one item per URL; ValueError is raised if their
+        number is different.
+        """
+        if options is None or isinstance(options, dict):
+            return [self.should_block(url, options) for url in urls]
+        urls, options = list(urls), list(options)
+        if len(urls) != len(options):
+            raise ValueError("Got %d URLs and %d options" % (len(urls), len(options)))
+        return [self.should_block(url, opts) for url, opts in zip(urls, options)]
+
+    def _matches(self, url, options, kind):
+        fallback_re = self._get_fallback_re(kind)
+        if fallback_re is not None and fallback_re.search(url):
+            return True
+
+        table = kind + '_keywords'
+        tokens = url_tokens(url)
+        if tokens is None:
+            keyword_ids = self._all_table_ids(table)
+        else:
+            keyword_ids = (
+                rule_id
+                for token in tokens
+                for rule_id in self._lookup(table, token)
+            )
+        for rule_id in keyword_ids:
+            if self._rule_regex(rule_id, re.IGNORECASE).search(url):
+                return True
+
+        present, true_mask, false_mask = self._options_masks(options)
+        rule_ids = []
+        if 'domain' in options:
+            for domain in _domain_variants(options['domain']):
+                rule_ids.extend(self._lookup(kind + '_domains', domain))
+        rule_ids.extend(self._id_list(kind + '_with_options'))
+
+        for rule_id in rule_ids:
+            (flags, rule_true, rule_false, required, regex_offset, regex_length,
+             domains_offset, domains_count) = self._rule(rule_id)
+
+            if required & ~present:
+                if self.skip_unsupported_rules:
+                    continue
+                raise ValueError("Rule requires option %s" % self._missing_option(
+                    required & ~present))
+            if rule_true & ~true_mask or rule_false & ~false_mask:
+                continue
+            if flags & _HAS_DOMAIN_OPTION and not self._domain_matches(
+                    domains_offset, domains_count, options['domain']):
+                continue
+            if self._rule_regex(rule_id, 0).search(url):
+                return True
+        return False
+
+    def _options_masks(self, options):
+        present = true_mask = false_mask = 0
+        for name, value in options.items():
+            bit = self.option_bits.get(name)
+            if bit is None:
+                continue
+            present |= bit
+            # values are compared the same way AdblockRule.match_url does
+            if value == True:
+                true_mask |= bit
+            elif value == False:
+                false_mask |= bit
+        return present, true_mask, false_mask
+
+    def _missing_option(self, mask):
+        for name, bit in self.option_bits.items():
+            if mask & bit:
+                return name
+
+    def _domain_matches(self, offset, count, domain):
+        base = self._sections['domain_entries'] + offset * _DOMAIN_ENTRY.size
+        domain_rules = {}
+        for i in range(count):
+            str_offset, str_length, required = _DOMAIN_ENTRY.unpack_from(
+                self._mm, base + i * _DOMAIN_ENTRY.size)
+            domain_rules[self._string(str_offset, str_length)] = bool(required)
+
+        for variant in _domain_variants(domain):
+            if variant in domain_rules:
+                return domain_rules[variant]
+        return not any(domain_rules.values())
+
+    def _rule(self, rule_id):
+        return _RULE.unpack_from(self._mm, self._sections['rules'] + rule_id * _RULE.size)
+
+    def _rule_regex(self, rule_id, flags):
+        regex = self._regexes.get(rule_id)
+        if regex is None:
+            rule = self._rule(rule_id)
+            regex = re.compile(self._string(rule[4], rule[5]), flags)
+            self._regexes[rule_id] = regex
+        return regex
+
+    def _get_fallback_re(self, kind):
+        if kind not in self._fallback_re:
+            regexes = []
+            for rule_id in self._id_list(kind + '_fallback'):
+                rule = self._rule(rule_id)
+                regexes.append(self._string(rule[4], rule[5]))
+            self._fallback_re[kind] = _combined_regex(regexes)
+        return self._fallback_re[kind]
+
+    def _string(self, offset, length):
+        start = self._sections['strings'] + offset
+        return self._mm[start:start + length].decode('utf8')
+
+    def _ids(self, offset, count):
+        start = self._sections['ids'] + offset * _ID.size
+        return struct.unpack_from('<%dI' % count, self._mm, start)
+
+    def _id_list(self, name):
+        offset, count = self._sections[name]
+        return self._ids(offset, count)
+
+    def _lookup(self, table, key):
+        table_offset, size = self._sections[table]
+        if not size:
+            return ()
+        key_bytes = key.encode('utf8')
+        strings = self._sections['strings']
+        slot = zlib.crc32(key_bytes) & (size - 1)
+        while True:
+            key_offset, key_length, ids_offset, ids_count = _SLOT.unpack_from(
+                self._mm, table_offset + slot * _SLOT.size)
+            if not ids_count:
+                return ()
+            if (key_length == len(key_bytes) and
+                    self._mm[strings + key_offset:strings + key_offset + key_length] == key_bytes):
+                return self._ids(ids_offset, ids_count)
+            slot = (slot + 1) & (size - 1)
+
+    def _all_table_ids(self, table):
+        table_offset, size = self._sections[table]
+        for slot in range(size):
+            key_offset, key_length, ids_offset, ids_count = _SLOT.unpack_from(
+                self._mm, table_offset + slot * _SLOT.size)
+            for rule_id in self._ids(ids_offset, ids_count):
+                yield rule_id
+
+    @classmethod
+    def build(cls, rules, path):
+        """ Write AdblockRules instance ``rules`` to a file at ``path``. """
+        _Builder(rules).write(path)
+
+
+class _Builder(object):
+    def __init__(self, rules):
+        self.rules = rules
+        self.strings = bytearray()
+        self.string_offsets = {}
+        self.ids = []
+        self.domain_entries = []
+        self.rule_ids = {}
+        self.rule_records = []
+
+        option_names = set()
+        for rule in rules.rules:
+            option_names.update(rule.options)
+        option_names.discard('match-case')
+        self.option_names = sorted(option_names)
+        self.option_bits = dict(
+            (name, 1 << bit) for bit, name in enumerate(self.option_names)
+        )
+        if len(self.option_names) > 64:
+            raise ValueError("Too many distinct rule options")
+
+        for rule in rules.rules:
+            self._add_rule(rule)
+
+    def _add_string(self, text):
+        if text not in self.string_offsets:
+            data = text.encode('utf8')
+            self.string_offsets[text] = (len(self.strings), len(data))
+            self.strings.extend(data)
+        return self.string_offsets[text]
+
+    def _add_ids(self, rules):
+        offset = len(self.ids)
+        self.ids.extend(self.rule_ids[id(rule)] for rule in rules)
+        return offset, len(rules)
+
+    def _add_rule(self, rule):
+        self.rule_ids[id(rule)] = len(self.rule_records)
+        flags = required = true_mask = false_mask = 0
+        for name, value in rule.options.items():
+            if name == 'match-case':
+                continue
+            bit = self.option_bits[name]
+            required |= bit
+            if name == 'domain':
+                flags |= _HAS_DOMAIN_OPTION
+            elif value:
+                true_mask |= bit
+            else:
+                false_mask |= bit
+
+        domains = rule.options.get('domain', {})
+        domains_offset = len(self.domain_entries)
+        for domain, domain_required in domains.items():
+            str_offset, str_length = self._add_string(domain)
+            self.domain_entries.append((str_offset, str_length, domain_required))
+
+        regex_offset, regex_length = self._add_string(rule.regex)
+        self.rule_records.append((
+            flags, true_mask, false_mask, required, regex_offset, regex_length,
+            domains_offset, len(domains)
+        ))
+
+    def _hash_table(self, mapping):
+        size = 1
+        while size < len(mapping) * 2:
+            size *= 2
+        if not mapping:
+            size = 0
+        slots = [None] * size
+        for key, rules in mapping.items():
+            key_offset, key_length = self._add_string(key)
+            ids_offset, ids_count = self._add_ids(rules)
+            slot = zlib.crc32(key.encode('utf8')) & (size - 1)
+            while slots[slot] is not None:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = (key_offset, key_length, ids_offset, ids_count)
+        return slots
+
+    def _keyword_table(self, basic_rules):
+        buckets, fallback = {}, []
+        for rule in basic_rules:
+            keywords = rule_keywords(rule.rule_text)
+            if not keywords:
+                fallback.append(rule)
+                continue
+            keyword = pick_keyword(keywords, buckets)
+            buckets.setdefault(keyword, []).append(rule)
+        return self._hash_table(buckets), fallback
+
+    def write(self, path):
+        rules = self.rules
+        tables, id_lists = {}, {}
+        for kind in ['blacklist', 'whitelist']:
+            slots, fallback = self._keyword_table(getattr(rules, kind))
+            tables[kind + '_keywords'] = slots
+            id_lists[kind + '_fallback'] = self._add_ids(fallback)
+            id_lists[kind + '_with_options'] = self._add_ids(
+                getattr(rules, kind + '_with_options'))
+            tables[kind + '_domains'] = self._hash_table(
+                getattr(rules, kind + '_require_domain'))
+
+        body = bytearray()
+        sections = {}
+
+        def _section(name, data):
+            sections[name] = len(body)
+            body.extend(data)
+
+        _section('rules', b''.join(_RULE.pack(*r) for r in self.rule_records))
+        _section('domain_entries', b''.join(
+            _DOMAIN_ENTRY.pack(*e) for e in self.domain_entries))
+        _section('strings', bytes(self.strings))
+        _section('ids', struct.pack('<%dI' % len(self.ids), *self.ids))
+        for name, slots in tables.items():
+            _section(name, b''.join(
+                _SLOT.pack(*(slot or (0, 0, 0, 0))) for slot in slots))
+
+        def _meta(header_size):
+            absolute = dict(
+                (name, offset + header_size) for name, offset in sections.items()
+            )
+            for name, slots in tables.items():
+                absolute[name] = (absolute[name], len(slots))
+            for name, value in id_lists.items():
+                absolute[name] = value
+            return json.dumps({
+                'options': self.option_names,
+                'skip_unsupported_rules': rules.skip_unsupported_rules,
+                'sections': absolute,
+            }, sort_keys=True).encode('utf8')
+
+        # offsets in metadata depend on its length; the length
+        # stabilizes after a couple of iterations
+        header_size = _HEADER.size
+        while True:
+            meta = _meta(header_size)
+            new_header_size = _HEADER.size + len(meta)
+            if new_header_size == header_size:
+                break
+            header_size = new_header_size
+
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)))
+            f.write(meta)
+            f.write(body)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Checking large batches of URLs using several processes.
+"""
+from __future__ import absolute_import
+import multiprocessing
+from itertools import islice
+
+from adblockparser.parser import AdblockRules
+
+try:
+    from itertools import izip as zip  # Python 2
+except ImportError:
+    pass
+
+# AdblockRules instances shared with worker processes, by id.
+# Forked workers inherit this dict, so rules are not sent to them at all.
+_SHARED_RULES = {}
+
+# AdblockRules instance used in a worker process.
+_worker_rules = None
+
+
+class ParallelAdblockRules(object):
+    """
+    ParallelAdblockRules checks batches of URLs against AdBlock rules
+    using a pool of worker processes.
+
+    Rules are parsed and indexed once, in the current process.
+    When worker processes are started using ``fork`` (the default on
+    Unix) they inherit the rules from the parent, without any
+    serialization. With other start methods each worker builds
+    its own ``AdblockRules`` instance from rule texts.
+
+    ``rules`` is either an ``AdblockRules`` instance or a list of rules;
+    in the latter case extra keyword arguments are passed
+    to ``AdblockRules`` constructor.
+
+    >>> with ParallelAdblockRules(["||ads.example.com^"], processes=2) as rules:
+    ...     rules.should_block_many([
+    ...         "http://ads.example.com/banner.gif",
+    ...         "http://example.com/",
+    ...     ])
+    [True, False]
+    """
+
+    def __init__(self, rules, processes=None, chunksize=1000, start_method=None,
+                 **kwargs):
+        if isinstance(rules, AdblockRules):
+            self.rules = rules
+        else:
+            self.rules = AdblockRules(rules, **kwargs)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        self.start_method = start_method
+        self._pool = None
+
+    def should_block(self, url, options=None):
+        """ Check a single URL in the current process. """
+        return self.rules.should_block(url, options)
+
+    def should_block_many(self, urls, options=None):
+        """
+        Return a list of ``should_block`` results for ``urls``, computed
+        in worker processes. Results are in the same order as ``urls``.
+
+        ``options`` is either a dict shared by all URLs, or an iterable
+        of dicts (one per URL) - see ``AdblockRules.should_block_many``.
+        URLs are sent to workers in chunks of ``chunksize`` URLs.
+        """
+        if not (options is None or isinstance(options, dict)):
+            urls, options = list(urls), list(options)
+            if len(urls) != len(options):
+                raise ValueError("Got %d URLs and %d options" % (
+                    len(urls), len(options)))
+        pool = self._get_pool()
+        results = []
+        for chunk_results in pool.imap(_should_block_chunk,
+                                       _chunks(urls, options, self.chunksize)):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        """ Stop worker processes. """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        _SHARED_RULES.pop(id(self), None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_pool(self):
+        if self._pool is None:
+            context = _get_context(self.start_method)
+            if _start_method(context) == 'fork':
+                _SHARED_RULES[id(self)] = self.rules
+                initargs = (id(self), None)
+            else:
+                initargs = (None, _rules_state(self.rules))
+            self._pool = context.Pool(self.processes, _init_worker, initargs)
+        return self._pool
+
+
+def _get_context(start_method):
+    if not hasattr(multiprocessing, 'get_context'):  # Python 2
+        return multiprocessing
+    return multiprocessing.get_context(start_method)
+
+
+def _start_method(context):
+    if not hasattr(context, 'get_start_method'):  # Python 2
+        return 'fork'
+    return context.get_start_method()
+
+
+def _rules_state(rules):
+    """
+    Return data needed to build a copy of ``rules``
+    AdblockRules instance in another process.
+    """
+    rule_texts = [rule.raw_rule_text for rule in rules.rules]
+    kwargs = rules._settings()
+    return rule_texts, kwargs
+
+
+def _init_worker(shared_id, state):
+    global _worker_rules
+    if shared_id is not None:
+        _worker_rules = _SHARED_RULES[shared_id]
+    else:
+        rule_texts, kwargs = state
+        _worker_rules = AdblockRules(rule_texts, **kwargs)
+
+
+def _should_block_chunk(chunk):
+    urls, options = chunk
+    return _worker_rules.should_block_many(urls, options)
+
+
+def _chunks(urls, options, chunksize):
+    """
+    Split ``urls`` and ``options`` into ``(urls, options)`` chunks.
+
+    >>> list(_chunks(["a", "b", "c"], None, 2))
+    [(['a', 'b'], None), (['c'], None)]
+    >>> list(_chunks(["a", "b", "c"], [{'script': True}, {}, {}], 2))
+    [(['a', 'b'], [{'script': True}, {}]), (['c'], [{}])]
+    """
+    if options is None or isinstance(options, dict):
+        urls = iter(urls)
+        while True:
+            chunk = list(islice(urls, chunksize))
+            if not chunk:
+                return
+            yield chunk, options
+    else:
+        pairs = zip(urls, options)
+        while True:
+            chunk = list(islice(pairs, chunksize))
+            if not chunk:
+                return
+            yield [url for url, _ in chunk], [opts for _, opts in chunk]
@@ -1,9 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import re
-from collections import defaultdict
+from collections import defaultdict, Counter
 from functools import partial
-from adblockparser.utils import split_data
+from itertools import repeat, chain
+from adblockparser.utils import (
+    split_data, LRUCache, _combined_regex, _is_re2_supported, _domain_variants
+)
+from adblockparser.index import (
+    RuleIndex, HostTable, rule_host, url_tokens, url_hosts, find_rule,
+    _strip_anchors, _is_regex_rule, _matches_all_urls
+)
+from adblockparser.elemhide import ElementHidingIndex
+from adblockparser.filterlist import FilterList
+from adblockparser.pruning import prune_rules, restorable_rules
+from adblockparser.stats import MatchStats
+from adblockparser.complexity import RegexGuard
+from adblockparser import serialization
+
+try:
+    from itertools import izip as zip  # Python 2
+except ImportError:
+    pass
+
+try:
+    basestring  # Python 2
+except NameError:
+    basestring = str
 
 
 class AdblockParsingError(ValueError):
@@ -79,13 +102,19 @@ class AdblockRule(object):
     OPTIONS_SPLIT_PAT = ',(?=~?(?:%s))' % ('|'.join(BINARY_OPTIONS + ["domain"]))
     OPTIONS_SPLIT_RE = re.compile(OPTIONS_SPLIT_PAT)
 
+    # a bit for each option, used in option bitmasks
+    OPTION_BITS = dict(
+        (name, 1 << bit) for bit, name in enumerate(BINARY_OPTIONS + ["domain"])
+    )
+
     __slots__ = ['raw_rule_text', 'is_comment', 'is_html_rule', 'is_exception',
-                 'raw_options', 'options', '_options_keys', 'rule_text',
-                 'regex', 'regex_re']
+                 'raw_options', 'options', '_options_keys', '_option_masks',
+                 'rule_text', '_regex', 'regex_re']
 
-    def __init__(self, rule_text):
+    def __init__(self, rule_text, lazy=False):
         self.raw_rule_text = rule_text
         self.regex_re = None
+        self._regex = None
 
         rule_text = rule_text.strip()
         self.is_comment = not rule_text or rule_text.startswith(('!', '[Adblock'))
@@ -97,24 +126,55 @@ class AdblockRule(object):
             if self.is_exception:
                 rule_text = rule_text[2:]
 
-        if not self.is_comment and '$' in rule_text:
+        # CSS selectors of element hiding rules can contain '$'
+        if not self.is_comment and not self.is_html_rule and '$' in rule_text:
             rule_text, options_text = rule_text.split('$', 1)
             self.raw_options = self._split_options(options_text)
             self.options = dict(self._parse_option(opt) for opt in self.raw_options)
         else:
             self.raw_options = []
             self.options = {}
-        self._options_keys = frozenset(self.options.keys()) - set(['match-case'])
+        if self.options:
+            self._options_keys = frozenset(self.options.keys()) - set(['match-case'])
+            self._option_masks = self._compute_option_masks()
+        else:
+            # most rules don't have options; they share these values
+            self._options_keys = _NO_OPTIONS
+            self._option_masks = _NO_OPTION_MASKS
 
         self.rule_text = rule_text
 
+        if not lazy:
+            self._regex = self._to_regex()
+        elif rule_text == '/':
+            # the only rule text rule_to_regex rejects;
+            # raise the error early, like in non-lazy mode
+            raise AdblockParsingError('Invalid rule')
+
+    @property
+    def regex(self):
+        r"""
+        Regex for the rule. With ``lazy=True`` it is created
+        on first access.
+
+        >>> rule = AdblockRule("||ads.example.com^", lazy=True)
+        >>> print(rule.regex)
+        ^(?:[^:/?#]+:)?(?://(?:[^/?#]*\.)?)?ads\.example\.com(?:[^\w\-.%]|$)
+        """
+        if self._regex is None:
+            self._regex = self._to_regex()
+        return self._regex
+
+    @regex.setter
+    def regex(self, value):
+        self._regex = value
+
+    def _to_regex(self):
         if self.is_comment or self.is_html_rule:
-            # TODO: add support for HTML rules.
-            # We should split the rule into URL and HTML parts,
-            # convert URL part to a regex and parse the HTML part.
-            self.regex = ''
-        else:
-            self.regex = self.rule_to_regex(rule_text)
+            # element hiding rules don't match URLs;
+            # they are handled by ElementHidingIndex
+            return ''
+        return self.rule_to_regex(self.rule_text)
 
     def match_url(self, url, options=None):
         """
@@ -122,8 +182,22 @@ class AdblockRule(object):
 
         What to do if rule is matched is up to developer. Most likely
         ``.is_exception`` attribute should be taken in account.
+
+        ``url`` can also be a :class:`Request` instance; ``options``
+        are taken from it then.
         """
+        if isinstance(url, Request):
+            request, url = url, url.url
+            if not self._options_match(request.options, request.domain_variants):
+                return False
+            return self._url_matches(url)
+
         options = options or {}
+        if not self._options_match(options):
+            return False
+        return self._url_matches(url)
+
+    def _options_match(self, options, domain_variants=None):
         for optname in self.options:
             if optname == 'match-case':  # TODO
                 continue
@@ -132,18 +206,51 @@ class AdblockRule(object):
                 raise ValueError("Rule requires option %s" % optname)
 
             if optname == 'domain':
-                if not self._domain_matches(options['domain']):
+                if not self._domain_matches(options['domain'], domain_variants):
                     return False
                 continue
 
             if options[optname] != self.options[optname]:
                 return False
+        return True
 
-        return self._url_matches(url)
+    def _compute_option_masks(self):
+        """
+        Return ``(required, required_true, required_false)`` bitmasks
+        for rule options (see ``OPTION_BITS``), or None if the rule
+        uses an option which doesn't have a bit.
+
+        >>> rule = AdblockRule("adv$script,~third-party,domain=~example.com")
+        >>> masks = rule._compute_option_masks()
+        >>> bits = AdblockRule.OPTION_BITS
+        >>> masks == (bits['script'] | bits['third-party'] | bits['domain'],
+        ...           bits['script'], bits['third-party'])
+        True
+        >>> print(AdblockRule("adv$popup")._compute_option_masks())
+        None
+        """
+        required = required_true = required_false = 0
+        for name, value in self.options.items():
+            if name == 'match-case':
+                continue
+            bit = self.OPTION_BITS.get(name)
+            if bit is None:
+                return None
+            required |= bit
+            if name == 'domain':
+                continue
+            if value:
+                required_true |= bit
+            else:
+                required_false |= bit
+        return required, required_true, required_false
 
-    def _domain_matches(self, domain):
+    def _domain_matches(self, domain, domain_variants=None):
+        # ``domain_variants`` are precomputed _domain_variants(domain)
         domain_rules = self.options['domain']
-        for domain in _domain_variants(domain):
+        if domain_variants is None:
+            domain_variants = _domain_variants(domain)
+        for domain in domain_variants:
             if domain in domain_rules:
                 return domain_rules[domain]
         return not any(domain_rules.values())
@@ -153,6 +260,11 @@ class AdblockRule(object):
             self.regex_re = re.compile(self.regex)
         return bool(self.regex_re.search(url))
 
+    def precompile(self):
+        """ Create and compile the regex now instead of on first use. """
+        if self.regex_re is None:
+            self.regex_re = re.compile(self.regex)
+
     def matching_supported(self, options=None):
         """
         Return whether this rule can return meaningful result,
@@ -186,7 +298,7 @@ class AdblockRule(object):
         if self.is_comment:
             return False
 
-        if self.is_html_rule:  # HTML rules are not supported yet
+        if self.is_html_rule:  # it is not matched against URLs
             return False
 
         options = options or {}
@@ -233,6 +345,18 @@ class AdblockRule(object):
                 raise AdblockParsingError('Invalid rule')
             return rule
 
+        # Consecutive wildcards are the same as one; leading and trailing
+        # wildcards don't change what the rule matches, unless they
+        # hide an anchor or make the rule look like a regex.
+        # | which is not an anchor is escaped together with the next
+        # character below, so such rules are left as is.
+        if '|' not in _strip_anchors(rule)[0]:
+            rule = re.sub(r"\*\*+", "*", rule)
+            stripped = rule.strip('*')
+            if stripped and stripped[0] != '|' and stripped[-1] != '|' and \
+                    not _is_regex_rule(stripped):
+                rule = stripped
+
         # escape special regex characters
         rule = re.sub(r"([.$+?{}()\[\]\\])", r"\\\1", rule)
 
@@ -243,8 +367,8 @@ class AdblockRule(object):
 
         # Separator character ^ matches anything but a letter, a digit, or
         # one of the following: _ - . %. The end of the address is also
-        # accepted as separator.
-        rule = rule.replace("^", "(?:[^\w\d_\-.%]|$)")
+        # accepted as separator. \w already includes digits and _.
+        rule = rule.replace("^", r"(?:[^\w\-.%]|$)")
 
         # * symbol
         rule = rule.replace("*", ".*")
@@ -277,6 +401,147 @@ class AdblockRule(object):
         return "AdblockRule(%r)" % self.raw_rule_text
 
 
+class RequestOptions(object):
+    """
+    Options of a request, converted to bitmasks once, so that they can be
+    checked against rule options using a few integer operations.
+
+    ``options`` is a dict, like the one passed to
+    ``AdblockRules.should_block``. ``option_bits`` is a {name: bit} mapping;
+    it defaults to ``AdblockRule.OPTION_BITS``, pass ``rule_cls.OPTION_BITS``
+    if you use a custom rule class.
+
+    RequestOptions instance can be passed to ``AdblockRules.should_block``
+    instead of a dict, to avoid converting the same options many times:
+
+    >>> options = RequestOptions({'script': True, 'domain': 'example.com'})
+    >>> rules = AdblockRules(["adv$script", "banner$~script"])
+    >>> rules.should_block("http://example.com/advert.js", options)
+    True
+    >>> rules.should_block("http://example.com/banner.js", options)
+    False
+    """
+
+    __slots__ = ['options', 'present_mask', 'true_mask', 'false_mask',
+                 'domain_variants']
+
+    def __init__(self, options=None, option_bits=None):
+        self.options = options or {}
+        if 'domain' in self.options:
+            self.domain_variants = tuple(_domain_variants(self.options['domain']))
+        else:
+            self.domain_variants = ()
+        if option_bits is None:
+            option_bits = AdblockRule.OPTION_BITS
+        self.present_mask = self.true_mask = self.false_mask = 0
+        for name, value in self.options.items():
+            bit = option_bits.get(name)
+            if bit is None:
+                continue
+            self.present_mask |= bit
+            # rule option values are booleans; compare them
+            # the same way AdblockRule.match_url does
+            if value == True:
+                self.true_mask |= bit
+            elif value == False:
+                self.false_mask |= bit
+
+    def __repr__(self):
+        return "RequestOptions(%r)" % self.options
+
+
+class Request(RequestOptions):
+    """
+    An URL to check, together with its options. Data needed for matching
+    (option bitmasks, variants of the source domain, URL tokens and
+    host names) is computed once, when it is first needed.
+
+    ``options`` is a dict or a :class:`RequestOptions` instance.
+    Request instances can be passed to ``AdblockRules.should_block``
+    and ``AdblockRule.match_url`` instead of an URL and options:
+
+    >>> request = Request("http://ads.example.com:8080/banner.gif",
+    ...                   {'domain': 'www.example.org', 'image': True})
+    >>> request.host
+    'ads.example.com'
+    >>> request.domain_variants
+    ('www.example.org', 'example.org')
+    >>> AdblockRules(["||ads.example.com^$image"]).should_block(request)
+    True
+    >>> AdblockRule("/banner.$domain=example.org").match_url(request)
+    True
+    """
+
+    __slots__ = ['url', '_host', '_tokens', '_hosts']
+
+    def __init__(self, url, options=None, option_bits=None):
+        if isinstance(options, RequestOptions):
+            for name in RequestOptions.__slots__:
+                setattr(self, name, getattr(options, name))
+        else:
+            super(Request, self).__init__(options, option_bits)
+        self.url = url
+        self._host = self._tokens = self._hosts = _NOT_COMPUTED
+
+    @property
+    def host(self):
+        """ Lowercased host name of the URL ('' if there is none). """
+        if self._host is _NOT_COMPUTED:
+            match = _URL_HOST_RE.match(self.url)
+            self._host = match.group(1).lower() if match else ''
+        return self._host
+
+    @property
+    def tokens(self):
+        """ URL tokens, see :func:`adblockparser.index.url_tokens`. """
+        if self._tokens is _NOT_COMPUTED:
+            self._tokens = url_tokens(self.url)
+        return self._tokens
+
+    @property
+    def hosts(self):
+        """
+        Strings ``||host^`` rules are looked up by,
+        see :func:`adblockparser.index.url_hosts`.
+        """
+        if self._hosts is _NOT_COMPUTED:
+            self._hosts = url_hosts(self.url)
+        return self._hosts
+
+    def __repr__(self):
+        return "Request(%r, %r)" % (self.url, self.options)
+
+
+_NOT_COMPUTED = object()
+_URL_HOST_RE = re.compile(r"(?:[^:/?#]+:)?//(?:[^/?#@]*@)?([^:/?#]*)")
+
+
+class MatchResult(object):
+    """
+    A result of ``AdblockRules.match``. ``blocked`` is the verdict
+    (the same as ``should_block`` returns); ``rule`` is a blocking rule
+    which matched the URL, and ``exception`` is an exception rule which
+    matched it (and overrides ``rule``). Both are None if nothing matched.
+
+    MatchResult instances are true if the URL should be blocked.
+    """
+    __slots__ = ['blocked', 'rule', 'exception']
+
+    def __init__(self, blocked, rule=None, exception=None):
+        self.blocked = blocked
+        self.rule = rule
+        self.exception = exception
+
+    def __bool__(self):
+        return self.blocked
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "MatchResult(blocked=%r, rule=%r, exception=%r)" % (
+            self.blocked, self.rule, self.exception)
+
+
 class AdblockRules(object):
     """
     AdblockRules is a class for checking URLs against multiple AdBlock rules.
@@ -284,10 +549,83 @@ class AdblockRules(object):
     It is more efficient to use AdblockRules instead of creating AdblockRule
     instances manually and checking them one-by-one because AdblockRules
     optimizes some common cases.
+
+    With ``lazy=True`` rules are only pre-scanned when AdblockRules
+    is created (comments, exceptions and options are parsed), and
+    their regexes are created when they are needed for matching.
+    This makes startup faster and uses less memory for large lists,
+    because many rules (e.g. rules for domains which are never visited,
+    or rules with keywords which never occur in URLs) are never converted.
+
+    Rules which require a domain are selected, grouped by options and
+    compiled once for each source domain; results are kept in
+    ``domain_cache``, an LRU cache for ``domain_cache_size`` most recently
+    used domains (pass ``domain_cache_size=0`` to disable it). Cache hit
+    and miss counters are available as ``domain_cache.hits`` and
+    ``domain_cache.misses``.
+
+    Rules are combined into regexes of at most ``shard_size`` rules
+    (pass None for no limit); smaller regexes compile faster and
+    need less memory, especially with re2. See :meth:`index_stats`.
+
+    If ``result_cache_size`` is not 0, ``should_block`` results are cached
+    in ``result_cache`` (a thread-safe LRU cache of this size) by URL and
+    options; ``result_cache_ttl`` is an optional time in seconds
+    after which cached results expire. Use ``result_cache.stats()``
+    to get hits, misses and evictions.
+
+    With ``prune=True`` duplicate rules and rules made redundant by other
+    rules with the same options (e.g. ``||ads.example.com^`` when
+    ``||example.com^`` is present) are removed when AdblockRules is created;
+    ``pruning_stats`` tells how many rules were removed. Removed rules
+    are kept in ``pruned_rules``: :meth:`remove_rules` removes a pruned
+    copy of a rule first, and adds back pruned rules which are no longer
+    redundant. Rules added later with :meth:`add_rules` are not pruned. See
+    :func:`adblockparser.pruning.prune_rules` for details.
+
+    With ``collect_stats=True`` ``should_block`` calls are counted and
+    timed by stage in ``match_stats``
+    (an :class:`adblockparser.stats.MatchStats` instance); it is None
+    by default, and then ``should_block`` has no instrumentation overhead.
+    Cached results and ``match`` calls are not counted.
+
+    Some rules can be very slow to match with stdlib re (see
+    :meth:`expensive_rules`). With ``guard_regexes=True`` such rules are
+    not combined with other rules; they are matched one-by-one using re2
+    (if it is used) or a linear-time matcher for wildcard rules.
+
+    AdblockRules compiles regexes lazily, on first use. With
+    ``thread_safe=True`` everything is compiled when rules are created
+    or changed (see :meth:`precompile`), and rules which require a domain
+    are compiled before they are put into ``domain_cache``, so checking
+    URLs from several threads doesn't modify shared state. Updating rules
+    (:meth:`add_rules`, :meth:`remove_rules`) is not thread-safe; update
+    a copy and replace the instance instead.
+
+    Element hiding rules (``##`` and ``#@#``) are kept in ``html_rules``
+    and indexed by domain; use :meth:`get_css_selectors` and
+    :meth:`get_stylesheet` to get CSS selectors for a page. Selectors
+    are cached for ``domain_cache_size`` most recently used domains.
+
+    >>> rules = AdblockRules(["||ads.example.com^"], result_cache_size=100)
+    >>> rules.should_block("http://ads.example.com/banner.gif")
+    True
+    >>> rules.should_block("http://ads.example.com/banner.gif")
+    True
+    >>> rules.result_cache.hits, rules.result_cache.misses
+    (1, 1)
     """
 
+    # should_block_many merges option groups which apply to requests
+    # with the same option bitmasks into a single group once this many
+    # URLs of a batch have these bitmasks.
+    BATCH_INDEX_MIN_URLS = 1000
+
     def __init__(self, rules, supported_options=None, skip_unsupported_rules=True,
-                 use_re2='auto', max_mem=256*1024*1024, rule_cls=AdblockRule):
+                 use_re2='auto', max_mem=256*1024*1024, rule_cls=AdblockRule,
+                 lazy=False, domain_cache_size=1000, result_cache_size=0,
+                 result_cache_ttl=None, shard_size=1000, prune=False,
+                 collect_stats=False, thread_safe=False, guard_regexes=False):
 
         if supported_options is None:
             self.supported_options = rule_cls.BINARY_OPTIONS + ['domain']
@@ -296,17 +634,38 @@ class AdblockRules(object):
 
         self.uses_re2 = _is_re2_supported() if use_re2 == 'auto' else use_re2
         self.re2_max_mem = max_mem
+        self.shard_size = shard_size
         self.rule_cls = rule_cls
         self.skip_unsupported_rules = skip_unsupported_rules
-
-        _params = dict((opt, True) for opt in self.supported_options)
-        self.rules = [
-            r for r in (
-                r if isinstance(r, rule_cls) else rule_cls(r)
-                for r in rules
-            )
-            if (r.regex or r.options) and r.matching_supported(_params)
-        ]
+        self.lazy = lazy
+        self.domain_cache_size = domain_cache_size
+        self.domain_cache = LRUCache(domain_cache_size) if domain_cache_size else None
+        self.result_cache_size = result_cache_size
+        self.result_cache_ttl = result_cache_ttl
+        self.result_cache = None
+        if result_cache_size:
+            self.result_cache = LRUCache(result_cache_size, ttl=result_cache_ttl)
+        self.thread_safe = thread_safe
+        self.guard_regexes = guard_regexes
+        self.regex_guard = RegexGuard() if guard_regexes else None
+        self.async_matcher = None
+        self.collect_stats = collect_stats
+        self.match_stats = None
+        if collect_stats:
+            self.match_stats = MatchStats()
+            self._should_block = self._should_block_with_stats
+
+        self.rules, self.html_rules = self._parse_rules(rules)
+        self.prune = prune
+        self.pruning_stats = {'duplicates': 0, 'subsumed': 0}
+        self.pruned_rules = []
+        if prune:
+            kept, self.pruning_stats = prune_rules(self.rules)
+            kept_ids = set(id(rule) for rule in kept)
+            self.pruned_rules = [rule for rule in self.rules if id(rule) not in kept_ids]
+            self.rules = kept
+        self.elemhide = ElementHidingIndex(self.html_rules, domain_cache_size)
+        self._guard_rules(self.rules)
 
         # "advanced" rules are rules with options,
         # "basic" rules are rules without options
@@ -316,83 +675,928 @@ class AdblockRules(object):
         # if user passes a domain we can discard all rules which
         # require another domain. So we build an index:
         # {domain: [rules_which_require_it]}, and only check
-        # rules which require our domain. If a rule doesn't require any
-        # domain.
-        # TODO: what about ~rules? Should we match them earlier?
+        # rules which require our domain. Rules which only exclude
+        # domains (domain=~example.com) are grouped with other rules
+        # with options; exclusions are checked after the URL matches.
         domain_required_rules, non_domain_rules = split_data(
-            advanced_rules,
-            lambda r: (
-                'domain' in r.options
-                and any(r.options["domain"].values())
-            )
-        )
+            advanced_rules, self._requires_domain)
 
         # split rules into blacklists and whitelists
         self.blacklist, self.whitelist = self._split_bw(basic_rules)
-        _combined = partial(_combined_regex, use_re2=self.uses_re2, max_mem=max_mem)
-        self.blacklist_re = _combined([r.regex for r in self.blacklist])
-        self.whitelist_re = _combined([r.regex for r in self.whitelist])
+        _index = partial(RuleIndex, use_re2=self.uses_re2, max_mem=max_mem,
+                         shard_size=shard_size, guard=self.regex_guard)
+        self.blacklist_index = _index(self.blacklist)
+        self.whitelist_index = _index(self.whitelist)
 
         self.blacklist_with_options, self.whitelist_with_options = \
             self._split_bw(non_domain_rules)
         self.blacklist_require_domain, self.whitelist_require_domain = \
             self._split_bw_domain(domain_required_rules)
+        self._group_rules_with_options()
+
+    def _parse_rules(self, rules):
+        """
+        Return ``(url_rules, html_rules)`` lists of AdblockRule instances
+        for ``rules`` (rule strings or AdblockRule instances): rules which
+        can be matched against URLs and element hiding rules.
+        """
+        rule_cls = self.rule_cls
+        _params = dict((opt, True) for opt in self.supported_options)
+        _rule = partial(rule_cls, lazy=True) if self.lazy else rule_cls
+        url_rules, html_rules = [], []
+        for r in rules:
+            if not isinstance(r, rule_cls):
+                r = _rule(r)
+            if r.is_html_rule:
+                html_rules.append(r)
+            elif ((r.options or not _matches_all_urls(r)) and
+                    r.matching_supported(_params)):
+                url_rules.append(r)
+        return url_rules, html_rules
+
+    @classmethod
+    def _requires_domain(cls, rule):
+        return 'domain' in rule.options and any(rule.options["domain"].values())
+
+    def add_rules(self, rules):
+        """
+        Add ``rules`` (rule strings or AdblockRule instances).
+        Existing rules are not parsed again, and only the affected parts
+        of the indexes are compiled again. Return a list of added
+        AdblockRule instances (comments and unsupported rules are skipped).
+
+        >>> rules = AdblockRules(["||ads.example.com^"])
+        >>> rules.should_block("http://example.com/banner.gif")
+        False
+        >>> rules.add_rules(["/banner.gif", "! comment"])
+        [AdblockRule('/banner.gif')]
+        >>> rules.should_block("http://example.com/banner.gif")
+        True
+        """
+        new_rules, new_html_rules = self._parse_rules(rules)
+        self._guard_rules(new_rules)
+        for i, rule in enumerate(new_rules):
+            try:
+                self._add_rule(rule)
+            except Exception:
+                # the rule is not added; remove rules added before it
+                self.rules.extend(new_rules[:i])
+                self.remove_rules(new_rules[:i])
+                raise
+        self.rules.extend(new_rules)
+        for rule in new_html_rules:
+            self.elemhide.add(rule)
+        self.html_rules.extend(new_html_rules)
+        self._update_rules_with_options(new_rules)
+        return new_rules + new_html_rules
+
+    def remove_rules(self, rules):
+        """
+        Remove ``rules`` (rule strings or AdblockRule instances).
+        A rule string removes one rule with the same text; rules which
+        are not found are ignored. Return a list of removed AdblockRule
+        instances.
+
+        >>> rules = AdblockRules(["||ads.example.com^", "/banner.gif"])
+        >>> rules.remove_rules(["/banner.gif", "adv"])
+        [AdblockRule('/banner.gif')]
+        >>> rules.should_block("http://example.com/banner.gif")
+        False
+        """
+        rules = list(rules)
+        # a pruned copy of a rule is removed before the rule itself
+        all_rules = self.pruned_rules + self.rules + self.html_rules
+        texts = set(item.strip() for item in rules if not isinstance(item, AdblockRule))
+        by_text = defaultdict(list)
+        if texts:
+            for rule in reversed(all_rules):
+                text = rule.raw_rule_text.strip()
+                if text in texts:
+                    by_text[text].append(rule)
+        rule_ids = set(id(rule) for rule in all_rules)
+        pruned_ids = set(id(rule) for rule in self.pruned_rules)
+
+        removed = []
+        removed_ids = set()
+        for item in rules:
+            if isinstance(item, AdblockRule):
+                if id(item) not in rule_ids or id(item) in removed_ids:
+                    continue
+                rule = item
+            else:
+                candidates = by_text.get(item.strip())
+                while candidates and id(candidates[-1]) in removed_ids:
+                    candidates.pop()
+                if not candidates:
+                    continue
+                rule = candidates.pop()
+            if id(rule) not in pruned_ids:
+                self._remove_rule(rule)
+            removed.append(rule)
+            removed_ids.add(id(rule))
+
+        if removed:
+            def _remaining(rule_list):
+                return [rule for rule in rule_list if id(rule) not in removed_ids]
+
+            self.rules = _remaining(self.rules)
+            self.html_rules = _remaining(self.html_rules)
+            self.blacklist = _remaining(self.blacklist)
+            self.whitelist = _remaining(self.whitelist)
+            self.blacklist_with_options = _remaining(self.blacklist_with_options)
+            self.whitelist_with_options = _remaining(self.whitelist_with_options)
+            self.pruned_rules = _remaining(self.pruned_rules)
+            changed = [rule for rule in removed
+                       if not rule.is_html_rule and id(rule) not in pruned_ids]
+            self._update_rules_with_options(changed + self._restore_pruned(changed))
+        return removed
+
+    def _restore_pruned(self, removed):
+        """
+        Add back pruned rules which are no longer redundant after
+        ``removed`` rules were removed; return a list of them.
+        """
+        if not self.pruned_rules or not removed:
+            return []
+        restored = restorable_rules(self.rules, self.pruned_rules, removed)
+        restored_ids = set(id(rule) for rule in restored)
+        self._guard_rules(restored)
+        for rule in restored:
+            self._add_rule(rule)
+        self.rules.extend(restored)
+        self.pruned_rules = [rule for rule in self.pruned_rules
+                             if id(rule) not in restored_ids]
+        return restored
+
+    def apply_diff(self, old_rules, new_rules):
+        """
+        Update rules after a filter list changed from ``old_rules``
+        to ``new_rules`` (lists of rule strings or texts with
+        a rule per line): rules which are only in ``old_rules``
+        are removed, rules which are only in ``new_rules`` are added.
+        Return ``(added, removed)`` lists of AdblockRule instances.
+
+        >>> old = "||ads.example.com^\\n/banner.gif"
+        >>> new = "||ads.example.com^\\n/banner.png"
+        >>> rules = AdblockRules(old.splitlines())
+        >>> rules.apply_diff(old, new)
+        ([AdblockRule('/banner.png')], [AdblockRule('/banner.gif')])
+        """
+        if isinstance(old_rules, basestring):
+            old_rules = old_rules.splitlines()
+        if isinstance(new_rules, basestring):
+            new_rules = new_rules.splitlines()
+        old_counts = Counter(rule.strip() for rule in old_rules)
+        new_counts = Counter(rule.strip() for rule in new_rules)
+        removed = self.remove_rules((old_counts - new_counts).elements())
+        added = self.add_rules((new_counts - old_counts).elements())
+        return added, removed
+
+    def _add_rule(self, rule):
+        if not rule.options:
+            if rule.is_exception:
+                self.whitelist_index.add(rule)
+                self.whitelist.append(rule)
+            else:
+                self.blacklist_index.add(rule)
+                self.blacklist.append(rule)
+        elif self._requires_domain(rule):
+            if rule.is_exception:
+                domain_index = self.whitelist_require_domain
+            else:
+                domain_index = self.blacklist_require_domain
+            for domain, required in rule.options['domain'].items():
+                if required:
+                    domain_index.setdefault(domain, []).append(rule)
+        elif rule.is_exception:
+            self.whitelist_with_options.append(rule)
+        else:
+            self.blacklist_with_options.append(rule)
+
+    def _remove_rule(self, rule):
+        # rules are removed from blacklist, whitelist and *_with_options
+        # lists by the caller, in a single pass
+        if rule.is_html_rule:
+            self.elemhide.remove(rule)
+        elif not rule.options:
+            if rule.is_exception:
+                self.whitelist_index.remove(rule)
+            else:
+                self.blacklist_index.remove(rule)
+        elif self._requires_domain(rule):
+            if rule.is_exception:
+                domain_index = self.whitelist_require_domain
+            else:
+                domain_index = self.blacklist_require_domain
+            for domain, required in rule.options['domain'].items():
+                if required:
+                    _remove_item(domain_index[domain], rule)
+                    if not domain_index[domain]:
+                        del domain_index[domain]
+
+    def _group_rules_with_options(self):
+        # Rules with options (but without required domains) which
+        # have the same option masks are grouped, so that a single mask
+        # check accepts or rejects a whole group. Rules with other
+        # options are checked one-by-one.
+        self._blacklist_groups, self._blacklist_ungrouped = \
+            self._option_groups(self.blacklist_with_options)
+        self._whitelist_groups, self._whitelist_ungrouped = \
+            self._option_groups(self.whitelist_with_options)
+        self._clear_caches()
+        if self.thread_safe:
+            self.precompile()
+
+    def precompile(self):
+        """
+        Compile all regexes which are otherwise compiled on first use:
+        regexes of rule indexes, of rules with options and of their groups
+        (including groups used for rules which exclude domains).
+        Rules which require a domain are still grouped and compiled
+        per source domain, when the domain is seen for the first time.
+
+        >>> rules = AdblockRules(["adv", "/banner/*/img"], lazy=True)
+        >>> rules.index_stats()['blacklist']['compiled_regexes']
+        0
+        >>> rules.precompile()
+        >>> rules.index_stats()['blacklist']['compiled_regexes']
+        2
+        """
+        self.blacklist_index.precompile()
+        self.whitelist_index.precompile()
+        for group in self._blacklist_groups + self._whitelist_groups:
+            group.precompile()
+        for rule_list in chain(self.blacklist_require_domain.values(),
+                               self.whitelist_require_domain.values(),
+                               [self._blacklist_ungrouped, self._whitelist_ungrouped]):
+            for rule in rule_list:
+                rule.precompile()
+
+    def _clear_caches(self):
+        for cache in [self.domain_cache, self.result_cache]:
+            if cache is not None:
+                cache.clear()
+
+    def _settings(self):
+        """
+        Return keyword arguments for creating an AdblockRules instance
+        with the same settings as this one.
+        """
+        return dict(
+            supported_options=self.supported_options,
+            skip_unsupported_rules=self.skip_unsupported_rules,
+            use_re2=self.uses_re2,
+            max_mem=self.re2_max_mem,
+            shard_size=self.shard_size,
+            rule_cls=self.rule_cls,
+            lazy=self.lazy,
+            domain_cache_size=self.domain_cache_size,
+            result_cache_size=self.result_cache_size,
+            result_cache_ttl=self.result_cache_ttl,
+            prune=self.prune,
+            collect_stats=self.collect_stats,
+            thread_safe=self.thread_safe,
+            guard_regexes=self.guard_regexes,
+        )
+
+    def _update_rules_with_options(self, changed_rules):
+        """
+        Update groups and caches after URL rules ``changed_rules``
+        were added or removed. Only groups with the option masks of
+        changed rules are built again, and only ``domain_cache`` entries
+        for domains required by changed rules are dropped.
+        """
+        if not changed_rules:
+            return
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        changed_domains = set()
+        changed_masks = {True: set(), False: set()}
+        for rule in changed_rules:
+            if not rule.options:
+                continue
+            if self._requires_domain(rule):
+                changed_domains.update(
+                    domain for domain, required in rule.options['domain'].items()
+                    if required)
+            else:
+                changed_masks[rule.is_exception].add(rule._option_masks)
+
+        if changed_masks[False]:
+            self._blacklist_groups, self._blacklist_ungrouped = self._option_groups(
+                self.blacklist_with_options,
+                reused_groups=self._unchanged_groups(self._blacklist_groups,
+                                                     changed_masks[False]))
+        if changed_masks[True]:
+            self._whitelist_groups, self._whitelist_ungrouped = self._option_groups(
+                self.whitelist_with_options,
+                reused_groups=self._unchanged_groups(self._whitelist_groups,
+                                                     changed_masks[True]))
+        if changed_domains and self.domain_cache is not None:
+            for domain in self.domain_cache.keys():
+                if any(variant in changed_domains
+                       for variant in _domain_variants(domain)):
+                    self.domain_cache.pop(domain)
+        if self.thread_safe:
+            self.precompile()
+
+    @staticmethod
+    def _unchanged_groups(groups, changed_masks):
+        return dict((group.masks, group) for group in groups
+                    if group.masks not in changed_masks)
+
+    def _option_groups(self, rules, domain_matched=False, reused_groups=None):
+        # If ``domain_matched`` is True, rules are already known to match
+        # the source domain. Otherwise rules with domain option can only
+        # exclude domains; groups check exclusions of rules which match.
+        # Groups from ``reused_groups`` ({masks: group}) are kept as is.
+        reused_groups = reused_groups or {}
+        groups = {}
+        ungrouped = []
+        guard = self.regex_guard
+        for rule in rules:
+            masks = rule._option_masks
+            if masks is None or (not domain_matched and self._requires_domain(rule)):
+                ungrouped.append(rule)
+            elif guard is not None and guard.is_expensive(rule):
+                # its regex_re is compiled by the guard
+                ungrouped.append(rule)
+            else:
+                groups.setdefault(masks, []).append(rule)
+        option_groups = [
+            reused_groups.get(masks) or
+            _OptionGroup(masks, group_rules, self.uses_re2, self.re2_max_mem,
+                         self.shard_size, exclusions=not domain_matched)
+            for masks, group_rules in groups.items()
+        ]
+        if self.thread_safe and domain_matched:
+            # groups for a source domain are shared via domain_cache
+            for group in option_groups:
+                group.precompile()
+        return option_groups, ungrouped
+
+    def _guard_rules(self, rules):
+        """
+        Compile regexes of expensive rules with options using the guard;
+        they are used by ``AdblockRule.match_url`` for ungrouped rules.
+        Expensive rules without options are isolated by RuleIndex.
+        """
+        guard = self.regex_guard
+        if guard is None:
+            return
+        for rule in rules:
+            if rule.options and guard.is_expensive(rule):
+                rule.regex_re = guard.compile(rule, 0, self.uses_re2, self.re2_max_mem)
+
+    def expensive_rules(self):
+        """
+        Return a list of ``(rule, issues)`` tuples for rules which
+        can be slow to match with stdlib re: rules with many wildcards
+        and regex rules with nested quantifiers or many unbounded
+        quantifiers (see :mod:`adblockparser.complexity`).
+
+        >>> rules = AdblockRules(["/banner/*/img", "/ads/*/*/*/*.gif", "/(ad.*)+js/"])
+        >>> rules.expensive_rules()
+        [(AdblockRule('/ads/*/*/*/*.gif'), ['4 unbounded wildcards']), (AdblockRule('/(ad.*)+js/'), ['nested quantifiers'])]
+        """
+        guard = self.regex_guard or RegexGuard()
+        return [
+            (rule, guard.issues(rule)) for rule in self.rules
+            if guard.is_expensive(rule)
+        ]
+
+    def index_stats(self):
+        """
+        Return a dict with statistics of rule indexes: ``blacklist``
+        and ``whitelist`` are :meth:`RuleIndex.stats` dicts for rules
+        without options; the number of groups of rules with options
+        is also returned.
+
+        >>> rules = AdblockRules(["adv", "/ad*/", "@@advice.", "track$script"])
+        >>> stats = rules.index_stats()
+        >>> stats['blacklist']['rules'], stats['whitelist']['rules']
+        (2, 1)
+        >>> stats['option_groups']
+        1
+        """
+        return {
+            'blacklist': self.blacklist_index.stats(),
+            'whitelist': self.whitelist_index.stats(),
+            'option_groups': len(self._blacklist_groups) + len(self._whitelist_groups),
+        }
+
+    def save(self, path, source=None):
+        """
+        Save parsed and indexed rules to a file at ``path``, so that they
+        can be loaded faster using :meth:`load`.
+
+        ``source`` is an optional iterable with rules this instance was
+        created from; if it is passed, its hash is saved as well, and
+        :meth:`load` can check if the file is stale.
+        """
+        source_hash = None
+        if source is not None:
+            source_hash = serialization.rules_hash(source)
+        with open(path, 'wb') as f:
+            serialization.dump(self, f, source_hash=source_hash)
+
+    @classmethod
+    def load(cls, path, source=None, use_re2='auto'):
+        """
+        Load rules saved by :meth:`save` from a file at ``path``.
+
+        If ``source`` (an iterable with rules) is passed,
+        AdblockCacheError is raised when the rules were saved
+        for a different source. AdblockCacheError is also raised if
+        the file is not valid or was saved by an incompatible version
+        of adblockparser.
+
+        Only load files you saved yourself: the file format is based
+        on pickle, and loading untrusted data is not secure.
+        """
+        source_hash = None
+        if source is not None:
+            source_hash = serialization.rules_hash(source)
+        with open(path, 'rb') as f:
+            return serialization.load(cls, f, source_hash=source_hash,
+                                      use_re2=use_re2)
+
+    @classmethod
+    def from_file(cls, source, encoding='utf-8', verify_checksum=True, **kwargs):
+        """
+        Create rules from a filter list file. ``source`` is a file name
+        or a file object; the file is read line by line, and comments
+        are skipped without creating AdblockRule instances. Other keyword
+        arguments are passed to the constructor.
+
+        See :class:`adblockparser.filterlist.FilterList` for details
+        about header and checksum handling.
+        """
+        return cls.from_files([source], encoding=encoding,
+                              verify_checksum=verify_checksum, **kwargs)
+
+    @classmethod
+    def from_files(cls, sources, encoding='utf-8', verify_checksum=True, **kwargs):
+        r"""
+        Create rules from several filter list files (see :meth:`from_file`).
+
+        >>> import io
+        >>> rules = AdblockRules.from_files([
+        ...     io.BytesIO(b"[Adblock Plus 2.0]\n! Title: Ads\n||ads.example.com^\n"),
+        ...     io.BytesIO(b"! Title: Allowed\n@@||ads.example.com/notbanner^\n"),
+        ... ])
+        >>> rules.rules
+        [AdblockRule('||ads.example.com^'), AdblockRule('@@||ads.example.com/notbanner^')]
+        >>> rules.should_block("http://ads.example.com/notbanner")
+        False
+        """
+        lines = chain.from_iterable(
+            FilterList(source, encoding=encoding, verify_checksum=verify_checksum)
+            for source in sources
+        )
+        return cls(lines, **kwargs)
+
+    def get_css_selectors(self, domain):
+        """
+        Return a tuple of unique CSS selectors of elements to hide
+        on pages from ``domain``, with ``#@#`` exceptions applied.
+
+        >>> rules = AdblockRules([
+        ...     "##.ad",
+        ...     "example.com##.sponsored",
+        ...     "example.com##.ad",
+        ...     "shop.example.com#@#.ad",
+        ... ])
+        >>> rules.get_css_selectors("www.example.com")
+        ('.sponsored', '.ad')
+        >>> rules.get_css_selectors("shop.example.com")
+        ('.sponsored',)
+        >>> rules.get_css_selectors("example.org")
+        ('.ad',)
+        """
+        return self.elemhide.selectors(domain)
+
+    def get_generic_css_selectors(self):
+        """
+        Return a tuple of unique CSS selectors of element hiding rules
+        which don't have domains; they apply to all pages.
+        """
+        return self.elemhide.generic_selectors()
+
+    def get_stylesheet(self, domain=None):
+        """
+        Return CSS which hides elements on pages from ``domain``
+        (or elements matched by generic rules if ``domain`` is None).
+
+        >>> rules = AdblockRules(["##.ad", "example.com##.sponsored"])
+        >>> print(rules.get_stylesheet("example.com"))
+        .sponsored, .ad {display: none !important;}
+        <BLANKLINE>
+        """
+        return self.elemhide.stylesheet(domain)
 
     def should_block(self, url, options=None):
-        # TODO: group rules with similar options and match them in bigger steps
-        options = options or {}
-        if self._is_whitelisted(url, options):
+        """
+        Return True if ``url`` should be blocked. ``options`` is a dict
+        with request options or a :class:`RequestOptions` instance.
+        ``url`` can also be a :class:`Request` instance (``options``
+        are ignored then).
+        """
+        if self.result_cache is None:
+            return self._should_block(self._request(url, options))
+
+        if isinstance(url, Request):
+            key = _result_cache_key(url.url, url.options)
+        else:
+            key = _result_cache_key(url, options)
+        if key is None:
+            return self._should_block(self._request(url, options))
+        result = self.result_cache.get(key)
+        if result is None:
+            result = self._should_block(self._request(url, options))
+            self.result_cache[key] = result
+        return result
+
+    def match(self, url, options=None):
+        """
+        Check ``url`` like :meth:`should_block` does, but return
+        a :class:`MatchResult` with the rules which decided the result.
+
+        Only the matched part of an index (a host name, a keyword bucket
+        or a shard of a combined regex) is checked rule-by-rule,
+        so this is not much slower than ``should_block``.
+        Results are not cached.
+
+        >>> rules = AdblockRules(["||ads.example.com^", "@@||ads.example.com/notbanner^"])
+        >>> rules.match("http://ads.example.com/notbanner")
+        MatchResult(blocked=False, rule=AdblockRule('||ads.example.com^'), exception=AdblockRule('@@||ads.example.com/notbanner^'))
+        >>> result = rules.match("http://ads.example.com/banner")
+        >>> bool(result), result.rule, result.exception
+        (True, AdblockRule('||ads.example.com^'), None)
+        """
+        request = self._request(url, options)
+        blacklist_domain_rules, whitelist_domain_rules = \
+            self._domain_rules(request)
+        exception = self._find_rule(
+            request,
+            self.whitelist_index,
+            whitelist_domain_rules,
+            self._whitelist_groups,
+            self._whitelist_ungrouped
+        )
+        rule = self._find_rule(
+            request,
+            self.blacklist_index,
+            blacklist_domain_rules,
+            self._blacklist_groups,
+            self._blacklist_ungrouped
+        )
+        return MatchResult(rule is not None and exception is None, rule, exception)
+
+    def should_block_async(self, url, options=None):
+        """
+        Return an awaitable with ``should_block(url, options)`` result,
+        computed in an executor; concurrent calls are checked in batches.
+        ``async_matcher`` (an :class:`adblockparser.aio.AsyncMatcher`
+        instance, created on first use) does the work; replace it
+        to use another executor. Python 3.5+ only.
+        """
+        return self._get_async_matcher().should_block(url, options)
+
+    def should_block_many_async(self, urls, options=None):
+        """
+        Return an awaitable with ``should_block_many(urls, options)``
+        result, computed in an executor. See :meth:`should_block_async`.
+        """
+        return self._get_async_matcher().should_block_many(urls, options)
+
+    def _get_async_matcher(self):
+        if self.async_matcher is None:
+            from adblockparser.aio import AsyncMatcher
+            self.async_matcher = AsyncMatcher(self)
+        return self.async_matcher
+
+    def _should_block(self, request):
+        blacklist_domain_rules, whitelist_domain_rules = \
+            self._domain_rules(request)
+        if self._is_whitelisted(request, whitelist_domain_rules):
             return False
-        if self._is_blacklisted(url, options):
+        if self._is_blacklisted(request, blacklist_domain_rules):
             return True
         return False
 
-    def _is_whitelisted(self, url, options):
+    def _should_block_with_stats(self, request):
+        call = self.match_stats.new_call()
+        blacklist_domain_rules, whitelist_domain_rules = \
+            call.timed('domain_rules', self._domain_rules, request)
+        stage, rule = self._matching_stage(
+            request,
+            'whitelist',
+            self.whitelist_index,
+            whitelist_domain_rules,
+            self._whitelist_groups,
+            self._whitelist_ungrouped,
+            call
+        )
+        if stage is not None:
+            self.match_stats.record(call, 'whitelist/' + stage, rule)
+            return False
+        stage, rule = self._matching_stage(
+            request,
+            'blacklist',
+            self.blacklist_index,
+            blacklist_domain_rules,
+            self._blacklist_groups,
+            self._blacklist_ungrouped,
+            call
+        )
+        if stage is not None:
+            self.match_stats.record(call, 'blacklist/' + stage, rule)
+            return True
+        self.match_stats.record(call, 'not_matched')
+        return False
+
+    def _request(self, url, options):
+        if isinstance(url, Request):
+            return url
+        return Request(url, options, self.rule_cls.OPTION_BITS)
+
+    def _request_options(self, options):
+        if isinstance(options, RequestOptions):
+            return options
+        return RequestOptions(options, self.rule_cls.OPTION_BITS)
+
+    def _is_whitelisted(self, request, domain_rules):
         return self._matches(
-            url, options,
-            self.whitelist_re,
-            self.whitelist_require_domain,
-            self.whitelist_with_options
+            request,
+            self.whitelist_index,
+            domain_rules,
+            self._whitelist_groups,
+            self._whitelist_ungrouped
         )
 
-    def _is_blacklisted(self, url, options):
+    def _is_blacklisted(self, request, domain_rules):
         return self._matches(
-            url, options,
-            self.blacklist_re,
-            self.blacklist_require_domain,
-            self.blacklist_with_options
+            request,
+            self.blacklist_index,
+            domain_rules,
+            self._blacklist_groups,
+            self._blacklist_ungrouped
         )
 
-    def _matches(self, url, options,
-                 general_re, domain_required_rules, rules_with_options):
+    _NO_DOMAIN_RULES = (None, None)
+
+    def _domain_rules(self, request):
+        """
+        Return ``(blacklist, whitelist)`` rules which require the source
+        domain of ``request``; each item is a ``(option_groups,
+        ungrouped_rules)`` tuple or None.
+        """
+        options = request.options
+        if 'domain' not in options:
+            return self._NO_DOMAIN_RULES
+        if not (self.blacklist_require_domain or self.whitelist_require_domain):
+            return self._NO_DOMAIN_RULES
+
+        if self.domain_cache is None:
+            return self._build_domain_rules(request, grouped=False)
+        domain = options['domain']
+        domain_rules = self.domain_cache.get(domain)
+        if domain_rules is None:
+            domain_rules = self._build_domain_rules(request)
+            self.domain_cache[domain] = domain_rules
+        return domain_rules
+
+    def _build_domain_rules(self, request, grouped=True):
+        return (
+            self._rules_for_domain(self.blacklist_require_domain, request, grouped),
+            self._rules_for_domain(self.whitelist_require_domain, request, grouped),
+        )
+
+    def _rules_for_domain(self, domain_required_rules, request, grouped):
+        rules = []
+        seen = set()
+        for variant in request.domain_variants:
+            for rule in domain_required_rules.get(variant, ()):
+                if id(rule) not in seen:
+                    seen.add(id(rule))
+                    rules.append(rule)
+        if not grouped:
+            return [], rules
+        domain, variants = request.options['domain'], request.domain_variants
+        rules = [rule for rule in rules if rule._domain_matches(domain, variants)]
+        return self._option_groups(rules, domain_matched=True)
+
+    def should_block_many(self, urls, options=None):
+        """
+        Return a list of ``should_block`` results for ``urls``.
+
+        ``options`` is either a dict (or a :class:`RequestOptions` instance)
+        shared by all URLs, or an iterable of dicts with one item per URL;
+        ValueError is raised if their number is different.
+
+        Work which only depends on options is done once per batch:
+        options are converted once for each distinct value, option groups
+        which apply to them are selected once for each distinct set of
+        options, and rules which require a domain are looked up once for
+        each source domain. If many URLs have the same options, groups
+        which apply to them are merged and searched in a single step.
+
+        >>> rules = AdblockRules(["adv", "@@advice.$~script"])
+        >>> rules.should_block_many([
+        ...     "http://example.com/advert.html",
+        ...     "http://example.com/advice.html",
+        ... ], {'script': False})
+        [True, False]
+        """
+        urls = list(urls)
+        if options is None or isinstance(options, (dict, RequestOptions)):
+            key = _options_key(options)
+            options_list = [options] * len(urls)
+            keys = [key] * len(urls)
+        else:
+            options_list = list(options)
+            if len(options_list) != len(urls):
+                raise ValueError("Got %d URLs and %d options" % (
+                    len(urls), len(options_list)))
+            keys = [_options_key(url_options) for url_options in options_list]
+
+        matcher = _BatchMatcher(self)
+        return [matcher.should_block(url, url_options, key)
+                for url, url_options, key in zip(urls, options_list, keys)]
+
+    def _matches(self, request, general_index, domain_rules,
+                 option_groups, ungrouped_rules):
         """
-        Return if ``url``/``options`` are matched by rules defined by
-        ``general_re``, ``domain_required_rules`` and ``rules_with_options``.
+        Return if ``request`` (a Request instance) is matched by rules defined by
+        ``general_index``, ``domain_rules``, ``option_groups``
+        and ``ungrouped_rules``.
 
-        ``general_re`` is a compiled regex for rules without options.
+        ``general_index`` is a RuleIndex for rules without options.
 
-        ``domain_required_rules`` is a {domain: [rules_which_require_it]}
-        mapping.
+        ``domain_rules`` is an ``(option_groups, ungrouped_rules)`` tuple
+        with rules which require the source domain, or None.
 
-         ``rules_with_options`` is a list of AdblockRule instances that
-        don't require any domain, but have other options.
+        ``option_groups`` is a list of _OptionGroup instances with rules
+        that don't require any domain, but have other options;
+        ``ungrouped_rules`` is a list of such rules which can't be grouped.
         """
-        if general_re and general_re.search(url):
+        if general_index and general_index.search(request.url, request):
             return True
+        if domain_rules is not None:
+            if self._groups_match(request, *domain_rules):
+                return True
+        return self._groups_match(request, option_groups, ungrouped_rules)
 
-        rules = []
-        if 'domain' in options and domain_required_rules:
-            src_domain = options['domain']
-            for domain in _domain_variants(src_domain):
-                if domain in domain_required_rules:
-                    rules.extend(domain_required_rules[domain])
+    def _find_rule(self, request, general_index, domain_rules,
+                   option_groups, ungrouped_rules):
+        """
+        Return the first rule which matches ``request``, or None.
+        Arguments are the same as for :meth:`_matches`.
+        """
+        if general_index:
+            rule = general_index.find(request.url, request)
+            if rule is not None:
+                return rule
+        if domain_rules is not None:
+            rule = self._groups_find(request, *domain_rules)
+            if rule is not None:
+                return rule
+        return self._groups_find(request, option_groups, ungrouped_rules)
+
+    def _groups_find(self, request, option_groups, ungrouped_rules):
+        url = request.url
+        for group in option_groups:
+            required, required_true, required_false = group.masks
+            if required & ~request.present_mask:
+                if self.skip_unsupported_rules:
+                    continue
+                for rule in group.rules:
+                    if rule.match_url(request):
+                        return rule
+                continue
+            if (required_true & ~request.true_mask or
+                    required_false & ~request.false_mask):
+                continue
+            rule = group.find(url, request)
+            if rule is not None:
+                return rule
+
+        for rule in ungrouped_rules:
+            if self._options_apply(rule, request) and rule._url_matches(url):
+                return rule
+        return None
+
+    def _matching_stage(self, request, name, general_index, domain_rules,
+                        option_groups, ungrouped_rules, call):
+        """
+        Instrumented version of :meth:`_matches`. Return ``(stage, rule)``
+        for the stage which matched ``request`` and a rule which matched,
+        or ``(None, None)``. ``call`` is a CallStats instance; stages
+        are timed as ``<name>/<stage>``.
+        """
+        url = request.url
+        if general_index:
+            if call.timed(name + '/general', general_index.search, url, request):
+                return 'general', general_index.find(url, request)
+        if domain_rules is not None:
+            if call.timed(name + '/domain', self._groups_match_with_stats,
+                          request, domain_rules[0], domain_rules[1], call):
+                return 'domain', self._groups_find(request, *domain_rules)
+        if call.timed(name + '/options', self._groups_match_with_stats,
+                      request, option_groups, ungrouped_rules, call):
+            return 'options', self._groups_find(request, option_groups, ungrouped_rules)
+        return None, None
+
+    def _groups_match_with_stats(self, request, option_groups, ungrouped_rules, call):
+        url = request.url
+        for group in option_groups:
+            required, required_true, required_false = group.masks
+            if required & ~request.present_mask:
+                if self.skip_unsupported_rules:
+                    call.skipped_unsupported += len(group.rules)
+                    continue
+                call.candidates += len(group.rules)
+                if any(rule.match_url(request) for rule in group.rules):
+                    return True
+                continue
+            if (required_true & ~request.true_mask or
+                    required_false & ~request.false_mask):
+                call.skipped_options += len(group.rules)
+                continue
+            call.candidates += len(group.rules)
+            if group.search(url, request):
+                return True
+
+        timer = call.timer
+        for rule in ungrouped_rules:
+            if not self._options_apply(rule, request):
+                if self.skip_unsupported_rules and self._is_unsupported(rule, request):
+                    call.skipped_unsupported += 1
+                else:
+                    call.skipped_options += 1
+                continue
+            call.candidates += 1
+            start = timer()
+            matched = rule._url_matches(url)
+            call.rule_times.append((rule.raw_rule_text, timer() - start))
+            if matched:
+                return True
+        return False
+
+    @staticmethod
+    def _is_unsupported(rule, request):
+        masks = rule._option_masks
+        if masks is None:
+            return not rule.matching_supported(request.options)
+        return bool(masks[0] & ~request.present_mask)
+
+    def _groups_match(self, request, option_groups, ungrouped_rules):
+        url = request.url
+        for group in option_groups:
+            required, required_true, required_false = group.masks
+            if required & ~request.present_mask:
+                if self.skip_unsupported_rules:
+                    continue
+                # match_url raises ValueError for missing options
+                if any(rule.match_url(request) for rule in group.rules):
+                    return True
+                continue
+            if (required_true & ~request.true_mask or
+                    required_false & ~request.false_mask):
+                continue
+            if group.search(url, request):
+                return True
 
-        rules.extend(rules_with_options)
+        for rule in ungrouped_rules:
+            if self._options_apply(rule, request) and rule._url_matches(url):
+                return True
+        return False
 
-        if self.skip_unsupported_rules:
-            rules = [rule for rule in rules if rule.matching_supported(options)]
+    def _options_apply(self, rule, request):
+        """
+        Return if options of a ``rule`` with options match
+        ``request`` (a RequestOptions instance).
+        """
+        masks = rule._option_masks
+        if masks is None:
+            if (self.skip_unsupported_rules and
+                    not rule.matching_supported(request.options)):
+                return False
+            return rule._options_match(request.options, request.domain_variants)
 
-        return any(rule.match_url(url, options) for rule in rules)
+        required, required_true, required_false = masks
+        if required & ~request.present_mask:
+            if self.skip_unsupported_rules:
+                return False
+            return rule._options_match(request.options)  # raises ValueError
+        if (required_true & ~request.true_mask or
+                required_false & ~request.false_mask):
+            return False
+        if 'domain' in rule.options:
+            return rule._domain_matches(request.options['domain'],
+                                        request.domain_variants)
+        return True
 
     @classmethod
     def _split_bw(cls, rules):
@@ -414,51 +1618,323 @@ class AdblockRules(object):
         return dict(result)
 
 
-def _domain_variants(domain):
+class _BatchMatcher(object):
     """
-    >>> list(_domain_variants("foo.bar.example.com"))
-    ['foo.bar.example.com', 'bar.example.com', 'example.com']
-    >>> list(_domain_variants("example.com"))
-    ['example.com']
-    >>> list(_domain_variants("localhost"))
-    ['localhost']
+    Matcher for a batch of URLs, used by ``AdblockRules.should_block_many``.
+    Work which only depends on options is done once per batch:
+
+    * options are converted to a RequestOptions instance once
+      for each distinct value;
+    * option groups which apply to option bitmasks of a request are
+      selected once for each distinct combination of bitmasks, so that
+      checking an URL doesn't involve masks of other groups; once
+      ``BATCH_INDEX_MIN_URLS`` URLs had the same bitmasks, these groups
+      are merged into one, which is searched in a single step;
+    * rules which require a domain are looked up once for each source
+      domain.
+
+    If stats are collected, results are cached or missing options
+    raise errors, URLs are checked using ``AdblockRules.should_block``.
     """
-    parts = domain.split('.')
-    if len(parts) == 1:
-        yield parts[0]
-    else:
-        for i in range(len(parts), 1, -1):
-            yield ".".join(parts[-i:])
+    def __init__(self, rules):
+        self.rules = rules
+        self.use_groups = (rules.skip_unsupported_rules and
+                           rules.result_cache is None and
+                           not rules.collect_stats)
+        self._request_options = {}
+        self._groups = {}
+        self._mask_counts = Counter()
+        self._domain_rules = {}
+
+    def should_block(self, url, options, key):
+        rules = self.rules
+        if key is None:  # unhashable option values
+            return rules.should_block(url, options)
+        request_options = self._request_options.get(key)
+        if request_options is None:
+            request_options = rules._request_options(options)
+            self._request_options[key] = request_options
+        request = Request(url, request_options, rules.rule_cls.OPTION_BITS)
+        if not self.use_groups:
+            return rules.should_block(request)
+
+        masks = (request.present_mask, request.true_mask, request.false_mask)
+        blacklist_groups, whitelist_groups = self._option_groups(masks)
+        blacklist_domain_rules, whitelist_domain_rules = \
+            self._request_domain_rules(request)
+        if self._matches(request, rules.whitelist_index, whitelist_domain_rules,
+                         whitelist_groups, rules._whitelist_ungrouped):
+            return False
+        return self._matches(request, rules.blacklist_index, blacklist_domain_rules,
+                             blacklist_groups, rules._blacklist_ungrouped)
+
+    def _option_groups(self, masks):
+        groups = self._groups.get(masks)
+        if groups is None:
+            groups = self._groups[masks] = (
+                _applicable_groups(self.rules._blacklist_groups, masks),
+                _applicable_groups(self.rules._whitelist_groups, masks),
+            )
+        self._mask_counts[masks] += 1
+        if self._mask_counts[masks] == self.rules.BATCH_INDEX_MIN_URLS:
+            groups = self._groups[masks] = (
+                self._merged(groups[0], masks),
+                self._merged(groups[1], masks),
+            )
+        return groups
+
+    def _merged(self, groups, masks):
+        if len(groups) < 2:
+            return groups
+        rules = self.rules
+        return [_OptionGroup(
+            masks, [rule for group in groups for rule in group.rules],
+            rules.uses_re2, rules.re2_max_mem, rules.shard_size, exclusions=True
+        )]
+
+    def _request_domain_rules(self, request):
+        if not request.domain_variants:
+            return AdblockRules._NO_DOMAIN_RULES
+        domain = request.options['domain']
+        domain_rules = self._domain_rules.get(domain)
+        if domain_rules is None:
+            if self.rules.domain_cache is not None:
+                domain_rules = self.rules._domain_rules(request)
+            else:
+                domain_rules = self.rules._build_domain_rules(request)
+            self._domain_rules[domain] = domain_rules
+        return domain_rules
 
+    def _matches(self, request, general_index, domain_rules, groups, ungrouped):
+        url = request.url
+        if general_index and general_index.search(url, request):
+            return True
+        if domain_rules is not None:
+            # there are few groups per domain; masks are checked as usual
+            if self.rules._groups_match(request, *domain_rules):
+                return True
+        return self._groups_match(request, groups, ungrouped)
+
+    def _groups_match(self, request, groups, ungrouped):
+        url = request.url
+        for group in groups:
+            if group.search(url, request):
+                return True
+        options_apply = self.rules._options_apply
+        for rule in ungrouped:
+            if options_apply(rule, request) and rule._url_matches(url):
+                return True
+        return False
 
-def _combined_regex(regexes, flags=re.IGNORECASE, use_re2=False, max_mem=None):
+
+def _applicable_groups(groups, masks):
+    """
+    Return option groups from ``groups`` which apply to requests
+    with ``(present, true, false)`` option bitmasks ``masks``.
     """
-    Return a compiled regex combined (using OR) from a list of ``regexes``.
-    If there is nothing to combine, None is returned.
+    present, true, false = masks
+    return [
+        group for group in groups
+        if not (group.masks[0] & ~present or group.masks[1] & ~true or
+                group.masks[2] & ~false)
+    ]
+
 
-    re2 library (https://github.com/axiak/pyre2) often can match and compile
-    large regexes much faster than stdlib re module (10x is not uncommon),
-    but there are some gotchas:
+def _remove_item(items, item):
+    """ Remove ``item`` from ``items`` list, comparing by identity. """
+    for i, other in enumerate(items):
+        if other is item:
+            del items[i]
+            return
+    raise ValueError("%r is not in the list" % item)
 
-    * in case of "DFA out of memory" errors use ``max_mem`` argument
-      to increase the amount of memory re2 is allowed to use.
+
+def _result_cache_key(url, options):
     """
-    joined_regexes = "|".join(r for r in regexes if r)
-    if not joined_regexes:
-        return None
+    Return a key for caching ``should_block`` results,
+    or None if options can't be used in a key.
 
-    if use_re2:
-        import re2
-        return re2.compile(joined_regexes, flags=flags, max_mem=max_mem)
-    return re.compile(joined_regexes, flags=flags)
+    >>> _result_cache_key("http://example.com", None) == _result_cache_key(
+    ...     "http://example.com", RequestOptions({}))
+    True
+    >>> print(_result_cache_key("http://example.com", {'foo': []}))
+    None
+    """
+    key = _options_key(options)
+    if key is None:
+        return None
+    return url, key
 
 
-def _is_re2_supported():
+def _options_key(options):
+    """
+    Return a hashable key for ``options`` (a dict or RequestOptions),
+    or None if option values are not hashable.
+    """
+    if isinstance(options, RequestOptions):
+        options = options.options
+    if not options:
+        return _NO_OPTIONS
     try:
-        import re2
-    except ImportError:
-        return False
+        return frozenset(options.items())
+    except TypeError:  # unhashable option values
+        return None
+
+
+_NO_OPTIONS = frozenset()
+_NO_OPTION_MASKS = (0, 0, 0)
+
+
+class _OptionGroup(object):
+    """
+    Rules with options which have the same option masks. ``||host^``
+    rules are put into a HostTable, other rules are matched using
+    a single combined regex compiled on first use. Matching is
+    case-sensitive, like in ``AdblockRule.match_url``.
+
+    If ``exclusions`` is True, rules can have a domain option which
+    only excludes domains (``domain=~example.com``); ``excluded`` is
+    a ``{domain: [rules]}`` index of such rules. The combined regex
+    is searched first; then only rules which exclude the source domain
+    of a request are matched one-by-one. If one of them matches,
+    the rest of the group is searched using a group built without
+    the excluded rules; such groups are cached per set of excluded rules,
+    or all built by :meth:`precompile`.
+    """
+    __slots__ = ['masks', 'rules', 'match_all', 'hosts', 'other_rules',
+                 'use_re2', 'max_mem', 'shard_size', '_regex_re', 'excluded',
+                 '_rest_groups']
+
+    # how many groups without excluded rules are cached
+    REST_GROUPS_CACHE_SIZE = 100
+
+    def __init__(self, masks, rules, use_re2=False, max_mem=None, shard_size=None,
+                 exclusions=False):
+        self.masks = masks
+        self.rules = rules
+        self.excluded = {}
+        if exclusions:
+            for rule in rules:
+                for domain in rule.options.get('domain', ()):
+                    self.excluded.setdefault(domain, []).append(rule)
+        self.match_all = any(_matches_all_urls(rule) for rule in rules)
+        self.use_re2 = use_re2
+        self.max_mem = max_mem
+        self.shard_size = shard_size
+        self._regex_re = _NOT_COMPILED
+        self._rest_groups = None
+
+        self.hosts = HostTable(self._combined, ignore_case=False)
+        self.other_rules = []
+        for rule in rules:
+            if rule_host(rule.rule_text) is not None:
+                self.hosts.add(rule)
+            else:
+                self.other_rules.append(rule)
+
+    def search(self, url, request=None):
+        if not self._search(url, request):
+            return False
+        excluded = self.excluded and self._excluded_rules(request)
+        if not excluded:
+            return True
+        # the URL matched; it is enough to check the few rules
+        # which don't apply to the source domain
+        if not any(rule._url_matches(url) for rule in excluded.values()):
+            return True
+        return self._rest_group(excluded).search(url, request)
+
+    def _search(self, url, request):
+        if self.match_all:
+            return True
+        if self.hosts and self.hosts.search(url, request):
+            return True
+        if self._regex_re is _NOT_COMPILED:
+            self._regex_re = self._combined([rule.regex for rule in self.other_rules])
+        return self._regex_re is not None and bool(self._regex_re.search(url))
+
+    def find(self, url, request=None):
+        """ Return a rule which matches ``url``, or None """
+        excluded = self.excluded and self._excluded_rules(request)
+        rule = self._find(url, request)
+        if rule is None or not excluded or id(rule) not in excluded:
+            return rule
+        # the rule doesn't apply to the source domain; check the rest
+        return self._rest_group(excluded).find(url, request)
+
+    def _find(self, url, request):
+        if self.match_all:
+            return next(rule for rule in self.rules if _matches_all_urls(rule))
+        if self.hosts:
+            rule = self.hosts.find(url, request)
+            if rule is not None:
+                return rule
+        if not self._search(url, request):
+            return None
+        return find_rule(self.other_rules, url, 0, self._regex_re)
+
+    def _excluded_rules(self, request):
+        """
+        Return an ``{id(rule): rule}`` dict of rules which exclude
+        the source domain of ``request``.
+        """
+        if request is None:
+            return None
+        return self._excluded_for_variants(request.domain_variants)
+
+    def _excluded_for_variants(self, domain_variants):
+        excluded = {}
+        for domain in domain_variants:
+            for rule in self.excluded.get(domain, ()):
+                excluded[id(rule)] = rule
+        return excluded
+
+    def _rest_group(self, excluded):
+        """
+        Return an _OptionGroup with rules of this group which are not
+        in ``excluded`` (an ``{id(rule): rule}`` dict).
+        """
+        if self._rest_groups is None:
+            self._rest_groups = LRUCache(self.REST_GROUPS_CACHE_SIZE)
+        key = frozenset(excluded)
+        group = self._rest_groups.get(key)
+        if group is None:
+            group = self._rest_groups[key] = self._new_rest_group(excluded)
+        return group
+
+    def _new_rest_group(self, excluded):
+        rules = [rule for rule in self.rules if id(rule) not in excluded]
+        return _OptionGroup(self.masks, rules, self.use_re2, self.max_mem,
+                            self.shard_size)
+
+    def precompile(self):
+        self.hosts.precompile()
+        if self._regex_re is _NOT_COMPILED:
+            self._regex_re = self._combined([rule.regex for rule in self.other_rules])
+        for rule in self.rules:
+            rule.precompile()
+        if self.excluded:
+            self._precompile_rest_groups()
+
+    def _precompile_rest_groups(self):
+        # Rules excluded for a request are the rules excluded for its
+        # longest domain variant which is in ``excluded``, so a group
+        # per domain in ``excluded`` covers all requests. A dict is used
+        # instead of LRUCache: all groups are kept and lookups don't
+        # modify it.
+        rest_groups = {}
+        for domain in self.excluded:
+            excluded = self._excluded_for_variants(_domain_variants(domain))
+            key = frozenset(excluded)
+            if key not in rest_groups:
+                rest_groups[key] = self._new_rest_group(excluded)
+                rest_groups[key].precompile()
+        self._rest_groups = rest_groups
+
+    def _combined(self, regexes):
+        return _combined_regex(regexes, flags=0, use_re2=self.use_re2,
+                               max_mem=self.max_mem, shard_size=self.shard_size)
+
+
+_NOT_COMPILED = object()
 
-    # re2.match doesn't work in re2 v0.2.20 installed from pypi
-    # (it always returns None).
-    return re2.match('foo', 'foo') is not None
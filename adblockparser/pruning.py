@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Removing redundant rules.
+
+Rules are grouped by their type (blocking rule or exception) and options;
+within a group a rule is redundant if it is a duplicate of another rule
+or if every URL it matches is also matched by another rule:
+
+* any rule is subsumed by a rule which matches all URLs
+  (e.g. ``$websocket,domain=example.com``);
+* ``||ads.example.com^`` is subsumed by ``||example.com^``;
+* a rule is subsumed by a plain substring rule (like ``adv`` or ``-ad-``)
+  if the substring is a part of its text which must be present in
+  every matched URL (e.g. ``||adv.example.com^`` or ``/adv/*/banner``).
+
+Rules without options are matched case-insensitively, so their text is
+compared in lower case.
+"""
+from __future__ import absolute_import
+import re
+from collections import OrderedDict
+
+from adblockparser.automaton import make_automaton
+from adblockparser.index import (
+    rule_host, rule_literal, _NON_ASCII_RE, _is_regex_rule, _strip_anchors
+)
+
+_SEGMENT_SEPARATORS_RE = re.compile(r'[*^]')
+
+
+def prune_rules(rules, use_pyahocorasick='auto'):
+    """
+    Remove duplicate and subsumed rules from a list of AdblockRule
+    instances. Return ``(rules, stats)`` tuple, where ``stats`` is a dict
+    with numbers of removed duplicates and subsumed rules.
+
+    Host name rules are pruned assuming that URLs are absolute:
+    ``||example.com^`` doesn't match ``ads.example.com/`` (without
+    a scheme), while ``||ads.example.com^`` does.
+
+    >>> from adblockparser import AdblockRule
+    >>> rules, stats = prune_rules([AdblockRule(text) for text in [
+    ...     "||example.com^",
+    ...     "||ads.example.com^",
+    ...     "||ads.example.com^$script,third-party",
+    ...     "||ads.example.com^$third-party,script",
+    ...     "adv",
+    ...     "/ADV/*/banner",
+    ...     "@@/adv/*/banner",
+    ... ]])
+    >>> rules
+    [AdblockRule('||example.com^'), AdblockRule('||ads.example.com^$script,third-party'), AdblockRule('adv'), AdblockRule('@@/adv/*/banner')]
+    >>> sorted(stats.items())
+    [('duplicates', 1), ('subsumed', 2)]
+    """
+    groups = OrderedDict()
+    duplicates = 0
+    for rule in rules:
+        group = groups.setdefault(_group_key(rule), OrderedDict())
+        text = _canonical_text(rule)
+        if text in group:
+            duplicates += 1
+        else:
+            group[text] = rule
+
+    redundant = set()
+    for group in groups.values():
+        redundant.update(_subsumed_rules(group, use_pyahocorasick))
+
+    kept = [
+        rule for group in groups.values() for rule in group.values()
+        if id(rule) not in redundant
+    ]
+    # keep the original order
+    positions = dict((id(rule), position) for position, rule in enumerate(rules))
+    kept.sort(key=lambda rule: positions[id(rule)])
+    return kept, {'duplicates': duplicates, 'subsumed': len(redundant)}
+
+
+def restorable_rules(rules, pruned_rules, removed_rules, use_pyahocorasick='auto'):
+    """
+    Return rules from ``pruned_rules`` which are no longer redundant
+    after ``removed_rules`` were removed from ``rules`` (rules which
+    were kept by :func:`prune_rules`). Only the groups of removed rules
+    are pruned again.
+
+    >>> from adblockparser import AdblockRule
+    >>> domain, ads, ads_copy = [AdblockRule(text) for text in [
+    ...     "||example.com^", "||ads.example.com^", "||ads.example.com^"]]
+    >>> prune_rules([domain, ads, ads_copy])[0]
+    [AdblockRule('||example.com^')]
+    >>> restorable_rules([], [ads, ads_copy], [domain])
+    [AdblockRule('||ads.example.com^')]
+    """
+    keys = set(_group_key(rule) for rule in removed_rules)
+    candidates = [rule for rule in pruned_rules if _group_key(rule) in keys]
+    if not candidates:
+        return []
+    candidate_ids = set(id(rule) for rule in candidates)
+    group_rules = [rule for rule in rules if _group_key(rule) in keys]
+    kept, stats = prune_rules(group_rules + candidates, use_pyahocorasick)
+    return [rule for rule in kept if id(rule) in candidate_ids]
+
+
+def _group_key(rule):
+    options = []
+    for name, value in rule.options.items():
+        if isinstance(value, dict):
+            value = frozenset(value.items())
+        options.append((name, value))
+    return rule.is_exception, frozenset(options)
+
+
+def _canonical_text(rule):
+    text = rule.rule_text
+    if _is_regex_rule(text):
+        return text
+    # leading and trailing wildcards don't change what is matched
+    stripped = text.strip('*')
+    if (stripped.startswith('|') or stripped.endswith('|') or
+            _is_regex_rule(stripped)):
+        stripped = text
+    if not rule.options and not _NON_ASCII_RE.search(stripped):
+        stripped = stripped.lower()
+    return stripped
+
+
+def _subsumed_rules(group, use_pyahocorasick):
+    """
+    Return ids of rules from ``group`` (an ordered {canonical_text: rule}
+    dict of rules with the same options) which are subsumed by other rules
+    of the group.
+    """
+    if len(group) < 2:
+        return set()
+
+    if '' in group:
+        # a rule which matches all URLs
+        match_all = group['']
+        return set(id(rule) for rule in group.values() if rule is not match_all)
+
+    subsumed = set()
+    hosts = {}
+    literals = []
+    for text, rule in group.items():
+        host = rule_host(text)
+        if host is not None:
+            hosts[host] = rule
+        literal = rule_literal(text)
+        if literal is not None and literal[1] == 0:
+            literals.append((literal[0], rule))
+
+    for host, rule in hosts.items():
+        parts = host.split('.')
+        if any('.'.join(parts[i:]) in hosts for i in range(1, len(parts))):
+            subsumed.add(id(rule))
+
+    if not literals:
+        return subsumed
+    automaton = make_automaton(literals, use_pyahocorasick=use_pyahocorasick)
+    for text, rule in group.items():
+        if id(rule) in subsumed:
+            continue
+        for segment in _rule_segments(text):
+            if any(value is not rule for end, value in automaton.iter(segment)):
+                subsumed.add(id(rule))
+                break
+    return subsumed
+
+
+def _rule_segments(text):
+    """
+    Return parts of a rule text which must be present in every
+    URL the rule matches.
+
+    >>> _rule_segments("||ads.example.com^")
+    ['ads.example.com']
+    >>> _rule_segments("/banner/*/img^")
+    ['/banner/', '/img']
+    >>> _rule_segments(r"/banner\\d+/")
+    []
+    """
+    if _is_regex_rule(text) or _NON_ASCII_RE.search(text):
+        return []
+    text, anchors = _strip_anchors(text)
+    if '|' in text:
+        return []
+    return [segment for segment in _SEGMENT_SEPARATORS_RE.split(text) if segment]
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Binary format for saving AdblockRules with all rules already parsed
+and indexed, to make startup faster.
+
+A file starts with a header (magic bytes, format version and an optional
+hash of source rules), followed by zlib-compressed pickle of builtin
+types. Only load files you created: loading pickle data from untrusted
+sources is not secure.
+"""
+from __future__ import absolute_import
+import hashlib
+import pickle
+import struct
+import zlib
+
+from adblockparser.elemhide import ElementHidingIndex
+
+try:
+    from itertools import izip as zip  # Python 2
+except ImportError:
+    pass
+
+MAGIC = b'ADBLOCKPARSER\x00'
+FORMAT_VERSION = 5
+
+# AdblockRules attributes with lists of rules
+_RULE_LISTS = [
+    'blacklist',
+    'whitelist',
+    'blacklist_with_options',
+    'whitelist_with_options',
+]
+
+# AdblockRules attributes with {domain: [rules]} indexes
+_DOMAIN_INDEXES = [
+    'blacklist_require_domain',
+    'whitelist_require_domain',
+]
+
+# AdblockRules attributes with RuleIndex instances
+_RULE_INDEXES = [
+    'blacklist_index',
+    'whitelist_index',
+]
+
+
+class AdblockCacheError(ValueError):
+    """ Saved rules can't be loaded: the file is invalid or stale. """
+    pass
+
+
+def rules_hash(rules):
+    """
+    Return a hash of rules source: an iterable of rule strings
+    or AdblockRule instances.
+
+    >>> rules_hash(["||ads.example.com^", "adv"]) == rules_hash(["||ads.example.com^", "adv"])
+    True
+    >>> rules_hash(["||ads.example.com^", "adv"]) == rules_hash(["||ads.example.com^"])
+    False
+    """
+    digest = hashlib.sha1()
+    for rule in rules:
+        text = getattr(rule, 'raw_rule_text', rule)
+        digest.update(text.encode('utf8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def dump(rules, fileobj, source_hash=None):
+    """ Write AdblockRules instance ``rules`` to a binary file object. """
+    rule_ids = dict((id(rule), rule_id) for rule_id, rule in enumerate(rules.rules))
+
+    def _ids(rule_list):
+        return [rule_ids[id(rule)] for rule in rule_list]
+
+    # re2 availability is checked when rules are loaded
+    settings = rules._settings()
+    del settings['use_re2']
+    data = {
+        'settings': settings,
+        'rules': _rule_columns(rules.rules),
+        # element hiding rules are cheap to parse
+        'html_rules': [rule.raw_rule_text for rule in rules.html_rules],
+        'pruning_stats': rules.pruning_stats,
+        'pruned_rules': [rule.raw_rule_text for rule in rules.pruned_rules],
+    }
+    for name in _RULE_LISTS:
+        data[name] = _ids(getattr(rules, name))
+    for name in _DOMAIN_INDEXES:
+        data[name] = dict(
+            (domain, _ids(rule_list))
+            for domain, rule_list in getattr(rules, name).items()
+        )
+    for name in _RULE_INDEXES:
+        data[name] = getattr(rules, name).dump(rule_ids)
+
+    source_hash = (source_hash or '').encode('ascii')
+    fileobj.write(MAGIC)
+    fileobj.write(struct.pack('>HB', FORMAT_VERSION, len(source_hash)))
+    fileobj.write(source_hash)
+    fileobj.write(zlib.compress(pickle.dumps(data, protocol=2)))
+
+
+def load(rules_cls, fileobj, source_hash=None, use_re2='auto'):
+    """
+    Read an ``rules_cls`` (AdblockRules or a subclass) instance from
+    a binary file object. If ``source_hash`` is not None and the rules
+    were saved with a different source hash, AdblockCacheError is raised.
+    """
+    if fileobj.read(len(MAGIC)) != MAGIC:
+        raise AdblockCacheError("Not a saved AdblockRules file")
+
+    header = fileobj.read(3)
+    if len(header) != 3:
+        raise AdblockCacheError("Saved rules file is truncated")
+    version, hash_length = struct.unpack('>HB', header)
+    if version != FORMAT_VERSION:
+        raise AdblockCacheError(
+            "Unsupported format version: %s (expected %s)" % (version, FORMAT_VERSION)
+        )
+    saved_hash = fileobj.read(hash_length)
+    if len(saved_hash) != hash_length:
+        raise AdblockCacheError("Saved rules file is truncated")
+    try:
+        saved_hash = saved_hash.decode('ascii')
+    except UnicodeDecodeError as e:
+        raise AdblockCacheError("Invalid saved rules: %s" % e)
+    if source_hash is not None and saved_hash != source_hash:
+        raise AdblockCacheError("Saved rules are stale")
+
+    try:
+        data = pickle.loads(zlib.decompress(fileobj.read()))
+    except (zlib.error, pickle.UnpicklingError, EOFError, ValueError,
+            KeyError, AttributeError, ImportError, IndexError, TypeError) as e:
+        # a corrupted pickle can fail in many ways
+        raise AdblockCacheError("Invalid saved rules: %s" % e)
+    if not isinstance(data, dict):
+        raise AdblockCacheError("Invalid saved rules: unexpected data")
+
+    try:
+        return _restore_rules(rules_cls, data, use_re2)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise AdblockCacheError("Invalid saved rules: %s" % e)
+
+
+def _restore_rules(rules_cls, data, use_re2):
+    # adblockparser.parser imports this module
+    from adblockparser.parser import _NO_OPTIONS, _NO_OPTION_MASKS
+
+    settings = data['settings']
+    rule_cls = settings['rule_cls']
+    rules = rules_cls([], use_re2=use_re2, **settings)
+    rules.rules = [
+        _restore_rule(rule_cls, _NO_OPTIONS, _NO_OPTION_MASKS, *state)
+        for state in zip(*data['rules'])
+    ]
+
+    def _rules(rule_ids):
+        return [rules.rules[rule_id] for rule_id in rule_ids]
+
+    for name in _RULE_LISTS:
+        setattr(rules, name, _rules(data[name]))
+    for name in _DOMAIN_INDEXES:
+        setattr(rules, name, dict(
+            (domain, _rules(rule_ids)) for domain, rule_ids in data[name].items()
+        ))
+    for name in _RULE_INDEXES:
+        index = getattr(rules, name)
+        setattr(rules, name, index.restore(
+            data[name], rules.rules,
+            use_re2=index.use_re2,
+            max_mem=index.max_mem,
+            shard_size=index.shard_size,
+            use_pyahocorasick=index.use_pyahocorasick,
+            guard=index.guard,
+        ))
+    rules.html_rules = [rule_cls(text) for text in data['html_rules']]
+    rules.pruning_stats = data['pruning_stats']
+    rules.pruned_rules = [rule_cls(text) for text in data['pruned_rules']]
+    rules.elemhide = ElementHidingIndex(rules.html_rules, rules.domain_cache_size)
+    rules._guard_rules(rules.rules)
+    rules._group_rules_with_options()
+    return rules
+
+
+def _rule_columns(rules):
+    # a list per attribute is more compact and faster to load
+    # than a tuple per rule
+    return (
+        [rule.raw_rule_text for rule in rules],
+        [rule.is_exception for rule in rules],
+        [rule.raw_options for rule in rules],
+        [rule.options for rule in rules],
+        [rule.rule_text for rule in rules],
+        [rule._regex for rule in rules],  # None if not created yet
+    )
+
+
+def _restore_rule(rule_cls, no_options, no_option_masks, raw_rule_text,
+                  is_exception, raw_options, options, rule_text, regex):
+    # Only rules which can be matched are saved, so they are neither
+    # comments nor HTML rules.
+    rule = rule_cls.__new__(rule_cls)
+    rule.raw_rule_text = raw_rule_text
+    rule.is_comment = rule.is_html_rule = False
+    rule.is_exception = is_exception
+    rule.raw_options = raw_options
+    rule.options = options
+    if options:
+        rule._options_keys = frozenset(options) - frozenset(['match-case'])
+        rule._option_masks = rule._compute_option_masks()
+    else:
+        rule._options_keys = no_options
+        rule._option_masks = no_option_masks
+    rule.rule_text = rule_text
+    rule._regex = regex
+    rule.regex_re = None
+    return rule
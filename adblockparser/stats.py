@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of ``AdblockRules.should_block`` calls, collected when
+AdblockRules is created with ``collect_stats=True``.
+
+``should_block`` checks exception rules first, then blocking rules;
+for each of them there are three stages:
+
+* ``general`` - rules without options (a RuleIndex);
+* ``domain`` - rules which require the source domain of a request;
+* ``options`` - other rules with options.
+
+A call exits as soon as a stage matches; the exit reason is
+``<whitelist|blacklist>/<stage>``, or ``not_matched``.
+"""
+from __future__ import absolute_import, division
+import threading
+import timeit
+from collections import Counter
+
+
+class MatchStats(object):
+    """
+    Counters and timings of ``should_block`` calls. Updates are
+    thread-safe; use :meth:`snapshot` to export them as a dict.
+
+    >>> from adblockparser import AdblockRules
+    >>> rules = AdblockRules(["||ads.example.com^", "/banner/$script",
+    ...                       "@@/banner/$image"], collect_stats=True)
+    >>> rules.should_block("http://ads.example.com/")
+    True
+    >>> rules.should_block("http://example.com/banner/", {'script': True, 'image': False})
+    True
+    >>> stats = rules.match_stats.snapshot()
+    >>> stats['calls'], stats['blocked']
+    (2, 2)
+    >>> sorted(stats['exits'].items())
+    [('blacklist/general', 1), ('blacklist/options', 1)]
+    >>> [(item['rule'], item['hits']) for item in stats['top_rules']]
+    [('/banner/$script', 1), ('||ads.example.com^', 1)]
+    """
+
+    def __init__(self, timer=timeit.default_timer):
+        self.timer = timer
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Set all counters to zero. """
+        with self._lock:
+            self.calls = 0
+            self.exits = Counter()
+            self.stage_times = Counter()
+            self.candidates = 0
+            self.max_candidates = 0
+            self.skipped_unsupported = 0
+            self.skipped_options = 0
+            self.rule_hits = Counter()
+            self.rule_calls = Counter()
+            self.rule_times = Counter()
+
+    def new_call(self):
+        """ Return a :class:`CallStats` instance for a single call. """
+        return CallStats(self.timer)
+
+    def record(self, call, exit_reason, rule=None):
+        """
+        Add statistics of a single call. ``rule`` is the rule
+        which decided the result, if any.
+        """
+        with self._lock:
+            self.calls += 1
+            self.exits[exit_reason] += 1
+            self.stage_times.update(call.stage_times)
+            self.candidates += call.candidates
+            self.max_candidates = max(self.max_candidates, call.candidates)
+            self.skipped_unsupported += call.skipped_unsupported
+            self.skipped_options += call.skipped_options
+            if rule is not None:
+                self.rule_hits[rule.raw_rule_text] += 1
+            for text, seconds in call.rule_times:
+                self.rule_calls[text] += 1
+                self.rule_times[text] += seconds
+
+    def snapshot(self, top=10):
+        """
+        Return a dict with statistics, suitable for exporting as JSON.
+        ``top`` is a number of rules to list in ``top_rules`` (rules
+        which decided the most results) and ``slowest_rules`` (rules
+        with the highest total time).
+        """
+        with self._lock:
+            blocked = sum(count for reason, count in self.exits.items()
+                          if reason.startswith('blacklist/'))
+            return {
+                'calls': self.calls,
+                'blocked': blocked,
+                'exits': dict(self.exits),
+                'stage_times': dict(self.stage_times),
+                'candidates': {
+                    'total': self.candidates,
+                    'max': self.max_candidates,
+                    'mean': self.candidates / self.calls if self.calls else 0.0,
+                },
+                'skipped_rules': {
+                    'unsupported': self.skipped_unsupported,
+                    'options': self.skipped_options,
+                },
+                'top_rules': [
+                    {'rule': text, 'hits': hits}
+                    for text, hits in _most_common(self.rule_hits, top)
+                ],
+                'slowest_rules': [
+                    {'rule': text, 'calls': self.rule_calls[text], 'time': seconds}
+                    for text, seconds in _most_common(self.rule_times, top)
+                ],
+            }
+
+
+class CallStats(object):
+    """
+    Statistics of a single ``should_block`` call:
+
+    * ``stage_times`` - {stage: seconds} dict;
+    * ``candidates`` - a number of rules with options URL was matched
+      against (rules in option groups are matched together,
+      using a single regex);
+    * ``skipped_unsupported`` - a number of rules skipped because
+      options they need were not passed;
+    * ``skipped_options`` - a number of rules skipped because their
+      options don't match;
+    * ``rule_times`` - a list of ``(rule_text, seconds)`` tuples
+      for rules which were matched one-by-one.
+    """
+    __slots__ = ['timer', 'stage_times', 'candidates', 'skipped_unsupported',
+                 'skipped_options', 'rule_times']
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.stage_times = {}
+        self.candidates = self.skipped_unsupported = self.skipped_options = 0
+        self.rule_times = []
+
+    def timed(self, stage, func, *args):
+        """ Call ``func(*args)``, add the time it took to ``stage`` """
+        start = self.timer()
+        try:
+            return func(*args)
+        finally:
+            self.stage_times[stage] = self.stage_times.get(stage, 0) + \
+                self.timer() - start
+
+
+def _most_common(counter, number):
+    # sort ties by key, so that the result is deterministic
+    return sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:number]
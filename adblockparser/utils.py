@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import re
+import threading
+import time
+from collections import OrderedDict
 
 
 def split_data(iterable, pred):
@@ -19,3 +23,276 @@ def split_data(iterable, pred):
         else:
             no.append(d)
     return yes, no
+
+
+def _domain_variants(domain):
+    """
+    >>> list(_domain_variants("foo.bar.example.com"))
+    ['foo.bar.example.com', 'bar.example.com', 'example.com']
+    >>> list(_domain_variants("example.com"))
+    ['example.com']
+    >>> list(_domain_variants("localhost"))
+    ['localhost']
+    """
+    parts = domain.split('.')
+    if len(parts) == 1:
+        yield parts[0]
+    else:
+        for i in range(len(parts), 1, -1):
+            yield ".".join(parts[-i:])
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping which keeps at most ``maxsize`` most recently
+    used items. If ``ttl`` (in seconds) is not None, items expire ``ttl``
+    seconds after they are set.
+
+    Lookups which found (``hits``) or didn't find (``misses``) a value
+    are counted; ``evictions`` is a number of items dropped because
+    the cache was full or because they expired.
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> print(cache.get('b'))
+    None
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, maxsize, ttl=None, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self._timer():
+                self.misses += 1
+                self.evictions += 1
+                return default
+            self._data[key] = value, expires
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        expires = None if self.ttl is None else self._timer() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value, expires
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """ Remove ``key`` and return its value (or ``default``) """
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and (item[1] is None or item[1] > self._timer())
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ Return a dict with cache statistics. """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+        }
+
+
+class ShardedRegex(object):
+    """
+    A list of compiled regexes (shards) which are searched one after
+    another; ``search`` returns the first match. Each shard is combined
+    from ``shard_size`` regexes (the last one can be smaller).
+    """
+    __slots__ = ['shards', 'shard_size']
+
+    def __init__(self, shards, shard_size=None):
+        self.shards = shards
+        self.shard_size = shard_size
+
+    def search(self, text):
+        for shard in self.shards:
+            match = shard.search(text)
+            if match:
+                return match
+        return None
+
+
+def _combined_regex(regexes, flags=re.IGNORECASE, use_re2=False, max_mem=None,
+                    shard_size=None):
+    """
+    Return a compiled regex combined (using OR) from a list of ``regexes``.
+    If there is nothing to combine, None is returned.
+
+    If ``shard_size`` is set and there are more regexes,
+    they are split into shards of at most ``shard_size`` regexes,
+    each compiled separately, and ShardedRegex is returned. This bounds
+    compile time and memory needed for a single regex.
+
+    >>> regex = _combined_regex(["foo", "bar", "baz"], shard_size=2)
+    >>> len(regex.shards)
+    2
+    >>> regex.search("xBAZx").group()
+    'BAZ'
+
+    re2 library (https://github.com/axiak/pyre2) often can match and compile
+    large regexes much faster than stdlib re module (10x is not uncommon),
+    but there are some gotchas:
+
+    * in case of "DFA out of memory" errors use ``max_mem`` argument
+      to increase the amount of memory re2 is allowed to use,
+      or make ``shard_size`` smaller.
+    """
+    regexes = [r for r in regexes if r]
+    if not regexes:
+        return None
+    if shard_size and len(regexes) > shard_size:
+        return ShardedRegex([
+            _compile(_join_regexes(regexes[start:start + shard_size]),
+                     flags, use_re2, max_mem)
+            for start in range(0, len(regexes), shard_size)
+        ], shard_size)
+    return _compile(_join_regexes(regexes), flags, use_re2, max_mem)
+
+
+# Pieces of regexes created by AdblockRule.rule_to_regex which
+# are handled as single tokens by _join_regexes.
+_REGEX_TOKEN_RE = re.compile(r"""
+    \^\(\?:\[\^:/\?\#\]\+:\)\?\(\?://\(\?:\[\^/\?\#\]\*\\\.\)\?\)\?  # ||
+    | \(\?:\[\^\\w(?:\\d_)?\\-\.%\]\|\$\)  # ^ separator
+    | \A\^            # | at the start
+    | \.\*             # * wildcard
+    | \\.              # escaped character
+    | \$\Z             # | at the end
+    | [^\\()\[\]{}|*+?^$]  # a character
+""", re.VERBOSE)
+
+# Deeper factoring is not worth the nesting of groups.
+_MAX_FACTORING_DEPTH = 50
+
+
+def _join_regexes(regexes):
+    """
+    Return a regex which matches if any of ``regexes`` matches.
+
+    Regexes created from plain rules are split into tokens and put into
+    a trie, so that common prefixes are matched once: the result is
+    a smaller regex which compiles and searches faster than
+    ``"|".join(regexes)``. Other regexes (e.g. ``/regex/`` rules)
+    are joined as is. A regex is dropped if another one is its prefix,
+    because the shorter one matches whenever the longer one does.
+
+    >>> print(_join_regexes([r"ads\\.", r"adv\\.", r"ad", r"banner\\.(?:js|gif)"]))
+    ad|banner\\.(?:js|gif)
+    >>> print(_join_regexes([r"^foo\\.js$", r"^foo\\.gif", r"^bar"]))
+    ^(?:foo\\.(?:js$|gif)|bar)
+    """
+    trie = OrderedDict()
+    other = []
+    for regex in regexes:
+        tokens = _regex_tokens(regex)
+        if tokens is None:
+            other.append(regex)
+            continue
+        node = trie
+        for token in tokens:
+            if None in node:  # a prefix is already there
+                break
+            node = node.setdefault(token, OrderedDict())
+        else:
+            node.clear()
+            node[None] = True
+    factored = [_trie_regex(token, child, 0) for token, child in trie.items()]
+    return "|".join(factored + other)
+
+
+def _regex_tokens(regex):
+    tokens = []
+    pos = 0
+    while pos < len(regex):
+        match = _REGEX_TOKEN_RE.match(regex, pos)
+        if match is None:
+            return None
+        tokens.append(match.group())
+        pos = match.end()
+    return tokens
+
+
+def _trie_regex(token, node, depth):
+    parts = [token]
+    while None not in node and len(node) == 1:
+        token, node = next(iter(node.items()))
+        parts.append(token)
+    if None not in node:
+        if depth < _MAX_FACTORING_DEPTH:
+            alternatives = [_trie_regex(token, child, depth + 1)
+                            for token, child in node.items()]
+        else:
+            alternatives = [_trie_regex_flat(token, child)
+                            for token, child in node.items()]
+        parts.append("(?:%s)" % "|".join(alternatives))
+    return "".join(parts)
+
+
+def _trie_regex_flat(token, node):
+    return "|".join(token + suffix for suffix in _trie_suffixes(node))
+
+
+def _trie_suffixes(node):
+    stack = [('', node)]
+    while stack:
+        prefix, node = stack.pop()
+        if None in node:
+            yield prefix
+            continue
+        for token, child in node.items():
+            stack.append((prefix + token, child))
+
+
+def _compile(regex, flags, use_re2, max_mem):
+    if use_re2:
+        import re2
+        return re2.compile(regex, flags=flags, max_mem=max_mem)
+    return re.compile(regex, flags=flags)
+
+
+def _is_re2_supported():
+    try:
+        import re2
+    except ImportError:
+        return False
+
+    # re2.match doesn't work in re2 v0.2.20 installed from pypi
+    # (it always returns None).
+    return re2.match('foo', 'foo') is not None
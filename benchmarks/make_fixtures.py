@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generate benchmark fixtures: filter lists which look like EasyList and
+EasyPrivacy (the same mix of rule types, options and domains) and a corpus
+of URLs with request options. Output is deterministic, so the generated
+files are kept in the repository and benchmarks run offline;
+run this script only to change the fixtures.
+
+Usage: python benchmarks/make_fixtures.py
+"""
+from __future__ import absolute_import, print_function
+import io
+import os
+import random
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+WORDS = [
+    'ad', 'ads', 'adv', 'advert', 'banner', 'sponsor', 'promo', 'popup',
+    'track', 'tracker', 'pixel', 'beacon', 'analytics', 'stats', 'count',
+    'click', 'affiliate', 'partner', 'widget', 'tag', 'metrics', 'social',
+    'media', 'static', 'cdn', 'img', 'news', 'shop', 'video', 'player',
+    'user', 'api', 'event', 'log', 'collect', 'sync', 'match', 'bid',
+]
+SIZES = ['120x600', '160x600', '300x250', '468x60', '728x90', '970x250']
+TLDS = ['com', 'net', 'org', 'de', 'fr', 'ru', 'co.uk', 'io', 'info']
+TYPES = ['script', 'image', 'stylesheet', 'object', 'xmlhttprequest',
+         'subdocument', 'other']
+
+
+class Generator(object):
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.sites = [self.host() for _ in range(300)]
+        self.ad_hosts = [self.host() for _ in range(3000)]
+
+    def word(self):
+        return self.random.choice(WORDS)
+
+    def name(self):
+        return self.word() + self.random.choice(['', '', 's', '-', '_']) + \
+            str(self.random.randint(0, 99))
+
+    def host(self):
+        labels = [self.name().strip('-_') for _ in range(self.random.randint(1, 2))]
+        return '.'.join(labels) + '.' + self.random.choice(TLDS)
+
+    def domains(self, count=None):
+        count = count or self.random.randint(1, 4)
+        sites = self.random.sample(self.sites, count)
+        if self.random.random() < 0.3:
+            sites.append('~' + self.random.choice(self.sites))
+        return '|'.join(sites)
+
+    def options(self, domain=None):
+        options = []
+        if self.random.random() < 0.5:
+            options.append(self.random.choice(['third-party', '~third-party']))
+        if self.random.random() < 0.5:
+            options.append(self.random.choice(TYPES + ['~' + t for t in TYPES]))
+        if domain or (domain is None and self.random.random() < 0.3):
+            options.append('domain=' + self.domains())
+        return '$' + ','.join(options) if options else ''
+
+    def url_rule(self):
+        r = self.random.random()
+        if r < 0.35:
+            return '||%s^' % self.random.choice(self.ad_hosts)
+        if r < 0.45:
+            return '||%s^%s' % (self.random.choice(self.ad_hosts), self.options())
+        if r < 0.55:
+            return '||%s/%s/%s.' % (self.random.choice(self.sites), self.name(), self.name())
+        if r < 0.65:
+            return '/%s/%s.' % (self.name(), self.name())
+        if r < 0.72:
+            return '-%s-%s.' % (self.word(), self.random.choice(SIZES))
+        if r < 0.77:
+            return '_%s_%s_' % (self.word(), self.word())
+        if r < 0.81:
+            return '&%s_%s=' % (self.word(), self.word())
+        if r < 0.85:
+            return '/%s/*/%s^' % (self.name(), self.word())
+        if r < 0.87:
+            return '/%s*%s.' % (self.word(), self.random.choice(SIZES))
+        if r < 0.88:
+            return r'/\/%s[0-9]+\/%s\./' % (self.word(), self.word())
+        if r < 0.96:
+            return '/%s.%s%s' % (self.name(), self.random.choice(['js', 'gif', 'php']),
+                                 self.options(domain=True))
+        return '|http://%s/%s/' % (self.random.choice(self.ad_hosts), self.word())
+
+    def exception_rule(self):
+        r = self.random.random()
+        if r < 0.5:
+            return '@@||%s/%s/%s' % (self.random.choice(self.sites), self.name(),
+                                     self.options(domain=False))
+        if r < 0.8:
+            return '@@||%s^%s' % (self.random.choice(self.ad_hosts),
+                                  self.options(domain=True))
+        return '@@/%s/%s.%s' % (self.word(), self.name(), self.options())
+
+    def html_rule(self):
+        selector = self.random.choice(['.', '#']) + '%s-%s' % (self.word(), self.word())
+        r = self.random.random()
+        if r < 0.5:
+            return '##' + selector
+        domains = ','.join(self.random.sample(self.sites, self.random.randint(1, 3)))
+        if r < 0.9:
+            return '%s##%s' % (domains, selector)
+        return '%s#@#%s' % (domains, selector)
+
+    def filter_list(self, title, rule_count, html_rule_count):
+        lines = [
+            '[Adblock Plus 2.0]',
+            '! Version: 201701010000',
+            '! Title: %s' % title,
+            '! Expires: 4 days',
+            '! Synthetic list for adblockparser benchmarks',
+        ]
+        rules = [self.url_rule() for _ in range(int(rule_count * 0.9))]
+        rules += [self.exception_rule() for _ in range(rule_count - len(rules))]
+        rules += [self.html_rule() for _ in range(html_rule_count)]
+        self.random.shuffle(rules)
+        for i, rule in enumerate(rules):
+            if i % 200 == 0:
+                lines.append('! *** section %d ***' % (i // 200))
+            lines.append(rule)
+        return lines
+
+    def url(self):
+        r = self.random.random()
+        host = self.random.choice(self.ad_hosts if r < 0.3 else self.sites)
+        if self.random.random() < 0.3:
+            host = 'www.' + host
+        path = '/'.join(self.name() for _ in range(self.random.randint(1, 3)))
+        ext = self.random.choice(['js', 'gif', 'png', 'html', 'php', 'css'])
+        url = '%s://%s/%s.%s' % (self.random.choice(['http', 'https']), host, path, ext)
+        if self.random.random() < 0.3:
+            url += '?%s=%s&%s_%s=1' % (self.word(), self.name(), self.word(), self.word())
+        return url
+
+    def url_corpus(self, count):
+        lines = []
+        for _ in range(count):
+            lines.append('%s\t%s\t%s' % (
+                self.url(), self.random.choice(self.sites), self.random.choice(TYPES)
+            ))
+        return lines
+
+
+def write_lines(filename, lines):
+    with io.open(os.path.join(DATA_DIR, filename), 'w', encoding='utf8') as f:
+        for line in lines:
+            f.write(u'%s\n' % line)
+
+
+def main():
+    generator = Generator(seed=2017)
+    write_lines('easylist.txt', generator.filter_list('EasyList-like', 4000, 1500))
+    write_lines('easyprivacy.txt', generator.filter_list('EasyPrivacy-like', 2000, 0))
+    write_lines('urls.tsv', generator.url_corpus(2000))
+
+
+if __name__ == '__main__':
+    main()
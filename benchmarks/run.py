@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+adblockparser benchmarks. They use filter lists and URLs from
+benchmarks/data (see make_fixtures.py), so no network access is needed.
+
+Measured:
+
+* AdblockRules construction time (and peak memory on Python 3);
+* ``should_block`` latency percentiles: without options, with options
+  and with options including the source domain;
+* ``should_block_many`` throughput, with options shared by all URLs
+  and with options per URL, next to a ``should_block`` loop.
+
+Each benchmark runs with stdlib re, and also with re2 if it is installed.
+
+Usage::
+
+    python benchmarks/run.py                       # print results
+    python benchmarks/run.py --save base.json      # save results
+    python benchmarks/run.py --compare base.json   # fail on regressions
+
+"""
+from __future__ import absolute_import, print_function, division
+import argparse
+import gc
+import io
+import json
+import os
+import sys
+import timeit
+
+try:
+    import tracemalloc  # Python 3.4+
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from adblockparser import AdblockRules
+from adblockparser.utils import _is_re2_supported
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+LISTS = [os.path.join(DATA_DIR, name) for name in ['easylist.txt', 'easyprivacy.txt']]
+URLS = os.path.join(DATA_DIR, 'urls.tsv')
+
+timer = timeit.default_timer
+
+
+def read_urls(path, limit=None):
+    """ Return a list of (url, options) tuples """
+    requests = []
+    with io.open(path, encoding='utf8') as f:
+        for line in f:
+            url, domain, content_type = line.rstrip('\n').split('\t')
+            options = {
+                content_type: True,
+                'third-party': domain.split('.')[-2:] != url.split('/')[2].split('.')[-2:],
+                'domain': domain,
+            }
+            requests.append((url, options))
+    return requests[:limit]
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def bench_build(use_re2, repeat, **kwargs):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = timer()
+        AdblockRules.from_files(LISTS, use_re2=use_re2, **kwargs)
+        times.append(timer() - start)
+    result = {'time': min(times)}
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        rules = AdblockRules.from_files(LISTS, use_re2=use_re2, **kwargs)
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        del rules
+    return result
+
+
+def bench_latency(rules, requests, scenario):
+    calls = [(url, _scenario_options(options, scenario)) for url, options in requests]
+    for url, options in calls:  # warmup: compile lazy regexes, fill caches
+        rules.should_block(url, options)
+    times = []
+    should_block = rules.should_block
+    for url, options in calls:
+        start = timer()
+        should_block(url, options)
+        times.append(timer() - start)
+    times.sort()
+    return dict(
+        ('p%d_us' % p, percentile(times, p) * 1e6) for p in [50, 90, 99, 100]
+    )
+
+
+def bench_batch(rules, requests, scenario, repeat, per_url=False):
+    urls = [url for url, options in requests]
+    if per_url:
+        options = [_scenario_options(opts, scenario) for url, opts in requests]
+        loop_options = options
+    else:
+        # the same options are used for all URLs in a batch
+        options = _scenario_options(requests[0][1], scenario)
+        loop_options = [options] * len(urls)
+
+    def loop():
+        should_block = rules.should_block
+        return [should_block(url, opts) for url, opts in zip(urls, loop_options)]
+
+    rules.should_block_many(urls, options)  # warmup
+    loop()
+    times, loop_times = [], []
+    for _ in range(repeat):
+        start = timer()
+        rules.should_block_many(urls, options)
+        times.append(timer() - start)
+        start = timer()
+        loop()
+        loop_times.append(timer() - start)
+    return {
+        'urls_per_s': len(urls) / min(times),
+        'loop_urls_per_s': len(urls) / min(loop_times),
+    }
+
+
+def _scenario_options(options, scenario):
+    if scenario == 'no-options':
+        return None
+    if scenario == 'options':
+        return dict((key, value) for key, value in options.items() if key != 'domain')
+    return options
+
+
+def run(args):
+    requests = read_urls(URLS, args.urls)
+    engines = [('re', False)]
+    if _is_re2_supported():
+        engines.append(('re2', True))
+    elif not args.quiet:
+        print("re2 is not installed; only stdlib re is benchmarked\n")
+
+    results = {}
+    for engine, use_re2 in engines:
+        for lazy in [False, True]:
+            name = 'build/%s%s' % (engine, '/lazy' if lazy else '')
+            results[name] = bench_build(use_re2, args.repeat, lazy=lazy)
+            _report(name, results[name], args)
+
+        rules = AdblockRules.from_files(LISTS, use_re2=use_re2)
+        for scenario in ['no-options', 'options', 'options-domain']:
+            name = 'should_block/%s/%s' % (engine, scenario)
+            results[name] = bench_latency(rules, requests, scenario)
+            _report(name, results[name], args)
+
+            name = 'should_block_many/%s/%s' % (engine, scenario)
+            results[name] = bench_batch(rules, requests, scenario, args.repeat)
+            _report(name, results[name], args)
+
+            if scenario != 'no-options':
+                name = 'should_block_many/%s/%s-per-url' % (engine, scenario)
+                results[name] = bench_batch(rules, requests, scenario, args.repeat,
+                                            per_url=True)
+                _report(name, results[name], args)
+    return results
+
+
+def _report(name, result, args):
+    if args.quiet:
+        return
+    values = ", ".join("%s=%.1f" % (key, value) for key, value in sorted(result.items()))
+    print("%-48s %s" % (name, values))
+
+
+# p99 and max latencies are too noisy to be compared
+COMPARED = ['time', 'peak_mb', 'p50_us', 'p90_us', 'urls_per_s', 'loop_urls_per_s']
+
+
+def compare(results, baseline, max_slowdown):
+    """ Return a list of regressions, comparing ``results`` to ``baseline`` """
+    regressions = []
+    for name, result in sorted(results.items()):
+        for key, value in sorted(result.items()):
+            if key not in COMPARED:
+                continue
+            base = baseline.get(name, {}).get(key)
+            if not base:
+                continue
+            # throughput: higher is better; times and memory: lower is better
+            ratio = base / value if key.endswith('urls_per_s') else value / base
+            if ratio > max_slowdown:
+                regressions.append("%s %s: %.1f -> %.1f (%.2fx)" % (
+                    name, key, base, value, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--urls', type=int, default=1000,
+                        help="number of URLs to check (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="repeat build and batch benchmarks (default: %(default)s)")
+    parser.add_argument('--save', metavar='PATH', help="save results to a JSON file")
+    parser.add_argument('--compare', metavar='PATH',
+                        help="compare results to a JSON file saved before")
+    parser.add_argument('--max-slowdown', type=float, default=1.5,
+                        help="exit with an error if a result is this many times "
+                             "worse than in --compare file (default: %(default)s)")
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_slowdown)
+        for regression in regressions:
+            print("REGRESSION: %s" % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
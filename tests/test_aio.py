@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from adblockparser import AdblockRules
+from adblockparser.aio import AsyncMatcher, create_rules
+
+RULES = [
+    "||ads.example.com^",
+    "@@||ads.example.com/notbanner^$~script",
+    "/banner/*/img^$third-party",
+    "/track.$domain=example.org",
+]
+
+CHECKS = [
+    ("http://ads.example.com/notbanner", {'script': False}),
+    ("http://ads.example.com/notbanner", {'script': True}),
+    ("http://example.com/banner/foo/img", {'third-party': True}),
+    ("http://example.com/banner/foo/img", None),
+    ("http://example.com/track.gif", {'domain': 'www.example.org'}),
+    ("http://example.com/track.gif", {'domain': 'example.com'}),
+    ("http://example.com/", None),
+]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def expected_results(rules):
+    return [rules.should_block(url, options) for url, options in CHECKS]
+
+
+async def check_all(check):
+    return list(await asyncio.gather(*[
+        check(url, options) for url, options in CHECKS
+    ]))
+
+
+def test_should_block_async():
+    rules = AdblockRules(RULES, thread_safe=True)
+    assert run(check_all(rules.should_block_async)) == expected_results(rules)
+    assert rules.async_matcher.batches == 1
+
+
+def test_should_block_many_async():
+    rules = AdblockRules(RULES)
+    urls = [url for url, options in CHECKS]
+    options = [options for url, options in CHECKS]
+    assert run(rules.should_block_many_async(urls, iter(options))) == \
+        expected_results(rules)
+    assert run(rules.should_block_many_async(urls, {'script': False})) == \
+        rules.should_block_many(urls, {'script': False})
+
+
+@pytest.mark.parametrize('max_batch_size', [1, 2, 1000])
+def test_batches(max_batch_size):
+    rules = AdblockRules(RULES)
+    with ThreadPoolExecutor(2) as executor:
+        matcher = AsyncMatcher(rules, executor=executor,
+                               max_batch_size=max_batch_size)
+        assert run(check_all(matcher.should_block)) == expected_results(rules)
+    assert matcher.batches == -(-len(CHECKS) // max_batch_size)
+
+
+def test_processes():
+    rules = AdblockRules(RULES)
+    matcher = AsyncMatcher(rules, processes=2)
+    try:
+        assert run(check_all(matcher.should_block)) == expected_results(rules)
+    finally:
+        matcher.close()
+
+
+def test_errors():
+    rules = AdblockRules(["/banner/$script"], skip_unsupported_rules=False)
+
+    async def check():
+        return await asyncio.gather(
+            rules.should_block_async("http://example.com/banner/", {'script': True}),
+            rules.should_block_async("http://example.com/banner/"),
+            return_exceptions=True,
+        )
+
+    result, error = run(check())
+    assert result is True
+    assert isinstance(error, ValueError)
+
+
+def test_create_rules_and_reload():
+    async def reload():
+        rules = await create_rules(
+            [io.BytesIO(b"||ads.example.com^\n")], factory=AdblockRules.from_files)
+        matcher = AsyncMatcher(rules)
+        before = await matcher.should_block("http://tracker.example.org/")
+        new_rules = await matcher.reload(["||tracker.example.org^"], thread_safe=True)
+        after = await matcher.should_block("http://tracker.example.org/")
+        return before, after, new_rules
+
+    before, after, new_rules = run(reload())
+    assert (before, after) == (False, True)
+    assert new_rules.thread_safe
+
+
+def test_executor_and_processes():
+    with pytest.raises(ValueError):
+        AsyncMatcher(AdblockRules(RULES), executor=ThreadPoolExecutor(1), processes=2)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import threading
+
+from adblockparser import AdblockRules, RequestOptions
+from adblockparser.utils import LRUCache
+
+RULES = [
+    "||ads.example.com^",
+    "adv$script",
+    "@@advice.$script,domain=example.com",
+]
+
+URLS = [
+    "http://ads.example.com/banner.gif",
+    "http://example.com/advert.js",
+    "http://example.com/advice.js",
+    "http://example.com/",
+]
+
+OPTIONS = [
+    None,
+    {'script': True},
+    {'script': False},
+    {'script': True, 'domain': 'example.com'},
+    {'script': True, 'domain': 'example.net'},
+]
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_ttl():
+    timer = FakeTimer()
+    cache = LRUCache(10, ttl=5, timer=timer)
+    cache['a'] = 1
+    timer.now = 4
+    assert cache.get('a') == 1
+    assert 'a' in cache
+    timer.now = 5
+    assert 'a' not in cache
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 0}
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(2)
+    for key in 'abcd':
+        cache[key] = key
+    assert cache.keys() == ['c', 'd']
+    assert cache.evictions == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_result_cache():
+    cached_rules = AdblockRules(RULES, result_cache_size=100)
+    rules = AdblockRules(RULES)
+    assert rules.result_cache is None
+
+    for _ in range(2):
+        for options in OPTIONS:
+            for url in URLS:
+                expected = rules.should_block(url, options)
+                assert cached_rules.should_block(url, options) == expected
+                if options is not None:
+                    request = RequestOptions(options)
+                    assert cached_rules.should_block(url, request) == expected
+
+    stats = cached_rules.result_cache.stats()
+    assert stats['misses'] == len(URLS) * len(OPTIONS)
+    assert stats['hits'] == len(URLS) * (len(OPTIONS) * 3 - 2)
+    assert stats['evictions'] == 0
+
+
+def test_result_cache_size_and_ttl():
+    rules = AdblockRules(RULES, result_cache_size=2, result_cache_ttl=60)
+    for url in URLS:
+        rules.should_block(url)
+    assert len(rules.result_cache) == 2
+    assert rules.result_cache.evictions == len(URLS) - 2
+    assert rules.result_cache.ttl == 60
+
+
+def test_result_cache_unhashable_options():
+    rules = AdblockRules(RULES, result_cache_size=10)
+    assert rules.should_block("http://example.com/advert.js",
+                              {'script': True, 'extra': []})
+    assert len(rules.result_cache) == 0
+
+
+def test_result_cache_threads():
+    rules = AdblockRules(RULES, result_cache_size=3)
+    expected = dict(
+        (url, AdblockRules(RULES).should_block(url, {'script': True}))
+        for url in URLS
+    )
+    errors = []
+
+    def check():
+        for _ in range(200):
+            for url in URLS:
+                if rules.should_block(url, {'script': True}) != expected[url]:
+                    errors.append(url)
+
+    threads = [threading.Thread(target=check) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    stats = rules.result_cache.stats()
+    assert stats['hits'] + stats['misses'] == 8 * 200 * len(URLS)
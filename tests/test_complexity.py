@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import random
+import re
+import time
+
+import pytest
+
+from adblockparser import AdblockRule, AdblockRules
+from adblockparser.complexity import (
+    rule_issues, regex_issues, WildcardRegex, RegexGuard
+)
+
+RULES = [
+    "||ads.example.com^",
+    "/banner/*/img^",
+    "/ads/*/*/*/*.gif",
+    "|http://*.example.org/*/*/track*.js|",
+    "||cdn.example.com^*/a*/b*/c*.js",
+    "/(ad.*)+js/",
+    r"/\/(\w+)+\.php/",
+    "/promo/*/*/*/*$script",
+    "@@/ads/*/*/*/ok*$image",
+    "@@/sponsor/*/*/*/*.png",
+]
+
+URLS = [
+    "http://ads.example.com/",
+    "http://example.com/banner/foo/img.gif",
+    "http://example.com/ads/1/2/3/x.gif",
+    "http://example.com/ads/1/2/3/ok.gif",
+    "http://www.example.org/x/y/tracker.js",
+    "http://www.example.org/x/y/tracker.js?",
+    "http://cdn.example.com/x/a1/b2/c3.js",
+    "http://cdn.example.com/x/c3/b2/a1.js",
+    "http://example.com/adjs",
+    "http://example.com/foo_bar.php",
+    "http://example.com/promo/1/2/3/4/x",
+    "http://example.com/sponsor/1/2/3/x.png",
+    "http://example.com/sponsor/1/2/3/x.gif",
+]
+
+
+def test_rule_issues():
+    assert rule_issues(AdblockRule("/ads/*/img")) == []
+    assert rule_issues(AdblockRule("/ads/*/*/*/*.gif")) == ['4 unbounded wildcards']
+    assert rule_issues(AdblockRule("/ads/*/*/*/*.gif"), max_wildcards=4) == []
+    assert rule_issues(AdblockRule("/ad.*/")) == []
+    assert rule_issues(AdblockRule("/(ad.*)+js/")) == ['nested quantifiers']
+
+
+def test_regex_issues():
+    assert regex_issues(r"a{1,3}b") == []
+    assert regex_issues(r"(ab)+c") == []
+    assert regex_issues(r"(a+)+b") == ['nested quantifiers']
+    assert regex_issues(r"(?:x|(a*)*)b") == ['nested quantifiers']
+    assert regex_issues(r"a.*b.*c.*d") == ['3 unbounded quantifiers']
+    assert regex_issues(r"(unbalanced") == []
+
+
+@pytest.mark.parametrize('flags', [0, re.IGNORECASE])
+def test_wildcard_regex_fuzz(flags):
+    rnd = random.Random(flags)
+    checked = 0
+    while checked < 300:
+        text = ''.join(rnd.choice('ab/.^*-') for _ in range(rnd.randint(1, 7)))
+        text = rnd.choice(['', '|', '||']) + text + rnd.choice(['', '|'])
+        if not WildcardRegex.supports(text):
+            continue
+        rule = AdblockRule(text)
+        if not rule.rule_text:
+            continue
+        checked += 1
+        wildcard_regex = WildcardRegex(rule.rule_text, flags)
+        regex = re.compile(rule.regex, flags)
+        for _ in range(20):
+            url = rnd.choice(['', 'http://', 'http://a.', '//']) + ''.join(
+                rnd.choice('abAB/.-:?x\n') for _ in range(rnd.randint(0, 12)))
+            assert bool(wildcard_regex.search(url)) == bool(regex.search(url)), \
+                (text, url)
+
+
+def test_wildcard_regex_is_fast():
+    regex = WildcardRegex("/a*a*a*a*a*a*b")
+    url = "http://example.com/" + "a" * 5000
+    start = time.time()
+    assert regex.search(url) is None
+    assert time.time() - start < 1
+
+
+def test_guard_is_slow_rules_only():
+    guard = RegexGuard()
+    assert not guard.is_expensive(AdblockRule("/banner/*/img"))
+    assert guard.is_expensive(AdblockRule("/ads/*/*/*/*.gif"))
+    assert isinstance(guard.compile(AdblockRule("/ads/*/*/*/*.gif")), WildcardRegex)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_guarded_rules_results(lazy):
+    rules = AdblockRules(RULES, lazy=lazy)
+    guarded = AdblockRules(RULES, lazy=lazy, guard_regexes=True)
+    assert len(guarded.blacklist_index.isolated) == 5
+    assert len(guarded.whitelist_index.isolated) == 1
+    for options in [None, {'script': True, 'image': False},
+                    {'script': False, 'image': True}]:
+        for url in URLS:
+            assert guarded.should_block(url, options) == \
+                rules.should_block(url, options), (url, options)
+            assert repr(guarded.match(url, options)) == \
+                repr(rules.match(url, options)), (url, options)
+        assert guarded.should_block_many(URLS, options) == \
+            rules.should_block_many(URLS, options)
+
+
+def test_guarded_rules_update():
+    rules = AdblockRules(RULES, guard_regexes=True)
+    assert rules.should_block("http://example.com/ads/1/2/3/x.gif")
+    rules.remove_rules(["/ads/*/*/*/*.gif"])
+    assert not rules.should_block("http://example.com/ads/1/2/3/x.gif")
+    rules.add_rules(["/ads/*/*/*/*.gif"])
+    assert rules.should_block("http://example.com/ads/1/2/3/x.gif")
+
+
+def test_expensive_rules():
+    rules = AdblockRules(RULES)
+    assert [rule.raw_rule_text for rule, issues in rules.expensive_rules()] == [
+        "/ads/*/*/*/*.gif",
+        "|http://*.example.org/*/*/track*.js|",
+        "||cdn.example.com^*/a*/b*/c*.js",
+        "/(ad.*)+js/",
+        r"/\/(\w+)+\.php/",
+        "/promo/*/*/*/*$script",
+        "@@/ads/*/*/*/ok*$image",
+        "@@/sponsor/*/*/*/*.png",
+    ]
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    AdblockRules(RULES, guard_regexes=True).save(path)
+    rules = AdblockRules.load(path)
+    assert rules.guard_regexes
+    assert len(rules.blacklist_index.isolated) == 5
+    expected = AdblockRules(RULES)
+    for url in URLS:
+        assert rules.should_block(url) == expected.should_block(url)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pytest
+
+from adblockparser import AdblockRules, AdblockRule
+from adblockparser.elemhide import ElementHidingIndex, parse_html_rule
+
+RULES = [
+    "||ads.example.com^",
+    "##.ad",
+    "##.banner",
+    "###ADSLOT_SKYSCRAPER",
+    "##a[href$=\".exe\"]",
+    "example.com##.sponsored",
+    "example.com,example.org##.banner",
+    "Example.com,~shop.example.com##.promo",
+    "~example.net##.tracker",
+    "~foo.example.net##.tracker",
+    "shop.example.com#@#.ad",
+    "example.net#@#.banner",
+    "#@##ADSLOT_SKYSCRAPER",
+    "~example.org#@#.widget",
+    "##.widget",
+]
+
+SELECTORS = {
+    "www.example.com": (
+        '.sponsored', '.banner', '.promo', '.ad',
+        'a[href$=".exe"]', '.tracker',
+    ),
+    "shop.example.com": (
+        '.sponsored', '.banner', 'a[href$=".exe"]', '.tracker',
+    ),
+    "EXAMPLE.ORG": (
+        '.banner', '.ad', 'a[href$=".exe"]', '.tracker', '.widget',
+    ),
+    "example.net": (
+        '.ad', 'a[href$=".exe"]', '.tracker',
+    ),
+    "foo.example.net": (
+        '.ad', 'a[href$=".exe"]',
+    ),
+    "localhost": (
+        '.ad', '.banner', 'a[href$=".exe"]', '.tracker',
+    ),
+}
+
+
+def naive_selectors(rules, domain):
+    """ Check all rules one-by-one """
+    def applies(domains, domain):
+        if not domains:
+            return True
+        parts = domain.lower().split('.')
+        for i in range(len(parts)):
+            variant = '.'.join(parts[i:])
+            if variant in domains:
+                return domains[variant]
+        return not any(domains.values())
+
+    parsed = [parse_html_rule(text) for text in rules if '#' in text]
+    disabled = set(
+        selector for domains, selector, is_exception in parsed
+        if is_exception and applies(domains, domain)
+    )
+    return set(
+        selector for domains, selector, is_exception in parsed
+        if not is_exception and selector not in disabled and applies(domains, domain)
+    )
+
+
+@pytest.mark.parametrize('cache_size', [0, 10])
+@pytest.mark.parametrize('domain', sorted(SELECTORS))
+def test_get_css_selectors(domain, cache_size):
+    rules = AdblockRules(RULES, domain_cache_size=cache_size)
+    selectors = rules.get_css_selectors(domain)
+    assert selectors == SELECTORS[domain]
+    assert set(selectors) == naive_selectors(RULES, domain)
+    assert rules.get_css_selectors(domain) == selectors
+
+
+def test_generic_selectors():
+    rules = AdblockRules(RULES)
+    assert rules.get_generic_css_selectors() == (
+        '.ad', '.banner', 'a[href$=".exe"]', '.widget'
+    )
+    assert rules.get_stylesheet() == (
+        '.ad, .banner, a[href$=".exe"], .widget {display: none !important;}\n'
+    )
+    assert AdblockRules([]).get_stylesheet("example.com") == ''
+
+
+def test_html_rules_are_kept():
+    rules = AdblockRules(RULES)
+    assert len(rules.html_rules) == len(RULES) - 1
+    assert len(rules.rules) == 1
+    rule = AdblockRule('##a[href$=".exe"]')
+    assert rule.is_html_rule
+    assert rule.options == {}
+    assert not rules.should_block("http://example.com/ad.exe")
+
+
+def test_update_html_rules():
+    rules = AdblockRules(["##.ad"])
+    assert rules.get_css_selectors("example.com") == ('.ad',)
+    rules.add_rules(["example.com#@#.ad", "example.com##.promo"])
+    assert rules.get_css_selectors("example.com") == ('.promo',)
+    assert rules.get_css_selectors("example.org") == ('.ad',)
+    assert [r.raw_rule_text for r in rules.remove_rules(["example.com#@#.ad"])] == \
+        ["example.com#@#.ad"]
+    assert rules.get_css_selectors("example.com") == ('.promo', '.ad')
+    rules.apply_diff(["##.ad", "example.com##.promo"], ["##.banner"])
+    assert rules.get_css_selectors("example.com") == ('.banner',)
+    assert len(rules.elemhide) == 1
+
+
+def test_index_ignores_non_html_rules():
+    index = ElementHidingIndex()
+    assert not index.add(AdblockRule("||example.com/##foo"))
+    assert len(index) == 0
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import base64
+import hashlib
+import io
+import re
+
+import pytest
+
+from adblockparser import (
+    AdblockRules, AdblockRule, FilterList, AdblockChecksumError
+)
+
+LIST = u"""[Adblock Plus 2.0]
+! Version: 201701011200
+! Title: Test list
+! Expires: 4 days (update frequency)
+
+! General rules
+||ads.example.com^
+@@||ads.example.com/notbanner^$~script
+\r
+/banner/*/img^\r
+example.com##.ad
+! Последнее правило
+/баннер/
+"""
+
+
+def add_checksum(data):
+    """ The way Adblock Plus adds checksums """
+    checksum_re = re.compile(r'^\s*!\s*checksum[\s\-:]+([\w\+\/=]+).*\n', re.I | re.M)
+    normalized = re.sub(r'\n+', '\n', data.replace('\r', ''))
+    normalized = checksum_re.sub('', normalized)
+    md5 = hashlib.md5(normalized.encode('utf8')).digest()
+    checksum = base64.b64encode(md5).decode('ascii').rstrip('=')
+    return re.sub(r'(\r?\n)', r'\1! Checksum: %s\1' % checksum, data, 1)
+
+
+def test_filter_list():
+    filter_list = FilterList(io.BytesIO(LIST.encode('utf8')))
+    assert list(filter_list) == [
+        u"||ads.example.com^",
+        u"@@||ads.example.com/notbanner^$~script",
+        u"/banner/*/img^",
+        u"example.com##.ad",
+        u"/баннер/",
+    ]
+    assert filter_list.header == 'Adblock Plus 2.0'
+    assert filter_list.metadata == {
+        'Version': '201701011200',
+        'Title': 'Test list',
+        'Expires': '4 days (update frequency)',
+    }
+    assert filter_list.checksum is None
+
+
+@pytest.mark.parametrize('data', [
+    add_checksum(LIST).encode('utf8'),
+    b'\xef\xbb\xbf' + add_checksum(LIST).encode('utf8'),
+    add_checksum(LIST.replace('\n', '\r\n')).encode('utf8'),
+    add_checksum(u"! Title: no header\n\n\n" + LIST),
+])
+def test_checksum(data):
+    fileobj = io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data)
+    filter_list = FilterList(fileobj)
+    assert len(list(filter_list)) == 5
+    assert filter_list.checksum
+
+
+def test_invalid_checksum():
+    data = add_checksum(LIST).replace('/banner/', '/banner2/').encode('utf8')
+    with pytest.raises(AdblockChecksumError):
+        list(FilterList(io.BytesIO(data)))
+    with pytest.raises(AdblockChecksumError):
+        AdblockRules.from_file(io.BytesIO(data))
+    assert len(list(FilterList(io.BytesIO(data), verify_checksum=False))) == 5
+
+
+def test_from_file(tmpdir):
+    path = str(tmpdir.join('list.txt'))
+    with io.open(path, 'w', encoding='cp1251') as f:
+        f.write(LIST)
+    rules = AdblockRules.from_file(path, encoding='cp1251', lazy=True)
+    expected = AdblockRules(LIST.splitlines())
+    assert [r.raw_rule_text for r in rules.rules] == \
+        [r.raw_rule_text for r in expected.rules]
+    assert rules.get_css_selectors("example.com") == ('.ad',)
+    assert rules.lazy
+    for url in ["http://ads.example.com/notbanner",
+                "http://example.com/banner/foo/img",
+                u"http://example.com/баннер/"]:
+        assert rules.should_block(url) == expected.should_block(url)
+
+
+def test_comments_are_not_parsed():
+    created = []
+
+    class Rule(AdblockRule):
+        __slots__ = []
+
+        def __init__(self, rule_text, lazy=False):
+            created.append(rule_text)
+            super(Rule, self).__init__(rule_text, lazy)
+
+    AdblockRules.from_files(
+        [io.BytesIO(LIST.encode('utf8')), io.BytesIO(b"! comment\n||example.net^\n")],
+        rule_cls=Rule,
+    )
+    assert len(created) == 6
+    assert not any(text.startswith(('!', '[')) for text in created)
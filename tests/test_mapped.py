@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import mmap
+
+import pytest
+
+from adblockparser import AdblockRules, MappedAdblockRules
+
+RULES = [
+    "||ads.example.com^",
+    "|http://example.com/|",
+    "/banner/*/img^",
+    "adv",
+    "@@advice.$~script",
+    r"/banner\d+/",
+    "*/ads/*",
+    "||example.com^$third-party",
+    "||example.com/Banner$script,~third-party",
+    "adv$domain=example.com|~foo.example.com",
+    "@@||example.net^$domain=example.org",
+    "/tracker.$domain=~example.com|~example.net",
+    "$websocket,domain=extratorrent.cc|firstrowau.eu",
+]
+
+URLS = [
+    "http://ads.example.com/foo.gif",
+    "http://example.com/",
+    "http://example.com/banner/foo/img",
+    "http://example.com/Banner",
+    "http://example.com/advice.html",
+    "http://example.com/advert.html",
+    "http://example.org/banner123",
+    "http://example.org/x/ads/y",
+    "http://example.net/adv",
+    "http://example.net/tracker.js",
+    u"http://example.net/реклама/adv",
+]
+
+OPTIONS = [
+    {},
+    {'script': False},
+    {'script': True, 'third-party': False},
+    {'third-party': True, 'domain': 'example.com'},
+    {'third-party': False, 'domain': 'foo.example.com'},
+    {'domain': 'example.org'},
+    {'domain': 'www.example.net'},
+    {'domain': 'extratorrent.cc', 'websocket': True},
+]
+
+
+@pytest.fixture
+def mapped_path(tmpdir):
+    return str(tmpdir.join('rules.mmap'))
+
+
+def test_mapped_matches_rules(mapped_path):
+    rules = AdblockRules(RULES)
+    MappedAdblockRules.build(rules, mapped_path)
+    with MappedAdblockRules(mapped_path) as mapped:
+        for options in OPTIONS:
+            for url in URLS:
+                assert mapped.should_block(url, options) == \
+                    rules.should_block(url, options), (url, options)
+            assert mapped.should_block_many(URLS, options) == \
+                rules.should_block_many(URLS, options)
+
+
+def test_mapped_options_per_url(mapped_path):
+    rules = AdblockRules(RULES)
+    MappedAdblockRules.build(rules, mapped_path)
+    options = [OPTIONS[i % len(OPTIONS)] for i in range(len(URLS))]
+    with MappedAdblockRules(mapped_path) as mapped:
+        assert mapped.should_block_many(URLS, iter(options)) == \
+            rules.should_block_many(URLS, options)
+        with pytest.raises(ValueError):
+            mapped.should_block_many(URLS, options[:-1])
+
+
+def test_mapped_missing_options(mapped_path):
+    rules = AdblockRules(["adv$script"], skip_unsupported_rules=False)
+    MappedAdblockRules.build(rules, mapped_path)
+    with MappedAdblockRules(mapped_path) as mapped:
+        assert mapped.should_block("http://example.com/adv", {'script': True})
+        with pytest.raises(ValueError):
+            mapped.should_block("http://example.com/adv", {})
+
+
+def test_mapped_empty(mapped_path):
+    MappedAdblockRules.build(AdblockRules([]), mapped_path)
+    with MappedAdblockRules(mapped_path) as mapped:
+        assert not mapped.should_block("http://example.com/adv", {'domain': 'example.com'})
+
+
+def test_mapped_invalid_file(mapped_path):
+    with open(mapped_path, 'wb') as f:
+        f.write(b'x' * 100)
+    with pytest.raises(ValueError):
+        MappedAdblockRules(mapped_path)
+
+    with open(mapped_path, 'wb') as f:
+        f.write(b'x' * 3)
+    with pytest.raises(ValueError):
+        MappedAdblockRules(mapped_path)
+
+
+def test_mapped_invalid_file_is_closed(mapped_path, monkeypatch):
+    maps = []
+    mmap_cls = mmap.mmap
+
+    def _mmap(*args, **kwargs):
+        maps.append(mmap_cls(*args, **kwargs))
+        return maps[-1]
+
+    monkeypatch.setattr(mmap, 'mmap', _mmap)
+    with open(mapped_path, 'wb') as f:
+        f.write(b'x' * 100)
+    with pytest.raises(ValueError):
+        MappedAdblockRules(mapped_path)
+    assert len(maps) == 1 and maps[0].closed
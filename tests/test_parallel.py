@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import multiprocessing
+
+import pytest
+
+from adblockparser import AdblockRules, ParallelAdblockRules
+
+if hasattr(multiprocessing, 'get_all_start_methods'):
+    START_METHODS = multiprocessing.get_all_start_methods()
+else:
+    START_METHODS = [None]
+
+RULES = [
+    "||ads.example.com^",
+    "adv",
+    "@@advice.$~script",
+    "/banner/*/img^$third-party",
+    "@@||example.net^$domain=example.org",
+]
+
+URLS = [
+    "http://ads.example.com/foo.gif",
+    "http://example.com/advice.html",
+    "http://example.com/advert.html",
+    "http://example.com/banner/foo/img",
+    "http://example.net/advert.html",
+    "http://example.com/",
+] * 20
+
+OPTIONS = [
+    {'script': False, 'third-party': True, 'domain': 'example.org'},
+    {'script': True, 'third-party': False, 'domain': 'example.com'},
+    {},
+] * 40
+
+
+@pytest.mark.parametrize('start_method', START_METHODS)
+def test_parallel_matches_sequential(start_method):
+    rules = AdblockRules(RULES)
+    parallel = ParallelAdblockRules(rules, processes=2, chunksize=7,
+                                    start_method=start_method)
+    with parallel:
+        assert parallel.should_block_many(URLS, OPTIONS) == \
+            rules.should_block_many(URLS, OPTIONS)
+        assert parallel.should_block_many(URLS, {'script': False}) == \
+            rules.should_block_many(URLS, {'script': False})
+        assert parallel.should_block_many(iter(URLS)) == \
+            rules.should_block_many(URLS)
+        assert parallel.should_block_many([]) == []
+
+
+def test_parallel_length_mismatch():
+    with ParallelAdblockRules(RULES, processes=1) as rules:
+        with pytest.raises(ValueError):
+            rules.should_block_many(URLS, OPTIONS[:-1])
+
+
+def test_parallel_rule_arguments():
+    with ParallelAdblockRules(RULES, processes=1, supported_options=[]) as rules:
+        assert rules.should_block("http://example.com/advice.html", {'script': False})
+        assert rules.should_block_many(
+            ["http://example.com/advice.html"], {'script': False}
+        ) == [True]
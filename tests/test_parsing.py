@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
-from adblockparser import AdblockRules, AdblockRule, AdblockParsingError
+from adblockparser import (
+    AdblockRules, AdblockRule, AdblockParsingError, RequestOptions, Request
+)
 
 import pytest
 
@@ -262,12 +264,70 @@ def test_rules_with_options(rules, results, use_re2):
         assert rules.should_block(url, params) == should_block
 
 
+@pytest.mark.parametrize(('rules', 'results'), MULTIRULES_WITH_OPTIONS_TESTS.items())
+def test_match(rules, results):
+    rules = AdblockRules(rules)
+    for url, params, should_block in results:
+        result = rules.match(url, params)
+        assert result.blocked == bool(result) == should_block
+        if result.rule is not None:
+            assert result.rule.match_url(url, params)
+        if result.exception is not None:
+            assert result.exception.match_url(url, params)
+
+
+@pytest.mark.parametrize(('rule_text', 'results'), RULES_WITH_OPTIONS_TESTS.items())
+def test_match_rule_with_options(rule_text, results):
+    rules = AdblockRules([rule_text])
+    for url, params, match in results:
+        result = rules.match(url, params)
+        assert result.blocked == match
+        assert result.rule is (rules.rules[0] if match else None)
+        assert result.exception is None
+
+
+def test_match_exception():
+    rules = AdblockRules([
+        "||ads.example.com^",
+        "/banner/*/img^$image",
+        "@@||ads.example.com/notbanner^",
+        "@@/img^$image,domain=example.org",
+    ], shard_size=1)
+    ads, banner, notbanner, img = rules.rules
+
+    result = rules.match("http://ads.example.com/notbanner")
+    assert (result.blocked, result.rule, result.exception) == (False, ads, notbanner)
+
+    url = "http://example.com/banner/foo/img"
+    result = rules.match(url, {'image': True, 'domain': 'www.example.org'})
+    assert (result.blocked, result.rule, result.exception) == (False, banner, img)
+    result = rules.match(url, {'image': True, 'domain': 'example.net'})
+    assert (result.blocked, result.rule, result.exception) == (True, banner, None)
+
+    result = rules.match("http://example.com/")
+    assert (result.blocked, result.rule, result.exception) == (False, None, None)
+    assert not result
+
+
 def test_regex_rules():
     rules = AdblockRules(["/banner\d+/"])
     assert rules.should_block("banner123")
     assert not rules.should_block("banners")
 
 
+@pytest.mark.parametrize(('rule_text', 'regex'), [
+    ("*ad*", "ad"),
+    ("/ads/**/img", "/ads/.*/img"),
+    ("*", ".*"),
+    ("|*ad", "^.*ad"),
+    ("ad*|", "ad.*$"),
+    ("*/ad/*", ".*/ad/.*"),
+    ("ad^", r"ad(?:[^\w\-.%]|$)"),
+])
+def test_rule_to_regex_wildcards(rule_text, regex):
+    assert AdblockRule.rule_to_regex(rule_text) == regex
+
+
 def test_rules_supported_options():
     rules = AdblockRules(["adv", "@@advice.$~script"])
     assert not rules.should_block("http://example.com/advice.html", {'script': False})
@@ -292,3 +352,321 @@ def test_empty_rules():
 def test_empty_regexp_rules():
     with pytest.raises(AdblockParsingError):
         AdblockRules(['adv', '/', '//'])
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_empty_regexp_rules_with_options(lazy):
+    # an empty regex matches all URLs, like an empty pattern
+    for rule_text in ["//$script", "$script"]:
+        rules = AdblockRules([rule_text], lazy=lazy)
+        assert rules.should_block("http://example.com/x.js", {'script': True})
+        assert not rules.should_block("http://example.com/x.js", {'script': False})
+        assert rules.match("http://example.com/x.js", {'script': True}) is not None
+
+    rules = AdblockRules(["//$domain=example.com", "//$domain=~example.org"],
+                         lazy=lazy)
+    assert rules.should_block("http://example.com/x.js", {'domain': 'example.com'})
+    assert rules.should_block("http://example.com/x.js", {'domain': 'example.net'})
+    assert not rules.should_block("http://example.com/x.js", {'domain': 'example.org'})
+
+
+@pytest.mark.parametrize(('rule_text', 'results'), RULES_WITH_OPTIONS_TESTS.items())
+def test_should_block_many(rule_text, results):
+    rules = AdblockRules([rule_text])
+    urls = [url for url, params, match in results]
+    options = [params for url, params, match in results]
+    expected = [match for url, params, match in results]
+    assert rules.should_block_many(urls, options) == expected
+    assert rules.should_block_many(iter(urls), iter(options)) == expected
+
+
+def test_should_block_many_shared_options():
+    rules = AdblockRules(["adv", "@@advice.$~script"])
+    urls = ["http://example.com/advice.html", "http://example.com/advert.html"]
+    assert rules.should_block_many(urls) == [True, True]
+    assert rules.should_block_many(urls, {'script': False}) == [False, True]
+    assert rules.should_block_many(urls, {'script': True}) == [True, True]
+    assert rules.should_block_many([]) == []
+
+
+def test_should_block_many_length_mismatch():
+    rules = AdblockRules(["adv"])
+    urls = ["http://example.com/adv", "http://example.com/", "http://example.com/x"]
+    with pytest.raises(ValueError):
+        rules.should_block_many(urls, [{}, {}])
+    with pytest.raises(ValueError):
+        rules.should_block_many(urls[:1], iter([{}, {}]))
+
+
+def test_should_block_many_unhashable_options():
+    rules = AdblockRules(["adv$script"])
+    assert rules.should_block_many(
+        ["http://example.com/adv", "http://example.com/"],
+        [{'script': True, 'extra': []}, {'script': True, 'extra': []}],
+    ) == [True, False]
+
+
+@pytest.mark.parametrize('min_urls', [1, AdblockRules.BATCH_INDEX_MIN_URLS])
+def test_should_block_many_repeated_options(min_urls):
+    rules = AdblockRules([
+        "adv$script",
+        "||example.com/Banner$script",
+        "@@advice.$script,domain=example.com",
+        "@@|http://example.net/adv$~third-party",
+        "/Banner$third-party",
+        "/banner$domain=~example.net",
+        "@@/banner$script,domain=~example.com",
+    ])
+    urls = [
+        "http://example.com/advice.html",
+        "http://example.com/advert.html",
+        "http://example.net/advice.html",
+        "http://example.com/Banner",
+        "http://example.com/banner",
+    ] * 3
+    rules.BATCH_INDEX_MIN_URLS = min_urls
+    for options in [
+        {'script': True, 'domain': 'example.com', 'third-party': True},
+        {'script': True, 'domain': 'example.net', 'third-party': False},
+        {'script': False, 'domain': 'example.com', 'third-party': True},
+    ]:
+        expected = [rules.should_block(url, options) for url in urls]
+        assert rules.should_block_many(urls, options) == expected
+
+
+@pytest.mark.parametrize('min_urls', [1, AdblockRules.BATCH_INDEX_MIN_URLS])
+def test_should_block_many_empty_regexp_rules(min_urls):
+    urls = ["http://example.com/x.js", "http://example.com/y", "http://example.org/"]
+    for rule_text, options in [
+        ("//$domain=example.com", {'domain': 'example.com'}),
+        ("//$script", {'script': True}),
+    ]:
+        rules = AdblockRules([rule_text])
+        rules.BATCH_INDEX_MIN_URLS = min_urls
+        assert rules.should_block_many(urls, options) == [True] * 3
+    assert AdblockRules(["//"]).should_block_many(urls) == [False] * 3
+
+
+def test_request_options():
+    rules = AdblockRules([
+        "adv$script",
+        "banner$~script,~third-party",
+        "@@advice.$script,domain=~example.net",
+    ])
+    for params in [
+        {'script': True, 'domain': 'example.com'},
+        {'script': False, 'third-party': False},
+        {'script': True, 'domain': 'example.net', 'third-party': True},
+        {'script': 1, 'third-party': 0},
+        {'script': None, 'third-party': None},
+        {},
+    ]:
+        request = RequestOptions(params)
+        for url in ["http://example.com/advert.js",
+                    "http://example.com/advice.js",
+                    "http://example.com/banner.js"]:
+            assert rules.should_block(url, request) == rules.should_block(url, params)
+
+
+def test_request():
+    rules = AdblockRules([
+        "||ads.example.com^",
+        "adv$script",
+        "@@advice.$script,domain=example.com",
+        "banner$domain=example.com|~foo.example.com",
+    ])
+    for url in ["http://ads.example.com/", "http://example.com/advert.js",
+                "http://example.com/advice.js", "http://example.com/banner"]:
+        for options in [{}, {'script': True, 'domain': 'www.example.com'},
+                        {'script': False, 'domain': 'foo.example.com'}]:
+            expected = rules.should_block(url, options)
+            request = Request(url, options)
+            assert rules.should_block(request) == expected
+            assert rules.should_block(request) == expected
+            assert rules.should_block(Request(url, RequestOptions(options))) == expected
+            for rule in rules.rules:
+                if rule.matching_supported(options):
+                    assert rule.match_url(request) == rule.match_url(url, options)
+
+
+def test_request_attributes():
+    request = Request("https://user@WWW.Example.com:8080/ads?x=1",
+                      {'domain': 'a.b.example.org'})
+    assert request.host == 'www.example.com'
+    assert request.domain_variants == ('a.b.example.org', 'b.example.org',
+                                       'example.org')
+    assert 'example' in request.tokens
+    assert 'Example.com' in request.hosts
+    assert Request("/relative/url").host == ''
+    assert Request("http://example.com").domain_variants == ()
+
+
+def test_rules_with_same_options_are_grouped():
+    rules = AdblockRules([
+        "adv$script,~third-party",
+        r"/banner\d+/$~third-party,script",
+        "$script,~third-party,websocket",
+        "track$popup,image",
+        "ads$script,domain=~example.com",
+    ], supported_options=AdblockRule.BINARY_OPTIONS + ['domain', 'popup'])
+    assert len(rules._blacklist_groups) == 3
+    assert len(rules._blacklist_ungrouped) == 1
+
+    params = {'script': True, 'third-party': False}
+    assert rules.should_block("http://example.com/adv", params)
+    assert rules.should_block("http://example.com/banner12", params)
+    assert not rules.should_block("http://example.com/Adv", params)
+    assert not rules.should_block("http://example.com/adv",
+                                  {'script': True, 'third-party': True})
+    assert rules.should_block("http://example.com/anything",
+                              dict(params, websocket=True))
+    assert rules.should_block("http://example.net/ads",
+                              {'script': True, 'domain': 'example.net'})
+    assert not rules.should_block("http://example.com/ads",
+                                  {'script': True, 'domain': 'example.com'})
+    assert rules.should_block("http://example.com/track",
+                              {'image': True, 'popup': True})
+
+
+def test_rules_with_domain_exclusions_are_grouped():
+    rules = AdblockRules([
+        "/banner/$domain=~example.com",
+        "/banner/*.gif$domain=~example.org",
+        "||ads.example.net^$domain=~example.com|~example.org",
+        "$domain=~example.org|~example.net|~example.com",
+        "/track/$domain=example.com|~sub.example.com",
+    ])
+    assert len(rules._blacklist_groups) == 1
+    assert not rules._blacklist_ungrouped
+    assert len(rules._blacklist_groups[0].excluded) == 3
+
+    def check(url, domain):
+        result = rules.match(url, {'domain': domain})
+        assert result.blocked == rules.should_block(url, {'domain': domain})
+        return result.rule and result.rule.raw_rule_text
+
+    assert check("http://example.com/banner/1.gif", "www.example.com") == \
+        "/banner/*.gif$domain=~example.org"
+    assert check("http://example.com/banner/1.gif", "www.example.org") == \
+        "/banner/$domain=~example.com"
+    assert check("http://example.com/banner/1.png", "example.com") is None
+    assert check("http://ads.example.net/", "example.org") is None
+    assert check("http://ads.example.net/", "example.net") == \
+        "||ads.example.net^$domain=~example.com|~example.org"
+    assert check("http://example.com/", "example.de") == \
+        "$domain=~example.org|~example.net|~example.com"
+    assert check("http://example.com/track/", "sub.example.com") is None
+    assert check("http://example.com/track/", "example.com") == \
+        "/track/$domain=example.com|~sub.example.com"
+
+
+def test_rules_with_domain_exclusions_rest_of_group():
+    rules = AdblockRules(
+        ["/ad%d/$domain=~site%d.com" % (i, i) for i in range(50)] +
+        ["/banner$domain=~example.com", "/banner/top$domain=~example.org"]
+    )
+    group = rules._blacklist_groups[0]
+    options = {'domain': 'www.example.com'}
+    # /banner matches, but it doesn't apply to example.com
+    assert not rules.should_block("http://example.com/banner", options)
+    assert rules.match("http://example.com/banner/top", options).rule.raw_rule_text == \
+        "/banner/top$domain=~example.org"
+    assert not rules.should_block("http://example.com/ad7/", {'domain': 'site7.com'})
+    assert rules.should_block("http://example.com/ad7/", {'domain': 'site8.com'})
+    # groups without excluded rules are built once per set of rules
+    rest_sizes = [len(group._rest_groups.get(key).rules)
+                  for key in group._rest_groups.keys()]
+    assert sorted(rest_sizes) == [51, 51]
+
+
+def test_rules_unsupported_options_raise():
+    rules = AdblockRules(["adv$script", "ads$popup"], skip_unsupported_rules=False,
+                         supported_options=['script', 'popup'])
+    assert rules.should_block("http://example.com/adv", {'script': True, 'popup': False})
+    with pytest.raises(ValueError):
+        rules.should_block("http://example.com/adv", {'popup': False})
+    with pytest.raises(ValueError):
+        rules.should_block("http://example.com/ads", {'script': False})
+
+
+@pytest.mark.parametrize(('rule_text', 'results'), RULES_WITH_OPTIONS_TESTS.items())
+def test_lazy_rules_with_options(rule_text, results):
+    rules = AdblockRules([rule_text], lazy=True)
+    for url, params, match in results:
+        assert rules.should_block(url, params) == match
+
+
+def test_lazy_rules():
+    rules = AdblockRules([
+        "||ads.example.com^",
+        "/banner/*/img^",
+        "adv$script,domain=example.com",
+        "@@advice.$script,domain=example.net",
+    ], lazy=True)
+    assert all(rule._regex is None for rule in rules.rules[2:])
+    assert rules.should_block("http://ads.example.com/foo.gif")
+    assert rules.should_block("http://example.com/banner/foo/img")
+    assert rules.should_block("http://example.com/advice.html",
+                              {'script': True, 'domain': 'example.com'})
+    assert not rules.should_block("http://example.net/advice.html",
+                                  {'script': True, 'domain': 'example.net'})
+    assert rules.rules[2]._regex is not None
+
+    # rules for other domains are not converted
+    rules = AdblockRules(["adv$domain=example.com"], lazy=True)
+    assert not rules.should_block("http://example.net/adv", {'domain': 'example.net'})
+    assert rules.rules[0]._regex is None
+
+
+def test_lazy_empty_regexp_rules():
+    with pytest.raises(AdblockParsingError):
+        AdblockRules(['adv', '/', '//'], lazy=True)
+
+
+@pytest.mark.parametrize('domain_cache_size', [0, 1, 1000])
+@pytest.mark.parametrize(('rules', 'results'), MULTIRULES_WITH_OPTIONS_TESTS.items())
+def test_rules_with_options_domain_cache(rules, results, domain_cache_size):
+    rules = AdblockRules(rules, domain_cache_size=domain_cache_size)
+    for _ in range(2):
+        for url, params, should_block in results:
+            assert rules.should_block(url, params) == should_block
+
+
+def test_domain_cache():
+    rules = AdblockRules([
+        "adv$domain=example.com|~foo.example.com",
+        "banner$script,domain=example.com",
+        "@@advice.$domain=example.com",
+    ], domain_cache_size=2)
+    cache = rules.domain_cache
+    assert rules.should_block("http://example.net/adv", {'domain': 'bar.example.com'})
+    assert not rules.should_block("http://example.net/adv", {'domain': 'foo.example.com'})
+    assert not rules.should_block("http://example.net/adv", {'domain': 'example.net'})
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    assert not rules.should_block("http://example.net/advice.html", {'domain': 'example.net'})
+    assert not rules.should_block("http://example.net/advice.html", {'domain': 'example.com'})
+    assert not rules.should_block("http://example.net/banner",
+                                  {'domain': 'example.com', 'script': False})
+    assert rules.should_block("http://example.net/banner",
+                              {'domain': 'example.com', 'script': True})
+    assert (cache.hits, cache.misses) == (3, 4)
+    assert len(cache) == 2
+
+    # there are no rules which require a domain: cache is not used
+    rules = AdblockRules(["adv$~script"])
+    assert rules.should_block("http://example.net/adv",
+                              {'domain': 'example.com', 'script': False})
+    assert rules.domain_cache.misses == 0
+    assert AdblockRules(["adv"], domain_cache_size=0).domain_cache is None
+
+
+def test_host_rules_with_options():
+    rule_texts = ["||Ads.example.com^$script", "||tracker.example.org^$script"]
+    rules = AdblockRules(rule_texts)
+    for url in ["http://Ads.example.com/x.js", "http://ads.example.com/x.js",
+                "http://tracker.example.org", "http://tracker.example.org.evil/"]:
+        expected = any(AdblockRule(r).match_url(url, {'script': True})
+                       for r in rule_texts)
+        assert rules.should_block(url, {'script': True}) == expected
+        assert not rules.should_block(url, {'script': False})
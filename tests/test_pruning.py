@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pytest
+
+from adblockparser import AdblockRules, AdblockRule
+from adblockparser.pruning import prune_rules
+
+RULES = [
+    "||example.com^",
+    "||ads.example.com^",
+    "||Ads.Example.com^",
+    "||example.com^$third-party",
+    "||ads.example.com^$third-party",
+    "||ads.example.com^$domain=example.org",
+    "||tracker.example.net^$script",
+    "||example.net^$~script",
+    "adv",
+    "*adv*",
+    "|http://adv.example.org/",
+    "/adv/*/img^",
+    "/ADV/",
+    r"/adv\d+/",
+    "-banner-",
+    "-banner-$script",
+    "/ad-banner-728.",
+    "@@||ads.example.com^",
+    "@@||example.com/allowed/",
+    "@@allowed/",
+    "$websocket,domain=example.org",
+    "/ws/$websocket,domain=example.org",
+    "/ws/$websocket,domain=example.net",
+    u"/баннер/",
+    u"/баннер/*/ad",
+]
+
+URLS = [
+    "http://example.com/",
+    "http://ads.example.com/foo.gif",
+    "https://ADS.example.com/allowed/x",
+    "http://tracker.example.net/t.js",
+    "http://example.net/adv",
+    "http://adv.example.org/",
+    "http://example.org/adv/1/img",
+    "http://example.org/adv123/",
+    "http://example.org/static/-banner-.png",
+    "http://example.org/ad-banner-728.gif",
+    "ws://example.org/ws/",
+    "ws://example.net/ws/",
+    u"http://example.org/баннер/1/ad",
+    u"http://example.org/БАННЕР/",
+]
+
+OPTIONS = [
+    None,
+    {'third-party': True, 'script': True, 'websocket': False},
+    {'third-party': False, 'script': False, 'websocket': True,
+     'domain': 'example.org'},
+    {'third-party': True, 'script': False, 'websocket': True,
+     'domain': 'example.net'},
+]
+
+
+def test_prune_rules():
+    rules = [AdblockRule(text) for text in RULES]
+    pruned, stats = prune_rules(rules)
+    assert [r.raw_rule_text for r in rules if r not in pruned] == [
+        "||ads.example.com^",
+        "||Ads.Example.com^",
+        "||ads.example.com^$third-party",
+        "*adv*",
+        "|http://adv.example.org/",
+        "/adv/*/img^",
+        "/ad-banner-728.",
+        "@@||example.com/allowed/",
+        "/ws/$websocket,domain=example.org",
+    ]
+    assert stats == {'duplicates': 2, 'subsumed': 7}
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_pruned_rules_match_the_same_urls(options):
+    rules = AdblockRules(RULES)
+    pruned = AdblockRules(RULES, prune=True)
+    assert len(pruned.rules) == len(rules.rules) - 9
+    assert pruned.pruning_stats == {'duplicates': 2, 'subsumed': 7}
+    for url in URLS:
+        assert pruned.should_block(url, options) == rules.should_block(url, options), url
+
+
+def test_no_pruning_by_default():
+    rules = AdblockRules(["adv", "adv"])
+    assert len(rules.rules) == 2
+    assert rules.pruning_stats == {'duplicates': 0, 'subsumed': 0}
+
+
+def test_remove_duplicate_of_pruned_rule():
+    old = ["||ads.example.com^", "adv", "||ads.example.com^"]
+    rules = AdblockRules(old, prune=True)
+    assert rules.pruning_stats == {'duplicates': 1, 'subsumed': 0}
+    rules.apply_diff(old, old[:2])
+    assert rules.should_block("http://ads.example.com/foo.gif")
+    assert rules.pruned_rules == []
+
+    rules.remove_rules(["||ads.example.com^"])
+    assert not rules.should_block("http://ads.example.com/foo.gif")
+
+
+def test_remove_rule_restores_pruned_rules():
+    rules = AdblockRules([
+        "||example.com^",
+        "||ads.example.com^",
+        "||ads.example.com^",
+        "||example.com^$script",
+        "||ads.example.com^$script",
+    ], prune=True)
+    assert len(rules.rules) == 2
+    rules.remove_rules(["||example.com^", "||example.com^$script"])
+    assert not rules.should_block("http://example.com/")
+    assert rules.should_block("http://ads.example.com/foo.gif")
+    assert rules.should_block("http://ads.example.com/foo.js", {'script': True})
+    assert [rule.raw_rule_text for rule in rules.rules] == [
+        "||ads.example.com^", "||ads.example.com^$script"]
+    assert [rule.raw_rule_text for rule in rules.pruned_rules] == [
+        "||ads.example.com^"]
+
+
+def test_save_load_keeps_pruned_rules(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    AdblockRules(["||example.com^", "||ads.example.com^"], prune=True).save(path)
+    rules = AdblockRules.load(path)
+    rules.remove_rules(["||example.com^"])
+    assert rules.should_block("http://ads.example.com/foo.gif")
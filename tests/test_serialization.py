@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pickle
+import zlib
+
+import pytest
+
+from adblockparser import AdblockRules, AdblockCacheError
+from adblockparser import serialization
+
+RULES = [
+    "[Adblock Plus 2.0]",
+    "! comment",
+    "||ads.example.com^",
+    "|http://example.com/|",
+    "/banner/*/img^",
+    "adv",
+    "@@advice.$~script",
+    r"/banner\d+/",
+    "*/ads/*",
+    "||example.com^$third-party",
+    "adv$domain=example.com|~foo.example.com",
+    "@@||example.net^$domain=example.org",
+    "###ADSLOT_SKYSCRAPER",
+]
+
+URLS = [
+    "http://ads.example.com/foo.gif",
+    "http://example.com/",
+    "http://example.com/banner/foo/img",
+    "http://example.com/advice.html",
+    "http://example.com/advert.html",
+    "http://example.org/banner123",
+    "http://example.org/x/ads/y",
+    "http://example.net/adv",
+]
+
+OPTIONS = [
+    {},
+    {'script': False},
+    {'third-party': True, 'domain': 'example.com'},
+    {'third-party': False, 'domain': 'foo.example.com'},
+    {'domain': 'example.org'},
+]
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    rules = AdblockRules(RULES)
+    rules.save(path)
+    loaded = AdblockRules.load(path)
+
+    assert [r.raw_rule_text for r in loaded.rules] == \
+        [r.raw_rule_text for r in rules.rules]
+    assert [r.regex for r in loaded.rules] == [r.regex for r in rules.rules]
+    assert len(loaded.blacklist_index) == len(rules.blacklist_index)
+    assert sorted(loaded.whitelist_require_domain) == \
+        sorted(rules.whitelist_require_domain)
+    for options in OPTIONS:
+        for url in URLS:
+            assert loaded.should_block(url, options) == rules.should_block(url, options)
+    assert loaded.get_css_selectors("example.com") == ('#ADSLOT_SKYSCRAPER',)
+
+
+def test_save_load_lazy(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    rules = AdblockRules(RULES, lazy=True)
+    rules.save(path)
+    loaded = AdblockRules.load(path)
+    assert loaded.lazy
+
+    eager_rules = AdblockRules(RULES)
+    assert [r.regex for r in loaded.rules] == [r.regex for r in eager_rules.rules]
+    for options in OPTIONS:
+        for url in URLS:
+            assert loaded.should_block(url, options) == \
+                eager_rules.should_block(url, options)
+
+
+def test_load_keeps_settings(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    rules = AdblockRules(["adv", "@@advice.$~script"], supported_options=[])
+    rules.save(path)
+    loaded = AdblockRules.load(path)
+    assert loaded.supported_options == []
+    assert loaded.should_block("http://example.com/advice.html", {'script': False})
+
+
+def test_stale_check(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    AdblockRules(RULES).save(path, source=RULES)
+
+    assert AdblockRules.load(path, source=RULES).should_block("http://example.com/adv")
+    with pytest.raises(AdblockCacheError):
+        AdblockRules.load(path, source=RULES + ["new-rule"])
+
+
+def test_invalid_files(tmpdir):
+    path = tmpdir.join('rules.bin')
+    path.write_binary(b'foo')
+    with pytest.raises(AdblockCacheError):
+        AdblockRules.load(str(path))
+
+    AdblockRules(RULES).save(str(path))
+    data = path.read_binary()
+    header_size = len(serialization.MAGIC) + 3
+
+    path.write_binary(serialization.MAGIC + b'\xff\xff\x00' + data[header_size:])
+    with pytest.raises(AdblockCacheError):
+        AdblockRules.load(str(path))
+
+    path.write_binary(data[:header_size] + b'garbage')
+    with pytest.raises(AdblockCacheError):
+        AdblockRules.load(str(path))
+
+    for size in [len(serialization.MAGIC), header_size - 1, header_size + 1]:
+        path.write_binary(data[:size])
+        with pytest.raises(AdblockCacheError):
+            AdblockRules.load(str(path))
+
+    payload = zlib.compress(pickle.dumps({'rules': None}, protocol=2))
+    path.write_binary(data[:header_size] + payload)
+    with pytest.raises(AdblockCacheError):
+        AdblockRules.load(str(path))
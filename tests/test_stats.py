@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import json
+
+from adblockparser import AdblockRules
+
+RULES = [
+    "||ads.example.com^",
+    "@@||ads.example.com/notbanner^",
+    "/banner/$script",
+    "/track.$script,domain=example.org",
+    "/track.$image,domain=~example.org",
+    "@@/banner/$image,domain=example.net",
+    "/popup.$popup",
+]
+
+REQUESTS = [
+    ("http://ads.example.com/notbanner", None),
+    ("http://ads.example.com/banner", None),
+    ("http://example.com/banner/", {'script': True, 'image': False}),
+    ("http://example.com/banner/", {'script': True, 'image': True,
+                                    'domain': 'www.example.net'}),
+    ("http://example.com/track.gif", {'script': False, 'image': True,
+                                      'domain': 'example.com'}),
+    ("http://example.com/track.js", {'script': True, 'image': False,
+                                     'domain': 'example.org'}),
+    ("http://example.com/", {'script': True, 'image': True}),
+]
+
+
+def test_stats_disabled_by_default():
+    rules = AdblockRules(RULES)
+    assert rules.match_stats is None
+    assert '_should_block' not in vars(rules)
+
+
+def test_stats():
+    rules = AdblockRules(RULES)
+    instrumented = AdblockRules(RULES, collect_stats=True)
+    for url, options in REQUESTS:
+        assert instrumented.should_block(url, options) == \
+            rules.should_block(url, options), (url, options)
+
+    stats = instrumented.match_stats.snapshot()
+    assert stats['calls'] == len(REQUESTS)
+    assert stats['blocked'] == 4
+    assert stats['exits'] == {
+        'whitelist/general': 1,
+        'whitelist/domain': 1,
+        'blacklist/general': 1,
+        'blacklist/options': 2,
+        'blacklist/domain': 1,
+        'not_matched': 1,
+    }
+    assert set(stats['stage_times']) >= {
+        'domain_rules', 'whitelist/general', 'blacklist/general',
+        'blacklist/options', 'blacklist/domain',
+    }
+    assert all(seconds >= 0 for seconds in stats['stage_times'].values())
+    assert stats['candidates']['total'] > 0
+    assert stats['candidates']['max'] >= stats['candidates']['mean'] > 0
+    # "/popup.$popup" is skipped: 'popup' option is never passed
+    assert stats['skipped_rules']['unsupported'] > 0
+    assert stats['skipped_rules']['options'] > 0
+
+    hits = dict((item['rule'], item['hits']) for item in stats['top_rules'])
+    assert hits == {
+        "@@||ads.example.com/notbanner^": 1,
+        "@@/banner/$image,domain=example.net": 1,
+        "||ads.example.com^": 1,
+        "/banner/$script": 1,
+        "/track.$image,domain=~example.org": 1,
+        "/track.$script,domain=example.org": 1,
+    }
+    # all rules are in option groups; none is matched one-by-one
+    assert stats['slowest_rules'] == []
+
+    assert json.loads(json.dumps(stats)) == stats
+
+
+def test_slowest_rules():
+    rules = AdblockRules(["/popup.$popup", "/banner/$script"], collect_stats=True,
+                         supported_options=['popup', 'script'])
+    assert rules.should_block("http://example.com/popup.html", {'popup': True})
+    assert not rules.should_block("http://example.com/", {'popup': True, 'script': True})
+    stats = rules.match_stats.snapshot()
+    # rules with options without bitmasks are matched one-by-one
+    assert [item['rule'] for item in stats['slowest_rules']] == ["/popup.$popup"]
+    assert stats['slowest_rules'][0]['calls'] == 2
+
+
+def test_stats_reset():
+    rules = AdblockRules(RULES, collect_stats=True)
+    rules.should_block("http://ads.example.com/banner")
+    rules.match_stats.reset()
+    stats = rules.match_stats.snapshot(top=1)
+    assert stats['calls'] == 0
+    assert stats['exits'] == {}
+    assert stats['candidates']['mean'] == 0
+    assert stats['top_rules'] == []
+
+
+def test_cached_results_are_not_counted():
+    rules = AdblockRules(RULES, collect_stats=True, result_cache_size=10)
+    for _ in range(3):
+        assert rules.should_block("http://ads.example.com/banner")
+    assert rules.match_stats.snapshot()['calls'] == 1
+    assert rules.result_cache.hits == 2
+
+
+def test_stats_setting_is_saved(tmpdir):
+    path = str(tmpdir.join('rules.bin'))
+    AdblockRules(RULES, collect_stats=True).save(path)
+    rules = AdblockRules.load(path)
+    assert rules.should_block("http://ads.example.com/banner")
+    assert rules.match_stats.snapshot()['calls'] == 1
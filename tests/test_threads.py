@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import random
+import sys
+import threading
+
+import pytest
+
+from adblockparser import AdblockRules, Request
+from adblockparser.parser import _NOT_COMPILED
+
+WORDS = ['ad', 'adv', 'banner', 'track', 'pixel', 'promo', 'img', 'static', 'news']
+SITES = ['example.com', 'example.org', 'news.example.net', 'shop.example.de']
+
+
+def make_rules(rnd, count):
+    rules = []
+    for i in range(count):
+        word = rnd.choice(WORDS)
+        rules.append(rnd.choice([
+            "||%s%d.example.com^" % (word, i),
+            "/%s%d/" % (word, i),
+            "/%s/*/%d^" % (word, i),
+            "-%s-%d." % (word, i),
+            r"/%s\d+x%d/" % (word, i),
+            "/%s%d.$script,third-party" % (word, i),
+            "/%s%d.$image,domain=%s" % (word, i, rnd.choice(SITES)),
+            "/%s%d.$domain=~%s" % (word, i, rnd.choice(SITES)),
+            "@@/%s%d/$image" % (word, i),
+            "@@||%s%d.example.com/ok^$domain=%s" % (word, i, rnd.choice(SITES)),
+        ]))
+    return rules
+
+
+def make_requests(rnd, count, rule_count):
+    requests = []
+    for _ in range(count):
+        word, i = rnd.choice(WORDS), rnd.randint(0, rule_count)
+        url = rnd.choice([
+            "http://%s%d.example.com/ok/" % (word, i),
+            "http://example.com/%s%d/x.gif" % (word, i),
+            "http://example.com/%s/foo/%d" % (word, i),
+            "http://example.com/a-%s-%d.js" % (word, i),
+            "http://example.com/%s123x%d/" % (word, i),
+            "http://example.com/%s%d.js" % (word, i),
+            u"http://example.com/%s%d/\xfc" % (word, i),
+        ])
+        options = {
+            'script': rnd.random() < 0.5,
+            'image': rnd.random() < 0.5,
+            'third-party': rnd.random() < 0.5,
+            'domain': rnd.choice(SITES),
+        }
+        requests.append((url, rnd.choice([None, options])))
+    return requests
+
+
+def test_precompile():
+    rules = AdblockRules(make_rules(random.Random(1), 300), lazy=True,
+                         thread_safe=True)
+    for index in [rules.blacklist_index, rules.whitelist_index]:
+        assert set(index._bucket_re) == set(index.buckets)
+    assert all(rule.regex_re is not None for rule in rules.rules if rule.options)
+
+    rules.add_rules(["/added/$script"])
+    assert all(rule.regex_re is not None for rule in rules.rules if rule.options)
+
+
+def test_precompile_exclusion_groups():
+    rules = AdblockRules([
+        "/banner$domain=~example.com",
+        "/banner/top$domain=~example.org|~news.example.com",
+        "/ads$domain=~example.com",
+    ], thread_safe=True)
+    group = rules._blacklist_groups[0]
+    rest_groups = dict(group._rest_groups)
+    assert len(rest_groups) == 3
+    for domain in SITES + ['news.example.com', 'www.news.example.com']:
+        rules.should_block("http://example.com/banner/top", {'domain': domain})
+        rules.should_block("http://example.com/ads", {'domain': domain})
+    assert group._rest_groups == rest_groups
+    assert all(rest._regex_re is not _NOT_COMPILED for rest in rest_groups.values())
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_concurrent_should_block(lazy):
+    rnd = random.Random(2017)
+    rule_texts = make_rules(rnd, 1000)
+    requests = make_requests(rnd, 500, 1000)
+    sequential = AdblockRules(rule_texts)
+    expected = [sequential.should_block(url, options) for url, options in requests]
+    assert any(expected) and not all(expected)
+
+    rules = AdblockRules(rule_texts, lazy=lazy, thread_safe=True,
+                         domain_cache_size=2, result_cache_size=100)
+    start = threading.Event()
+    errors = []
+
+    def worker(seed):
+        order = list(range(len(requests)))
+        random.Random(seed).shuffle(order)
+        start.wait()
+        try:
+            for i in order:
+                url, options = requests[i]
+                if seed % 2:
+                    url = Request(url, options, rules.rule_cls.OPTION_BITS)
+                if rules.should_block(url, options) != expected[i]:
+                    errors.append(requests[i])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(6)]
+    for thread in threads:
+        thread.start()
+    # switch threads more often to make races more likely
+    switch_interval = getattr(sys, 'getswitchinterval', lambda: None)()
+    if switch_interval is not None:
+        sys.setswitchinterval(1e-6)
+    try:
+        start.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+    assert errors == []
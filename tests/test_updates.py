@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import pytest
+
+from adblockparser import AdblockRules, AdblockRule
+
+OLD_RULES = [
+    "! Title: test list",
+    "||ads.example.com^",
+    "|http://example.com/|",
+    "/banner/*/img^",
+    "adv",
+    "@@advice.$~script",
+    r"/banner\d+/",
+    "*/ads/*",
+    "||example.com^$third-party",
+    "adv$domain=example.com|~foo.example.com",
+    "@@||example.net^$domain=example.org",
+]
+
+NEW_RULES = [
+    "! Title: test list",
+    "||ads.example.com^",
+    "/banner/*/img^",
+    "adv",
+    "adv",
+    "@@advice.$~script,domain=example.com",
+    "*/ads/*",
+    "||example.com^$~third-party",
+    "track$domain=example.com|example.org",
+    "@@||example.net^$domain=example.org",
+    "$websocket,domain=example.org",
+    "||tracker.example.org^$script",
+]
+
+URLS = [
+    "http://ads.example.com/foo.gif",
+    "http://example.com/",
+    "http://example.com/banner/foo/img",
+    "http://example.com/advice.html",
+    "http://example.com/advert.html",
+    "http://example.org/banner123",
+    "http://example.org/x/ads/y",
+    "http://example.net/adv",
+    "http://example.net/track.gif",
+    "http://tracker.example.org/t.js",
+]
+
+OPTIONS = [
+    {},
+    {'script': False},
+    {'script': True, 'third-party': True, 'domain': 'example.com'},
+    {'third-party': False, 'domain': 'foo.example.com'},
+    {'domain': 'example.org', 'websocket': True},
+    {'domain': 'example.org', 'websocket': False},
+]
+
+
+def assert_same_results(rules, expected_rules):
+    for options in OPTIONS:
+        for url in URLS:
+            assert rules.should_block(url, options) == \
+                expected_rules.should_block(url, options), (url, options)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_apply_diff(lazy):
+    rules = AdblockRules(OLD_RULES, lazy=lazy)
+    assert_same_results(rules, AdblockRules(OLD_RULES))
+
+    added, removed = rules.apply_diff(OLD_RULES, NEW_RULES)
+    assert sorted(r.raw_rule_text for r in removed) == sorted([
+        "|http://example.com/|",
+        "@@advice.$~script",
+        r"/banner\d+/",
+        "||example.com^$third-party",
+        "adv$domain=example.com|~foo.example.com",
+    ])
+    assert len(added) == 6
+    assert_same_results(rules, AdblockRules(NEW_RULES))
+    assert len(rules.rules) == len(AdblockRules(NEW_RULES).rules)
+
+    rules.apply_diff("\n".join(NEW_RULES), "\n".join(OLD_RULES))
+    assert_same_results(rules, AdblockRules(OLD_RULES))
+
+
+def test_add_remove_rules():
+    rules = AdblockRules([])
+    assert not rules.should_block("http://example.com/adv")
+    rule = AdblockRule("adv")
+    assert rules.add_rules([rule, "@@adv$domain=example.com"])[0] is rule
+    assert rules.should_block("http://example.com/adv")
+    assert not rules.should_block("http://example.com/adv", {'domain': 'example.com'})
+
+    assert rules.remove_rules([rule, rule]) == [rule]
+    assert not rules.should_block("http://example.com/adv")
+    assert rules.remove_rules(["adv", "! comment"]) == []
+    assert [r.raw_rule_text for r in rules.rules] == ["@@adv$domain=example.com"]
+    assert rules.whitelist_require_domain
+
+
+def test_updates_clear_caches():
+    rules = AdblockRules(["adv$domain=example.com"], result_cache_size=10)
+    options = {'domain': 'example.com'}
+    assert rules.should_block("http://example.com/adv", options)
+    rules.add_rules(["@@adv$domain=example.com"])
+    assert not rules.should_block("http://example.com/adv", options)
+    rules.remove_rules(["@@adv$domain=example.com"])
+    assert rules.should_block("http://example.com/adv", options)
+
+
+def test_updates_keep_unaffected_groups_and_caches():
+    rules = AdblockRules([
+        "adv$script",
+        "banner$image",
+        "adv$domain=example.com",
+        "track$domain=example.org",
+    ])
+    script_group, image_group = rules._blacklist_groups
+    for domain in ["example.com", "foo.example.com", "example.org"]:
+        rules.should_block("http://example.com/x", {
+            'domain': domain, 'script': False, 'image': False})
+    assert len(rules.domain_cache) == 3
+
+    rules.add_rules(["ads", "@@adv$domain=example.com"])
+    assert rules._blacklist_groups == [script_group, image_group]
+    assert sorted(rules.domain_cache.keys()) == ["example.org"]
+
+    rules.add_rules(["popup$script"])
+    assert rules._blacklist_groups[1] is image_group
+    assert rules._blacklist_groups[0] is not script_group
+    assert rules.should_block("http://example.com/popup", {'script': True})
+
+    rules.remove_rules(["banner$image"])
+    assert len(rules._blacklist_groups) == 1
+    assert not rules.should_block("http://example.com/banner", {'image': True})
+    assert sorted(rules.domain_cache.keys()) == ["example.org"]
+
+
+def test_add_invalid_rule():
+    rules = AdblockRules(["adv", "/banner[0-9]/"])
+    with pytest.raises(Exception):
+        rules.add_rules(["track", "/ad[/"])
+    assert len(rules.rules) == 2
+    assert not rules.should_block("http://example.com/track")
+    assert rules.should_block("http://example.com/banner1")